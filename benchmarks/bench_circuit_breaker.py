@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+"""
+Google Sheets call latency during an outage, with and without the circuit breaker.
+
+A fake worksheet answers every call with a 503 after --latency seconds. Raw
+calls pay the full latency every time. Guarded calls pay it until the breaker
+trips, then fail in microseconds. After the cooldown one half-open probe
+succeeds against the recovered fake, and the breaker closes again.
+
+Usage: python benchmarks/bench_circuit_breaker.py [--calls 10] [--latency 0.5]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_gspread import FakeWorksheet  # noqa: E402
+
+
+def timed(fn):
+    start = time.perf_counter()
+    try:
+        fn()
+        outcome = 'ok'
+    except Exception as e:
+        outcome = type(e).__name__
+    return (time.perf_counter() - start) * 1000, outcome
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=10)
+    parser.add_argument('--latency', type=float, default=0.5, help='seconds before each fake 503')
+    parser.add_argument('--cooldown', type=float, default=2.0)
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp(prefix='bench-breaker-'))
+    os.environ.setdefault('DERIVATIVE_PREBUILD', 'false')
+    import server
+
+    worksheet = FakeWorksheet(latency=args.latency, error_rate=1.0, error_status=503)
+    breaker = server.CircuitBreaker(threshold=3, cooldown=args.cooldown, deadline=args.latency * 4, retries=1)
+    guarded = server.GuardedWorksheet(worksheet, breaker)
+
+    print(f"{'call':>4} | {'raw ms':>8} | {'guarded ms':>10} | {'outcome':>16} | breaker")
+    print('-' * 62)
+    for i in range(args.calls):
+        raw_ms, _ = timed(lambda: worksheet.col_values(4))
+        guarded_ms, outcome = timed(lambda: guarded.col_values(4))
+        print(f"{i + 1:>4} | {raw_ms:>8.1f} | {guarded_ms:>10.3f} | {outcome:>16} | {breaker.state}")
+
+    worksheet.error_rate, worksheet.latency = 0.0, 0.01
+    time.sleep(args.cooldown)
+    probe_ms, outcome = timed(lambda: guarded.col_values(4))
+    print(f"\nafter {args.cooldown:g}s cooldown, recovered backend: probe {probe_ms:.1f} ms -> {outcome}, "
+          f"breaker {breaker.state}")
+    print(breaker.stats())
+
+
+if __name__ == '__main__':
+    main()
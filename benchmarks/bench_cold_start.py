@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+"""
+Cold-start time: process start to the first successful GET / response.
+
+Launches `python server.py` on a free port and polls / until it returns 200.
+Use --google-delay to simulate a slow Google response: credentials are faked
+and gspread.authorize sleeps for that many seconds before failing. Boot should
+not wait for it, because Sheets connects in the background.
+
+Usage: python benchmarks/bench_cold_start.py [--runs 5] [--google-delay 8]
+"""
+import argparse
+import base64
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs server.py as __main__ with Google auth replaced by a slow failure
+BOOTSTRAP = """
+import runpy, sys, time
+import gspread
+from google.oauth2 import service_account
+delay = float(sys.argv[1])
+service_account.Credentials.from_service_account_info = classmethod(lambda cls, info, **kwargs: object())
+def slow_authorize(*args, **kwargs):
+    time.sleep(delay)
+    raise gspread.exceptions.GSpreadException('simulated slow Google response')
+gspread.authorize = slow_authorize
+sys.argv = ['server.py']
+runpy.run_path('server.py', run_name='__main__')
+"""
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def time_to_first_response(google_delay, timeout=60):
+    port = free_port()
+    env = dict(os.environ, PORT=str(port), HOST='127.0.0.1', FLASK_ENV='production',
+               DERIVATIVE_PREBUILD='false')
+    if google_delay is not None:
+        env['GOOGLE_CREDENTIALS'] = base64.b64encode(json.dumps({'client_email': 'bench@example.com'}).encode()).decode()
+        command = [sys.executable, '-c', BOOTSTRAP, str(google_delay)]
+    else:
+        command = [sys.executable, 'server.py']
+
+    start = time.perf_counter()
+    process = subprocess.Popen(command, cwd=REPO_ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - start < timeout:
+            try:
+                with urllib.request.urlopen(f'http://127.0.0.1:{port}/', timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - start
+            except (urllib.error.URLError, ConnectionError, socket.timeout):
+                time.sleep(0.01)
+        raise RuntimeError('server did not respond in time')
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--google-delay', type=float, default=None,
+                        help='simulate a Google auth call that takes this many seconds')
+    args = parser.parse_args()
+
+    samples = [time_to_first_response(args.google_delay) for _ in range(args.runs)]
+    label = 'no credentials' if args.google_delay is None else f'google delay {args.google_delay:g}s'
+    print(f"cold start ({label}): median {statistics.median(samples):.3f}s, "
+          f"min {min(samples):.3f}s, max {max(samples):.3f}s over {args.runs} run(s)")
+
+
+if __name__ == '__main__':
+    main()
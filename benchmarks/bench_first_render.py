@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+"""
+Requests and modelled time to first paint / first gallery render, static vs. inline index.html.
+
+Builds / in both INDEX_RENDER_MODE settings and walks the HTML the way a
+browser would: render-blocking stylesheets must arrive before first paint, and
+every script must run (then the loader's /api/gallery-images call, unless the
+manifest is embedded) before the gallery renders. Same-origin sizes are the
+gzip-encoded bytes the server actually sends. Third-party (CDN) files are
+counted as requests but their bytes aren't known offline, so they're left out
+of the byte totals.
+
+The time model is a simple mobile profile: every dependent stage costs one
+RTT plus its bytes over the link, and a first request to a new origin adds
+three RTTs (DNS, TCP, TLS). Defaults follow Lighthouse's simulated mobile
+throttling (150 ms RTT, 1.6 Mbps).
+
+Usage: python benchmarks/bench_first_render.py [--rtt-ms 150] [--kbps 1600]
+"""
+import argparse
+import os
+import re
+import sys
+import tempfile
+import urllib.parse
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STYLESHEET = re.compile(r'''<link\b[^>]*\srel=["']stylesheet["'][^>]*>''')
+SCRIPT = re.compile(r'''<script\b[^>]*\bsrc=["']([^"']+)["'][^>]*>''')
+HREF = re.compile(r'''\bhref=["']([^"']+)["']''')
+
+
+def without_noscript(html):
+    return re.sub(r'<noscript>.*?</noscript>', '', html, flags=re.S)
+
+
+def transfer_size(client, url):
+    """gzip-encoded bytes for a same-origin URL, or None for a third-party one."""
+    parsed = urllib.parse.urlparse(url)
+    if parsed.netloc:
+        return None
+    response = client.get('/' + url.lstrip('/'), headers={'Accept-Encoding': 'gzip'})
+    return len(response.get_data())
+
+
+def stage_seconds(urls, sizes, seen_origins, rtt, bytes_per_second):
+    """One RTT (+3 per new origin) for the slowest request, plus all bytes over the shared link."""
+    if not urls:
+        return 0.0
+    setup = 0
+    for url in urls:
+        origin = urllib.parse.urlparse(url).netloc or 'self'
+        if origin not in seen_origins:
+            seen_origins.add(origin)
+            setup = 3
+    return rtt * (1 + setup) + sum(sizes[u] or 0 for u in urls) / bytes_per_second
+
+
+def analyse(server, mode, client, rtt, bytes_per_second):
+    page = server.IndexPage(mode=mode)
+    body, gzipped, _ = page.get()
+    html = without_noscript(body.decode())
+    blocking_css = [HREF.search(link).group(1) for link in STYLESHEET.findall(html)]
+    scripts = [src for src in SCRIPT.findall(html)]
+    embedded = 'id="gallery-manifest"' in html
+    api = [] if embedded else ['api/gallery-images?offset=0&limit=12']
+
+    sizes = {url: transfer_size(client, url) for url in blocking_css + scripts + api}
+    origins = {'self'}
+    html_time = rtt * 4 + len(gzipped) / bytes_per_second  # new connection + request
+    paint = html_time + stage_seconds(blocking_css, sizes, origins, rtt, bytes_per_second)
+    scripts_done = paint + stage_seconds([s for s in scripts if s not in blocking_css], sizes, origins, rtt, bytes_per_second)
+    gallery = scripts_done + stage_seconds(api, sizes, origins, rtt, bytes_per_second)
+    same_origin = [u for u in blocking_css + scripts + api if sizes[u] is not None]
+    return {
+        'mode': mode,
+        'html_kb': len(gzipped) / 1024,
+        'paint_requests': 1 + len(blocking_css),
+        'gallery_requests': 1 + len(blocking_css) + len(scripts) + len(api),
+        'third_party': sum(1 for u in blocking_css + scripts if sizes[u] is None),
+        'same_origin_kb': (len(gzipped) + sum(sizes[u] for u in same_origin)) / 1024,
+        'first_paint_s': paint,
+        'gallery_s': gallery,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rtt-ms', type=float, default=150)
+    parser.add_argument('--kbps', type=float, default=1600)
+    args = parser.parse_args()
+
+    os.chdir(REPO_ROOT)
+    os.environ.update(OUTBOX_DB=os.path.join(tempfile.mkdtemp(prefix='bench-render-'), 'inquiries.db'),
+                      DERIVATIVE_PREBUILD='false', LOG_LEVEL='WARNING')
+    sys.path.insert(0, REPO_ROOT)
+    import server
+
+    client = server.app.test_client()
+    rtt, bytes_per_second = args.rtt_ms / 1000, args.kbps * 1000 / 8
+    print(f"{'mode':>7} | {'html KB':>7} | {'reqs to paint':>13} | {'reqs to gallery':>15} | {'3rd party':>9} | "
+          f"{'same-origin KB':>14} | {'first paint s':>13} | {'gallery s':>9}")
+    print('-' * 110)
+    for mode in ('static', 'inline'):
+        r = analyse(server, mode, client, rtt, bytes_per_second)
+        print(f"{r['mode']:>7} | {r['html_kb']:>7.1f} | {r['paint_requests']:>13} | {r['gallery_requests']:>15} | "
+              f"{r['third_party']:>9} | {r['same_origin_kb']:>14.1f} | {r['first_paint_s']:>13.2f} | {r['gallery_s']:>9.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+"""
+How many concurrent large downloads a fixed gunicorn pool can serve, per media serving mode.
+
+Writes a scratch --size-mb file into pg-photos/ (hidden name, removed at the
+end) and, for each --modes entry, starts gunicorn (--workers x --threads) and
+fires --clients downloads at once. Every client reads at --client-kbps, like
+a phone on a slow link; with --range-mb each client asks for a random byte
+range of that size (video seeking) instead of the whole file. While the
+downloads run, a probe requests /test every 100 ms.
+
+Modes:
+  sendfile     MEDIA_SERVE_MODE=sendfile (gunicorn copies the file with sendfile())
+  no-sendfile  the same responses, but gunicorn --no-sendfile (bytes go through Python)
+  x-accel      MEDIA_SERVE_MODE=x-accel (headers only; the front proxy, not run
+               here, would stream the bytes, so "MB" is 0 by design)
+
+Reported per mode: downloads completed, the most that were receiving data at
+the same time, time to first byte, probe latency, and worker CPU time per
+GB served.
+
+Usage: python benchmarks/bench_media.py [--modes sendfile,no-sendfile,x-accel]
+           [--workers 1] [--threads 4] [--clients 16] [--size-mb 32]
+           [--client-kbps 8192] [--range-mb 0]
+"""
+import argparse
+import http.client
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from load_test import REPO_ROOT, Server, percentile  # noqa: E402
+
+MODES = {
+    'sendfile': ({'MEDIA_SERVE_MODE': 'sendfile'}, ()),
+    'no-sendfile': ({'MEDIA_SERVE_MODE': 'sendfile'}, ('--no-sendfile',)),
+    'x-accel': ({'MEDIA_SERVE_MODE': 'x-accel'}, ()),
+}
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+
+
+def worker_cpu_seconds(master_pid):
+    """utime + stime of the gunicorn workers (children of the master)."""
+    total = 0
+    for pid in filter(str.isdigit, os.listdir('/proc')):
+        try:
+            with open(f'/proc/{pid}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        if int(fields[1]) == master_pid:
+            total += int(fields[11]) + int(fields[12])
+    return total / CLOCK_TICKS
+
+
+def download(port, path, size, range_bytes, bytes_per_second, started):
+    headers = {}
+    if range_bytes:
+        offset = random.randrange(0, max(1, size - range_bytes))
+        headers['Range'] = f'bytes={offset}-{offset + range_bytes - 1}'
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=300)
+    try:
+        connection.request('GET', path, headers=headers)
+        response = connection.getresponse()
+        first_byte = time.perf_counter() - started
+        received, chunk = 0, 64 * 1024
+        while True:
+            data = response.read(chunk)
+            if not data:
+                break
+            received += len(data)
+            # Throttle to the client's link speed
+            behind = received / bytes_per_second - (time.perf_counter() - started - first_byte)
+            if behind > 0:
+                time.sleep(behind)
+        return {'status': response.status, 'bytes': received, 'first_byte': first_byte,
+                'end': time.perf_counter() - started}
+    except (OSError, http.client.HTTPException):
+        return {'status': None, 'bytes': 0, 'first_byte': None, 'end': time.perf_counter() - started}
+    finally:
+        connection.close()
+
+
+def probe(port, stop, latencies):
+    while not stop.is_set():
+        started = time.perf_counter()
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+            connection.request('GET', '/test')
+            connection.getresponse().read()
+            connection.close()
+            latencies.append((time.perf_counter() - started) * 1000)
+        except (OSError, http.client.HTTPException):
+            pass
+        stop.wait(0.1)
+
+
+def max_overlap(results):
+    events = sorted([(r['first_byte'], 1) for r in results if r['first_byte'] is not None]
+                    + [(r['end'], -1) for r in results if r['first_byte'] is not None])
+    current = peak = 0
+    for _, delta in events:
+        current += delta
+        peak = max(peak, current)
+    return peak
+
+
+def run_mode(mode, path, size, args):
+    extra_env, extra_args = MODES[mode]
+    server = Server(args.workers, args.threads, 0, 0.0, 0.0, extra_env=extra_env, extra_args=extra_args)
+    try:
+        server.wait_ready()
+        cpu_before = worker_cpu_seconds(server.process.pid)
+        results = [None] * args.clients
+        latencies = []
+        stop = threading.Event()
+        started = time.perf_counter()
+
+        def client(i):
+            results[i] = download(server.port, path, size, args.range_mb * 1024 * 1024,
+                                  args.client_kbps * 1024, started)
+
+        threads = [threading.Thread(target=client, args=(i,)) for i in range(args.clients)]
+        prober = threading.Thread(target=probe, args=(server.port, stop, latencies))
+        prober.start()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        stop.set()
+        prober.join()
+        elapsed = time.perf_counter() - started
+        cpu = worker_cpu_seconds(server.process.pid) - cpu_before
+    finally:
+        server.stop()
+
+    done = [r for r in results if r['status'] in (200, 206)]
+    first_bytes = sorted(r['first_byte'] for r in done) or [0.0]
+    served = sum(r['bytes'] for r in done)
+    ordered = sorted(latencies) or [0.0]
+    return {
+        'mode': mode,
+        'completed': len(done),
+        'concurrent': max_overlap(done),
+        'ttfb_p50': percentile(first_bytes, 50),
+        'ttfb_max': first_bytes[-1],
+        'probe_p50': percentile(ordered, 50),
+        'probe_max': ordered[-1],
+        'mb': served / 1024 / 1024,
+        'seconds': elapsed,
+        'cpu_per_gb': cpu / (served / 1024 ** 3) if served else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--modes', default='sendfile,no-sendfile,x-accel')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--clients', type=int, default=16, help='concurrent downloads')
+    parser.add_argument('--size-mb', type=int, default=32, help='size of the scratch media file')
+    parser.add_argument('--client-kbps', type=int, default=8192, help='read speed of each client, KiB/s')
+    parser.add_argument('--range-mb', type=int, default=0, help='request random ranges of this size (0: whole file)')
+    args = parser.parse_args()
+
+    name = f'.bench-media-{uuid.uuid4().hex[:8]}.mp4'
+    file_path = os.path.join(REPO_ROOT, 'pg-photos', name)
+    size = args.size_mb * 1024 * 1024
+    with open(file_path, 'wb') as f:
+        for _ in range(args.size_mb):
+            f.write(os.urandom(1024 * 1024))
+    try:
+        results = []
+        for mode in args.modes.split(','):
+            print(f"running {mode} ...", file=sys.stderr)
+            results.append(run_mode(mode, f'/pg-photos/{name}', size, args))
+    finally:
+        os.remove(file_path)
+
+    print(f"{args.workers} worker(s) x {args.threads} thread(s), {args.clients} clients at {args.client_kbps} KiB/s, "
+          + (f"{args.range_mb} MiB ranges" if args.range_mb else f"{args.size_mb} MiB downloads"))
+    print(f"{'mode':>11} | {'done':>4} | {'concurrent':>10} | {'ttfb p50 s':>10} | {'ttfb max s':>10} | "
+          f"{'probe p50 ms':>12} | {'probe max ms':>12} | {'MB':>6} | {'wall s':>6} | {'CPU s/GB':>8}")
+    print('-' * 118)
+    for r in results:
+        print(f"{r['mode']:>11} | {r['completed']:>4} | {r['concurrent']:>10} | {r['ttfb_p50']:>10.2f} | "
+              f"{r['ttfb_max']:>10.2f} | {r['probe_p50']:>12.1f} | {r['probe_max']:>12.1f} | {r['mb']:>6.0f} | "
+              f"{r['seconds']:>6.1f} | {r['cpu_per_gb']:>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
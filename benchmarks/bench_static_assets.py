@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+"""
+Bytes transferred and time-to-first-byte for a page load, before and after
+the fingerprinted/precompressed asset pipeline.
+
+Starts the Flask app on a local port and loads index.html plus every local
+css/js/assets file it references:
+
+  before        plain URLs, no compression (what send_from_directory served)
+  after         hashed URLs with Accept-Encoding: br, gzip
+  after-repeat  a repeat visit: index.html revalidates with If-None-Match and
+                hashed assets are served from the browser cache (no request)
+
+Usage: python benchmarks/bench_static_assets.py [--runs 20]
+"""
+import argparse
+import gzip
+import http.client
+import logging
+import os
+import re
+import statistics
+import sys
+import threading
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REFERENCE_PATTERN = re.compile(r'''(?:href|src)=["']/?((?:css|js|assets)/[^"'?#]+)''')
+
+
+def fetch(conn, path, headers):
+    """Returns (status, body bytes, ttfb ms, response headers)."""
+    start = time.perf_counter()
+    conn.request('GET', '/' + path.lstrip('/'), headers=headers)
+    response = conn.getresponse()
+    ttfb = (time.perf_counter() - start) * 1000
+    body = response.read()
+    return response.status, body, ttfb, response
+
+
+def page_load(port, mode, index_etag=None):
+    conn = http.client.HTTPConnection('127.0.0.1', port)
+    headers = {} if mode == 'before' else {'Accept-Encoding': 'br, gzip'}
+    if mode == 'after-repeat':
+        headers['If-None-Match'] = index_etag
+    status, body, ttfb, response = fetch(conn, '/', headers)
+    requests, transferred, ttfbs = 1, len(body), [ttfb]
+    etag = response.getheader('ETag')
+    if mode != 'after-repeat':
+        html = gzip.decompress(body) if response.getheader('Content-Encoding') == 'gzip' else body
+        paths = REFERENCE_PATTERN.findall(html.decode('utf-8'))
+        if mode == 'before':
+            # Strip the fingerprint to request the plain file names
+            paths = [re.sub(r'\.[0-9a-f]{12}(\.[^.]+)$', r'\1', p) for p in paths]
+        for path in paths:
+            status, body, ttfb, _ = fetch(conn, path, headers)
+            assert status == 200, (path, status)
+            requests += 1
+            transferred += len(body)
+            ttfbs.append(ttfb)
+    conn.close()
+    return requests, transferred, ttfbs, etag
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=20, help='page loads per mode')
+    args = parser.parse_args()
+
+    os.chdir(REPO_ROOT)
+    os.environ.setdefault('DERIVATIVE_PREBUILD', 'false')
+    sys.path.insert(0, REPO_ROOT)
+    from werkzeug.serving import make_server
+    import server
+
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    httpd = make_server('127.0.0.1', 0, server.app, threaded=True)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    port = httpd.server_port
+
+    # Warm up so compressed variants exist before timing
+    _, _, _, index_etag = page_load(port, 'after')
+
+    print(f"{'mode':>13} | {'requests':>8} | {'bytes':>9} | {'ttfb p50 ms':>11} | {'ttfb sum ms':>11}")
+    print('-' * 64)
+    for mode in ('before', 'after', 'after-repeat'):
+        totals, sums, medians = [], [], []
+        for _ in range(args.runs):
+            requests, transferred, ttfbs, _ = page_load(port, mode, index_etag)
+            totals.append(transferred)
+            sums.append(sum(ttfbs))
+            medians.append(statistics.median(ttfbs))
+        print(f"{mode:>13} | {requests:>8} | {statistics.median(totals):>9.0f} | "
+              f"{statistics.median(medians):>11.3f} | {statistics.median(sums):>11.3f}")
+    httpd.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+"""
+Subscribe latency vs. number of stored rows.
+
+For each --rows size, starts from a fresh outbox holding that many stored
+emails, half as outbox rows and half read from the worksheets (sheet_emails),
+seeds the email index from it the way startup does, and times
+/subscribe_email through the Flask test client, once for new addresses
+(index miss, then the outbox lookup) and once for duplicates. The "legacy scan"
+column times the old get_all_values() list scan on the same rows (network
+time excluded), for comparison.
+
+Usage: python benchmarks/bench_subscribe.py [--rows 100,1000,10000,50000] [--requests 200]
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def time_requests(client, emails):
+    samples = []
+    for email in emails:
+        start = time.perf_counter()
+        response = client.post('/subscribe_email', json={'email': email})
+        samples.append((time.perf_counter() - start) * 1000)
+        assert response.status_code == 200, response.data
+    return samples
+
+
+def seed(server, size):
+    """A fresh outbox holding `size` stored emails, and an email index loaded from it."""
+    server.outbox = server.Outbox(os.path.join(tempfile.mkdtemp(prefix='bench-subscribe-db-'), 'inquiries.db'))
+    in_outbox = size // 2
+    server.outbox.import_rows(({
+        'row_id': f'seed-{i}', 'kind': 'subscription', 'date': '01-01-2025', 'time': '10:00:00 AM',
+        'name': 'Newsletter Subscriber', 'email': f'resident{i}@example.com', 'phone': '', 'visit_date': '',
+        'message': 'Subscribed to newsletter', 'created_at': 1735700000.0 + i,
+    } for i in range(in_outbox)), status='synced')
+    server.outbox.record_sheet_emails(
+        '2025', [f'resident{i}@example.com' for i in range(in_outbox, size)], size - in_outbox + 1)
+    server.email_index = server.EmailIndex()
+    server.email_index._add_many(server.outbox.emails())
+    return [f"resident{i}@example.com" for i in range(size)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', default='100,1000,10000,50000', help='comma-separated stored email counts')
+    parser.add_argument('--requests', type=int, default=200, help='requests per measurement')
+    args = parser.parse_args()
+
+    # Run against a scratch CSV so the real inquiries file is never touched
+    os.chdir(tempfile.mkdtemp(prefix='bench-subscribe-'))
+    os.environ['RATE_LIMIT_BURST'] = '1000000'  # Every request comes from the same test client
+    sys.path.insert(0, REPO_ROOT)
+    import server
+
+    client = server.app.test_client()
+
+    print(f"{'rows':>8} | {'new p50 ms':>10} | {'new p95 ms':>10} | {'dup p50 ms':>10} | {'legacy scan ms':>14}")
+    print('-' * 64)
+    for size in (int(n) for n in args.rows.split(',')):
+        stored = seed(server, size)
+        assert len(server.email_index) == size
+
+        new_emails = [f"new{size}-{i}@example.com" for i in range(args.requests)]
+        new_samples = time_requests(client, new_emails)
+        # Duplicates from both halves: outbox rows and sheet_emails
+        dup_samples = time_requests(client, stored[:args.requests // 2] + stored[-(args.requests - args.requests // 2):])
+
+        all_values = [server.SHEET_HEADERS] + [['', '', '', e, '', '', ''] for e in stored]
+        start = time.perf_counter()
+        existing_emails = [row[3] for row in all_values[1:] if len(row) > 3]
+        _ = stored[-1] in existing_emails
+        legacy_ms = (time.perf_counter() - start) * 1000
+
+        print(f"{size:>8} | {statistics.median(new_samples):>10.3f} | {percentile(new_samples, 95):>10.3f} | "
+              f"{statistics.median(dup_samples):>10.3f} | {legacy_ms:>14.3f}")
+
+
+if __name__ == '__main__':
+    main()
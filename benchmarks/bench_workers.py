@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+"""
+Throughput scaling with gunicorn workers and threads, plus multi-worker correctness.
+
+For each --layouts entry (processes x threads) starts gunicorn with the repo's
+gunicorn.conf.py against the fake gspread backend and measures throughput of
+the write routes and the home page. It then checks the shared state:
+
+- the same address subscribed concurrently from every client is stored once
+- once the replayer drains, every outbox row was appended exactly once
+  (outbox_rows_synced_total, summed across workers, equals the row count)
+- exactly one worker reports itself as the replayer leader
+
+Usage: python benchmarks/bench_workers.py [--layouts 1x1,2x1,4x1,2x4,4x4]
+           [--requests 400] [--concurrency 32] [--sheets-latency 0.05]
+"""
+import argparse
+import json
+import os
+import re
+import sqlite3
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from load_test import Server, build_routes, request, run_route  # noqa: E402
+
+ROUTES = ('submit_booking', 'subscribe_email', 'index')
+
+
+def scrape(port, name):
+    """Sum of every sample of a metric on /metrics."""
+    _, payload = request(port, 'GET', '/metrics')
+    pattern = re.compile(rf'^{name}(?:{{[^}}]*}})? (\S+)$', re.M)
+    return sum(float(v) for v in pattern.findall(payload.decode()))
+
+
+def leaders(port, workers):
+    """Distinct pids answering /test, and how many of them lead the replayer."""
+    seen = {}
+    for _ in range(workers * 20):
+        _, payload = request(port, 'GET', '/test')
+        stats = json.loads(payload)['outbox']
+        seen[stats['pid']] = stats['leader']
+        if len(seen) == workers:
+            break
+    return len(seen), sum(seen.values())
+
+
+def run_layout(workers, threads, args):
+    server = Server(workers, threads, 0, args.sheets_latency, 0.0)
+    try:
+        server.wait_ready()
+        routes = {name: (method, path, body) for name, method, path, body in build_routes(server.port, uuid.uuid4().hex[:8])}
+        result = {'workers': workers, 'threads': threads}
+        for name in ROUTES:
+            method, path, body = routes[name]
+            run_route(server.port, method, path, body, 20, args.concurrency)
+            result[name] = run_route(server.port, method, path, body, args.requests, args.concurrency)['throughput_rps']
+
+        duplicate = {'email': f'same-{uuid.uuid4().hex[:8]}@example.com'}
+        with ThreadPoolExecutor(args.concurrency) as pool:
+            list(pool.map(lambda _: request(server.port, 'POST', '/subscribe_email', duplicate), range(args.concurrency)))
+        db = sqlite3.connect(os.path.join(server.scratch, 'inquiries.db'))
+        result['duplicate_rows'] = db.execute("SELECT COUNT(*) FROM outbox WHERE email = ?", (duplicate['email'],)).fetchone()[0]
+
+        # Rows imported from the legacy CSV are queued too (the fake sheet has none of them)
+        deadline = time.monotonic() + 60
+        while time.monotonic() < deadline:
+            if db.execute("SELECT COUNT(*) FROM outbox WHERE status IN ('legacy', 'pending', 'sending')").fetchone()[0] == 0:
+                break
+            time.sleep(0.5)
+        total_rows = db.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+        time.sleep(float(os.environ.get('METRICS_FLUSH_INTERVAL', 5)) + 1)  # Let every worker snapshot
+        result['rows'] = total_rows
+        result['rows_appended'] = int(scrape(server.port, 'outbox_rows_synced_total'))
+        result['workers_seen'], result['leaders'] = leaders(server.port, workers)
+        db.close()
+        return result
+    finally:
+        server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--layouts', default='1x1,2x1,4x1,2x4,4x4', help='comma-separated PROCESSESxTHREADS')
+    parser.add_argument('--requests', type=int, default=400, help='measured requests per route')
+    parser.add_argument('--concurrency', type=int, default=32, help='concurrent client threads')
+    parser.add_argument('--sheets-latency', type=float, default=0.05, help='seconds per fake Sheets call')
+    args = parser.parse_args()
+
+    results = []
+    for layout in args.layouts.split(','):
+        workers, threads = (int(n) for n in layout.split('x'))
+        print(f"running {workers} worker(s) x {threads} thread(s) ...", file=sys.stderr)
+        results.append(run_layout(workers, threads, args))
+
+    base = results[0]
+    print(f"{'layout':>7} | " + ' | '.join(f'{name + " req/s":>22}' for name in ROUTES)
+          + f" | {'dup rows':>8} | {'rows/appended':>13} | {'leaders':>7}")
+    print('-' * 120)
+    for r in results:
+        cells = ' | '.join(f"{r[name]:>12.1f} ({r[name] / base[name]:>4.1f}x)   " for name in ROUTES)
+        print(f"{r['workers']}x{r['threads']:<5} | {cells} | {r['duplicate_rows']:>8} | "
+              f"{r['rows']:>6}/{r['rows_appended']:<6} | {r['leaders']:>3}/{r['workers_seen']:<3}")
+
+
+if __name__ == '__main__':
+    main()
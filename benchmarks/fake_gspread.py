@@ -0,0 +1,170 @@
+"""
+In-memory stand-in for the gspread client, spreadsheet and worksheet.
+
+Each worksheet call sleeps for ``latency`` seconds and fails with an APIError
+(``error_status``) with probability ``error_rate``. Both can be changed while
+it is in use. ``install()`` patches gspread.authorize and the service account
+loader so server.py connects to the fake instead of Google.
+"""
+import base64
+import json
+import os
+import random
+import re
+import threading
+import time
+
+import gspread
+from google.oauth2 import service_account
+
+RANGE_PATTERN = re.compile(r'^([A-Z]+)(\d*)(?::([A-Z]+)(\d*))?$')
+
+
+class FakeResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.text = f'fake error {status_code}'
+
+    def json(self):
+        return {'error': {'code': self.status_code, 'message': self.text, 'status': 'FAKE'}}
+
+
+def api_error(status_code):
+    return gspread.exceptions.APIError(FakeResponse(status_code))
+
+
+def column_index(letters):
+    index = 0
+    for letter in letters:
+        index = index * 26 + ord(letter) - ord('A') + 1
+    return index
+
+
+class FakeWorksheet:
+    def __init__(self, title='2025', rows=None, latency=0.0, error_rate=0.0, error_status=503, seed=None):
+        self.title = title
+        self.rows = [list(row) for row in rows or []]
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.calls = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _io(self, operation):
+        with self._lock:
+            self.calls[operation] = self.calls.get(operation, 0) + 1
+            fail = self._random.random() < self.error_rate
+        if self.latency:
+            time.sleep(self.latency)
+        if fail:
+            raise api_error(self.error_status)
+
+    def _grid(self, range_name):
+        match = RANGE_PATTERN.match(range_name)
+        if not match:
+            raise ValueError(f'unsupported range {range_name!r}')
+        first_col, first_row, last_col, last_row = match.groups()
+        first_row = int(first_row or 1)
+        last_col = last_col or first_col
+        last_row = int(last_row) if last_row else None
+        return column_index(first_col) - 1, first_row - 1, column_index(last_col), last_row
+
+    def row_values(self, row):
+        self._io('row_values')
+        with self._lock:
+            return list(self.rows[row - 1]) if row <= len(self.rows) else []
+
+    def col_values(self, col):
+        self._io('col_values')
+        with self._lock:
+            values = [row[col - 1] if len(row) >= col else '' for row in self.rows]
+        while values and not values[-1]:
+            values.pop()
+        return values
+
+    def get_all_values(self):
+        self._io('get_all_values')
+        with self._lock:
+            return [list(row) for row in self.rows]
+
+    def get_values(self, range_name=None, **kwargs):
+        self._io('get_values')
+        if range_name is None:
+            return self.get_all_values()
+        col_start, row_start, col_end, row_end = self._grid(range_name)
+        with self._lock:
+            selected = self.rows[row_start:row_end]
+            return [row[col_start:col_end] for row in selected]
+
+    def update(self, range_name, values=None, **kwargs):
+        self._io('update')
+        col_start, row_start, _, _ = self._grid(range_name)
+        with self._lock:
+            for offset, new_values in enumerate(values or []):
+                index = row_start + offset
+                while len(self.rows) <= index:
+                    self.rows.append([])
+                row = self.rows[index]
+                row.extend([''] * (col_start + len(new_values) - len(row)))
+                row[col_start:col_start + len(new_values)] = [str(v) for v in new_values]
+
+    def append_row(self, values, value_input_option='RAW', **kwargs):
+        self.append_rows([values], value_input_option=value_input_option)
+
+    def append_rows(self, values, value_input_option='RAW', **kwargs):
+        self._io('append_rows')
+        with self._lock:
+            self.rows.extend([str(v) for v in row] for row in values)
+
+
+class FakeSpreadsheet:
+    def __init__(self, title='Fake Inquiries', **worksheet_options):
+        self.title = title
+        self.worksheet_options = worksheet_options
+        self.tabs = {}
+
+    def worksheets(self):
+        return list(self.tabs.values())
+
+    def worksheet(self, title):
+        if title not in self.tabs:
+            raise gspread.exceptions.WorksheetNotFound(title)
+        return self.tabs[title]
+
+    def add_worksheet(self, title, rows=100, cols=20, **kwargs):
+        if title in self.tabs:
+            raise api_error(400)  # Google rejects duplicate tab names
+        self.tabs[title] = FakeWorksheet(title=title, **self.worksheet_options)
+        return self.tabs[title]
+
+
+class FakeClient:
+    def __init__(self, **worksheet_options):
+        self.spreadsheet = FakeSpreadsheet(**worksheet_options)
+        self.timeout = None
+
+    def open_by_key(self, key):
+        return self.spreadsheet
+
+    def set_timeout(self, timeout):
+        self.timeout = timeout
+
+
+def seed_rows(count):
+    """Rows for a sheet that already holds `count` inquiries (row 1 left empty for the server's headers)."""
+    rows = [[]]
+    for i in range(count):
+        rows.append(['01/01/2025', '10:00:00', f'Resident {i}', f'resident{i}@example.com',
+                     '9000000000', '', '', f'seed-{i}'])
+    return rows
+
+
+def install(**worksheet_options):
+    """Routes server.py's Google Sheets connection to a new FakeClient and returns it."""
+    client = FakeClient(**worksheet_options)
+    gspread.authorize = lambda credentials, **kwargs: client
+    service_account.Credentials.from_service_account_info = classmethod(lambda cls, info, **kwargs: object())
+    os.environ['GOOGLE_CREDENTIALS'] = base64.b64encode(
+        json.dumps({'client_email': 'fake@example.com'}).encode()).decode()
+    return client
@@ -0,0 +1,24 @@
+"""
+WSGI entry point that serves server.app against the in-memory fake gspread.
+
+    gunicorn --pythonpath benchmarks fake_wsgi:app
+
+The fake is configured from the environment:
+    FAKE_SHEETS_LATENCY     seconds per worksheet call (default 0.05)
+    FAKE_SHEETS_ERROR_RATE  probability of a 503 per call (default 0)
+    FAKE_SHEET_ROWS         inquiries already in the sheet (default 0)
+
+Each gunicorn worker gets its own fake spreadsheet.
+"""
+import os
+
+import fake_gspread
+
+client = fake_gspread.install(
+    latency=float(os.environ.get('FAKE_SHEETS_LATENCY', 0.05)),
+    error_rate=float(os.environ.get('FAKE_SHEETS_ERROR_RATE', 0)),
+)
+worksheet = client.spreadsheet.add_worksheet(os.environ.get('SHEET_NAME', '2025'))
+worksheet.rows = fake_gspread.seed_rows(int(os.environ.get('FAKE_SHEET_ROWS', 0)))
+
+from server import app  # noqa: E402
@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+"""
+Offline load test: gunicorn + the fake gspread backend, driven by concurrent clients.
+
+For every combination of --workers and --sheet-rows, starts gunicorn (with the
+repo's gunicorn.conf.py) on a free port with benchmarks/fake_wsgi.py (no
+network, scratch outbox database), warms each route up, then fires --requests
+requests per route from --concurrency client threads. Throughput and p50/p95/p99 latency per route are printed and
+written to --output as JSON. Pass --baseline with an earlier results file to
+print the change in throughput and p95.
+
+Routes: POST /submit_booking, POST /subscribe_email, GET /api/gallery-images,
+GET /, GET /pg-photos/<first photo> and GET /media/derived/<its smallest
+derivative> (when Pillow is installed).
+
+Usage: python benchmarks/load_test.py [--workers 1,2,4] [--sheet-rows 0,10000]
+           [--requests 500] [--concurrency 16] [--sheets-latency 0.05]
+           [--sheets-error-rate 0] [--output load_test_results.json]
+           [--baseline previous.json]
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def percentile(ordered, pct):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Server:
+    """A gunicorn process serving fake_wsgi:app from a scratch directory."""
+
+    def __init__(self, workers, threads, sheet_rows, sheets_latency, sheets_error_rate, extra_env=None, extra_args=()):
+        self.port = free_port()
+        self.scratch = tempfile.mkdtemp(prefix='load-test-')
+        env = dict(os.environ,
+                   FAKE_SHEETS_LATENCY=str(sheets_latency),
+                   FAKE_SHEETS_ERROR_RATE=str(sheets_error_rate),
+                   FAKE_SHEET_ROWS=str(sheet_rows),
+                   OUTBOX_DB=os.path.join(self.scratch, 'inquiries.db'),
+                   METRICS_DIR=os.path.join(self.scratch, 'metrics'),
+                   DERIVATIVE_PREBUILD='false',
+                   GUNICORN_MAX_REQUESTS='0',
+                   RATE_LIMIT_BURST='1000000',  # Every client shares 127.0.0.1
+                   LOG_LEVEL='WARNING')
+        env.update(extra_env or {})
+        command = [sys.executable, '-m', 'gunicorn', '--config', os.path.join(REPO_ROOT, 'gunicorn.conf.py'),
+                   '--chdir', REPO_ROOT, '--pythonpath', BENCH_DIR,
+                   '--bind', f'127.0.0.1:{self.port}', '--workers', str(workers), '--threads', str(threads),
+                   '--log-level', 'warning', *extra_args, 'fake_wsgi:app']
+        self.process = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def wait_ready(self, timeout=60):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError('gunicorn exited during startup (is it installed?)')
+            try:
+                status, _ = request(self.port, 'GET', '/test')
+                if status == 200:
+                    return
+            except OSError:
+                time.sleep(0.05)
+        raise RuntimeError('gunicorn did not become ready in time')
+
+    def stop(self):
+        self.process.terminate()
+        try:
+            self.process.wait(15)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        shutil.rmtree(self.scratch, ignore_errors=True)
+
+
+def request(port, method, path, body=None):
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    try:
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+        connection.request(method, path, body=json.dumps(body) if body is not None else None, headers=headers)
+        response = connection.getresponse()
+        payload = response.read()
+        return response.status, payload
+    finally:
+        connection.close()
+
+
+def build_routes(port, run_token):
+    """(name, method, path, body factory) for every benchmarked route."""
+    counter = iter(range(10 ** 9))
+    lock = threading.Lock()
+
+    def next_id():
+        with lock:
+            return next(counter)
+
+    def booking():
+        i = next_id()
+        return {'name': f'Load Test {i}', 'email': f'booking-{run_token}-{i}@example.com',
+                'phone': '9000000000', 'visitDate': '2025-01-01', 'message': 'load test'}
+
+    def subscription():
+        return {'email': f'subscriber-{run_token}-{next_id()}@example.com'}
+
+    routes = [
+        ('submit_booking', 'POST', '/submit_booking', booking),
+        ('subscribe_email', 'POST', '/subscribe_email', subscription),
+        ('gallery_images', 'GET', '/api/gallery-images?offset=0&limit=12', None),
+        ('index', 'GET', '/', None),
+    ]
+    _, payload = request(port, 'GET', '/api/gallery-images?offset=0&limit=1')
+    images = json.loads(payload).get('images', [])
+    if images:
+        routes.append(('pg_photo', 'GET', urllib.parse.quote(images[0]['url']), None))
+        srcset = images[0].get('srcset') or {}
+        if 'webp' in srcset:
+            smallest = srcset['webp'].split(',')[0].split()[0]
+            routes.append(('derived_photo', 'GET', smallest, None))
+    return routes
+
+
+def run_route(port, method, path, body_factory, total, concurrency):
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+
+    def one(_):
+        nonlocal errors
+        start = time.perf_counter()
+        try:
+            status, _ = request(port, method, path, body_factory() if body_factory else None)
+            ok = status < 400
+        except (OSError, http.client.HTTPException):
+            ok = False
+        elapsed = (time.perf_counter() - start) * 1000
+        with lock:
+            latencies.append(elapsed)
+            if not ok:
+                errors += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(one, range(total)))
+    duration = time.perf_counter() - started
+    ordered = sorted(latencies)
+    return {
+        'requests': total,
+        'errors': errors,
+        'duration_s': round(duration, 3),
+        'throughput_rps': round(total / duration, 1),
+        'p50_ms': round(percentile(ordered, 50), 2),
+        'p95_ms': round(percentile(ordered, 95), 2),
+        'p99_ms': round(percentile(ordered, 99), 2),
+        'max_ms': round(ordered[-1], 2),
+    }
+
+
+def run_scenario(workers, sheet_rows, args):
+    server = Server(workers, args.threads, sheet_rows, args.sheets_latency, args.sheets_error_rate)
+    try:
+        server.wait_ready()
+        routes = build_routes(server.port, uuid.uuid4().hex[:8])
+        results = {}
+        for name, method, path, body_factory in routes:
+            run_route(server.port, method, path, body_factory, args.warmup, args.concurrency)
+            results[name] = run_route(server.port, method, path, body_factory, args.requests, args.concurrency)
+        return results
+    finally:
+        server.stop()
+
+
+def print_results(scenarios, baseline=None):
+    baseline_index = {(s['workers'], s['sheet_rows']): s['routes'] for s in (baseline or {}).get('scenarios', [])}
+    header = f"{'workers':>7} | {'rows':>7} | {'route':<16} | {'req/s':>8} | {'p50 ms':>8} | {'p95 ms':>8} | {'p99 ms':>8} | {'err':>4}"
+    if baseline_index:
+        header += f" | {'Δ req/s':>8} | {'Δ p95':>8}"
+    print(header)
+    print('-' * len(header))
+    for scenario in scenarios:
+        previous = baseline_index.get((scenario['workers'], scenario['sheet_rows']), {})
+        for route, r in scenario['routes'].items():
+            line = (f"{scenario['workers']:>7} | {scenario['sheet_rows']:>7} | {route:<16} | {r['throughput_rps']:>8.1f} | "
+                    f"{r['p50_ms']:>8.2f} | {r['p95_ms']:>8.2f} | {r['p99_ms']:>8.2f} | {r['errors']:>4}")
+            if baseline_index:
+                old = previous.get(route)
+                if old:
+                    line += (f" | {(r['throughput_rps'] / old['throughput_rps'] - 1) * 100:>+7.1f}%"
+                             f" | {(r['p95_ms'] / old['p95_ms'] - 1) * 100:>+7.1f}%")
+                else:
+                    line += f" | {'n/a':>8} | {'n/a':>8}"
+            print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', default='1,2,4', help='comma-separated gunicorn worker counts')
+    parser.add_argument('--threads', type=int, default=1, help='gunicorn threads per worker')
+    parser.add_argument('--sheet-rows', default='0,10000', help='comma-separated rows already in the fake sheet')
+    parser.add_argument('--requests', type=int, default=500, help='measured requests per route')
+    parser.add_argument('--warmup', type=int, default=20, help='unmeasured requests per route')
+    parser.add_argument('--concurrency', type=int, default=16, help='concurrent client threads')
+    parser.add_argument('--sheets-latency', type=float, default=0.05, help='seconds per fake Sheets call')
+    parser.add_argument('--sheets-error-rate', type=float, default=0.0, help='probability of a fake 503')
+    parser.add_argument('--output', default='load_test_results.json')
+    parser.add_argument('--baseline', help='earlier results file to compare against')
+    args = parser.parse_args()
+
+    scenarios = []
+    for workers in (int(w) for w in args.workers.split(',')):
+        for sheet_rows in (int(n) for n in args.sheet_rows.split(',')):
+            print(f"running workers={workers} sheet_rows={sheet_rows} ...", file=sys.stderr)
+            scenarios.append({'workers': workers, 'sheet_rows': sheet_rows,
+                              'routes': run_scenario(workers, sheet_rows, args)})
+
+    results = {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'git_revision': git_revision(),
+        'python': platform.python_version(),
+        'cpu_count': os.cpu_count(),
+        'config': {k: v for k, v in vars(args).items() if k not in ('output', 'baseline')},
+        'scenarios': scenarios,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_results(scenarios, baseline)
+    print(f"\nresults written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+"""
+Import-time profile of server.py startup.
+
+Runs `python -X importtime -c "import server"` in a scratch environment (no
+Sheets credentials needed, derivative prebuild off), turns the import tree into
+collapsed stacks (open --output in speedscope, or pipe it to flamegraph.pl)
+and prints how much of boot goes to each heavy dependency. The `server` line
+is server.py's own module body: logging setup, the legacy CSV import, and so on.
+
+Usage: python benchmarks/profile_startup.py [--runs 3] [--output startup.collapsed.txt]
+"""
+import argparse
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMPORTTIME_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|(\s+)(\S+)$')
+PACKAGES = ('gspread', 'google', 'pytz', 'flask', 'werkzeug', 'requests', 'PIL', 'brotli', 'sqlite3')
+
+
+def run_import(scratch):
+    env = dict(os.environ, OUTBOX_DB=os.path.join(scratch, 'inquiries.db'), DERIVATIVE_PREBUILD='false',
+               LOG_LEVEL='ERROR', PYTHONDONTWRITEBYTECODE='1')
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import server'],
+                            cwd=REPO_ROOT, env=env, capture_output=True, text=True, check=True)
+    return time.perf_counter() - started, result.stderr
+
+
+def parse(stderr):
+    """Import tree from -X importtime output as [(name, self_us, children)] roots.
+
+    Lines arrive children first, indented two spaces per level.
+    """
+    pending = []
+    for line in stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if not match:
+            continue
+        self_us, level, name = int(match.group(1)), (len(match.group(3)) - 1) // 2, match.group(4)
+        children = []
+        while pending and pending[-1][0] > level:
+            children.insert(0, pending.pop()[1])
+        pending.append((level, (name, self_us, children)))
+    return [node for _, node in pending]
+
+
+def collapse(nodes, prefix=''):
+    for name, self_us, children in nodes:
+        stack = f'{prefix};{name}' if prefix else name
+        if self_us:
+            yield stack, self_us
+        yield from collapse(children, stack)
+
+
+def cumulative(node):
+    return node[1] + sum(cumulative(child) for child in node[2])
+
+
+def package_totals(roots):
+    """Cumulative microseconds of the outermost imports of each package in PACKAGES.
+
+    A package imported by another one (google-auth by gspread) counts towards both.
+    """
+    totals = dict.fromkeys(PACKAGES, 0)
+
+    def walk(node, inside):
+        top = node[0].split('.')[0]
+        if top in totals and top not in inside:
+            totals[top] += cumulative(node)
+            inside = inside | {top}
+        for child in node[2]:
+            walk(child, inside)
+
+    for root in roots:
+        walk(root, frozenset())
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=3, help='imports to run; the fastest is reported')
+    parser.add_argument('--output', default='startup.collapsed.txt', help='collapsed stacks file')
+    args = parser.parse_args()
+
+    best = None
+    for _ in range(args.runs):
+        scratch = tempfile.mkdtemp(prefix='profile-startup-')
+        try:
+            wall, stderr = run_import(scratch)
+        finally:
+            shutil.rmtree(scratch, ignore_errors=True)
+        if best is None or wall < best[0]:
+            best = (wall, stderr)
+    wall, stderr = best
+    roots = parse(stderr)
+    with open(args.output, 'w') as f:
+        for stack, self_us in collapse(roots):
+            f.write(f'{stack} {self_us}\n')
+
+    total_us = sum(cumulative(root) for root in roots)
+    server_node = next((root for root in roots if root[0] == 'server'), None)
+    print(f"process wall time {wall * 1000:.0f} ms, imports {total_us / 1000:.0f} ms")
+    print(f"{'package':<10} | {'ms':>8} | {'% of imports':>12}  (nested packages count in both)")
+    print('-' * 36)
+    for name, us in sorted(package_totals(roots).items(), key=lambda kv: -kv[1]):
+        if us:
+            print(f"{name:<10} | {us / 1000:>8.1f} | {us / total_us * 100:>11.1f}%")
+    if server_node:
+        print(f"{'server.py':<10} | {server_node[1] / 1000:>8.1f} | {server_node[1] / total_us * 100:>11.1f}%  (module body)")
+    print(f"\ncollapsed stacks written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
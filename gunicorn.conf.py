@@ -0,0 +1,61 @@
+"""
+Gunicorn settings for server.py (loaded automatically from the working directory).
+
+Defaults suit a small instance: a few worker processes, each with a handful of
+threads, since requests mostly wait on SQLite commits and file I/O rather than
+CPU. Override with WEB_CONCURRENCY (processes) and GUNICORN_THREADS.
+
+Every worker shares the SQLite outbox; only one of them (the holder of the
+outbox lock file) replays it to Google Sheets. Metrics from all workers are
+merged through METRICS_DIR, which is cleared when the server starts; workers
+recycled by max_requests fold their final counters into one file there.
+"""
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5001)}"
+workers = int(os.environ.get('WEB_CONCURRENCY', min(multiprocessing.cpu_count() * 2 + 1, 4)))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+worker_class = 'gthread' if threads > 1 else 'sync'
+
+# Background threads (Sheets connection, replayer, log listener) start per
+# worker after fork; preloading would start them in the master instead
+preload_app = False
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = 30  # Long enough for the replayer's final flush
+keepalive = 5
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 2000))
+max_requests_jitter = max_requests // 10
+
+# Heartbeat files on tmpfs so a slow disk can't get workers killed
+if os.path.isdir('/dev/shm'):
+    worker_tmp_dir = '/dev/shm'
+
+accesslog = None  # server.py writes its own structured access log
+errorlog = '-'
+loglevel = os.environ.get('LOG_LEVEL', 'info').lower()
+
+os.environ.setdefault('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'yasodha-metrics'))
+
+
+def on_starting(server):
+    # Counters restart with the server; drop snapshots from the previous run
+    shutil.rmtree(os.environ['METRICS_DIR'], ignore_errors=True)
+
+
+def post_worker_init(worker):
+    # The image derivative prebuild starts here rather than on import
+    app_module = sys.modules.get('server')
+    if app_module is not None:
+        app_module.start_derivative_prebuild()
+
+
+def worker_exit(server, worker):
+    # Cancel queued derivative builds before interpreter shutdown waits on them
+    app_module = sys.modules.get('server')
+    if app_module is not None:
+        app_module.derivative_store.shutdown()
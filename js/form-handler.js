@@ -3,6 +3,26 @@
 document.addEventListener('DOMContentLoaded', () => {
     // Get API base URL from config or use relative path
     const API_BASE_URL = window.appConfig?.API_BASE_URL || '';
+
+    // Same key for the same payload, so a retried or double-sent submission is stored once
+    const idempotencyKeys = new Map();
+    const idempotencyKeyFor = (body) => {
+        if (!idempotencyKeys.has(body)) {
+            idempotencyKeys.set(body, (window.crypto && crypto.randomUUID)
+                ? crypto.randomUUID()
+                : `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`);
+        }
+        return idempotencyKeys.get(body);
+    };
+
+    // Rate-limit (429) responses carry a message meant for the visitor
+    const rateLimitError = (response) => response.json()
+        .catch(() => ({}))
+        .then(body => {
+            const error = new Error(`Rate limited: ${response.status}`);
+            error.userMessage = body.message || 'Too many requests. Please wait a minute and try again.';
+            return error;
+        });
     // Set min date for visit date field to today
     const visitDateInput = document.getElementById('visitDate');
     if (visitDateInput) {
@@ -99,12 +119,16 @@ document.addEventListener('DOMContentLoaded', () => {
                 headers: {
                     'Content-Type': 'application/json',
                     'Accept': 'application/json',
+                    'Idempotency-Key': idempotencyKeyFor(JSON.stringify(data)),
                 },
                 body: JSON.stringify(data),
             })
             .then(response => {
                 console.log('Response status:', response.status);
                 console.log('Response headers:', response.headers);
+                if (response.status === 429) {
+                    return rateLimitError(response).then(error => { throw error; });
+                }
                 if (!response.ok) {
                     return response.text().then(text => {
                         console.error('Error response body:', text);
@@ -122,7 +146,9 @@ document.addEventListener('DOMContentLoaded', () => {
             .catch(error => {
                 console.error('Error details:', error);
                 // More descriptive error messages
-                if (error.message.includes('Failed to fetch')) {
+                if (error.userMessage) {
+                    formStatus.textContent = error.userMessage;
+                } else if (error.message.includes('Failed to fetch')) {
                     formStatus.textContent = 'Unable to connect to the server. Please check if the server is running on port 5001.';
                 } else {
                     formStatus.textContent = 'An error occurred while submitting your inquiry. Please try again later.';
@@ -185,10 +211,14 @@ document.addEventListener('DOMContentLoaded', () => {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
+                    'Idempotency-Key': idempotencyKeyFor(JSON.stringify(subData)),
                 },
                 body: JSON.stringify(subData),
             })
             .then(response => {
+                if (response.status === 429) {
+                    return rateLimitError(response).then(error => { throw error; });
+                }
                 if (!response.ok) {
                     throw new Error('Network response was not ok: ' + response.statusText);
                 }
@@ -202,7 +232,7 @@ document.addEventListener('DOMContentLoaded', () => {
             })
             .catch(error => {
                 console.error('Error:', error);
-                subscriptionFormStatus.textContent = 'An error occurred during subscription. Please try again later.';
+                subscriptionFormStatus.textContent = error.userMessage || 'An error occurred during subscription. Please try again later.';
                 subscriptionFormStatus.className = 'form-status error';
             });
 
@@ -2,32 +2,72 @@
 document.addEventListener('DOMContentLoaded', () => {
     // Get API base URL from config or use relative path
     const API_BASE_URL = window.appConfig?.API_BASE_URL || '';
+    // Number of images requested per page from the gallery manifest
+    const GALLERY_PAGE_SIZE = 12;
     let isGalleryInitialized = false;
     
-    // Function to load gallery images from server
+    // Function to load one page of gallery images from server
+    async function fetchGalleryPage(offset) {
+        const response = await fetch(`${API_BASE_URL}/api/gallery-images?offset=${offset}&limit=${GALLERY_PAGE_SIZE}`);
+        
+        if (!response.ok) {
+            throw new Error(`HTTP error! status: ${response.status}`);
+        }
+        
+        const data = await response.json();
+        return { images: data.success ? data.images : [], nextOffset: data.next_offset ?? null };
+    }
+    
+    // First page embedded by the server in index.html, if present
+    function readEmbeddedPage() {
+        const element = document.getElementById('gallery-manifest');
+        if (!element) return null;
+        try {
+            const data = JSON.parse(element.textContent);
+            return data.success ? { images: data.images, nextOffset: data.next_offset ?? null } : null;
+        } catch (error) {
+            console.warn('Ignoring invalid embedded gallery manifest:', error);
+            return null;
+        }
+    }
+    
+    // Function to load the first page of gallery images
     async function loadGalleryImages() {
         try {
-            const response = await fetch(`${API_BASE_URL}/api/gallery-images`);
-            
-            if (!response.ok) {
-                throw new Error(`HTTP error! status: ${response.status}`);
-            }
+            const page = readEmbeddedPage() || await fetchGalleryPage(0);
             
-            const data = await response.json();
-            
-            if (data.success && data.images.length > 0) {
-                return data.images;
+            if (page.images.length > 0) {
+                return page;
             } else {
                 console.warn('No images found in gallery');
-                return getDefaultImages();
+                return { images: getDefaultImages(), nextOffset: null };
             }
         } catch (error) {
             console.error('Error loading gallery images:', error);
             // Fallback to default images if API fails
-            return getDefaultImages();
+            return { images: getDefaultImages(), nextOffset: null };
         }
     }
     
+    // Load the remaining pages one at a time while the browser is idle
+    function loadRemainingPages(galleryWrapper, offset) {
+        if (offset === null) return;
+        
+        const whenIdle = window.requestIdleCallback || (callback => setTimeout(callback, 200));
+        whenIdle(async () => {
+            try {
+                const page = await fetchGalleryPage(offset);
+                appendSlides(galleryWrapper, page.images);
+                document.dispatchEvent(new CustomEvent('galleryImagesAppended', {
+                    detail: { imageCount: page.images.length }
+                }));
+                loadRemainingPages(galleryWrapper, page.nextOffset);
+            } catch (error) {
+                console.error('Error loading more gallery images:', error);
+            }
+        });
+    }
+    
     // Fallback default images
     function getDefaultImages() {
         // Return images that we know exist in the pg-photos folder
@@ -93,12 +133,36 @@ document.addEventListener('DOMContentLoaded', () => {
         return defaultImages;
     }
     
+    // Slide widths per Swiper breakpoint (1 / 2 / 3 slides per view)
+    const GALLERY_SIZES = '(max-width: 767px) 100vw, (max-width: 1023px) 50vw, 33vw';
+    
     // Function to create slide HTML
     function createSlideHTML(image) {
-        return `<img src="${image.url}" 
+        // Width/height let the browser reserve the right space before the image loads
+        const size = image.width && image.height ? `width="${image.width}" height="${image.height}"` : '';
+        const img = `<img src="${image.url}" 
                      alt="${image.alt}" 
+                     ${size}
                      loading="lazy"
                      onerror="this.onerror=null; this.style.display='none';">`;
+        
+        if (!image.srcset) return img;
+        
+        // Resized AVIF/WebP copies; the original stays as the <img> fallback
+        const sources = Object.entries(image.srcset)
+            .map(([format, srcset]) => `<source type="image/${format}" srcset="${srcset}" sizes="${GALLERY_SIZES}">`)
+            .join('');
+        return `<picture>${sources}${img}</picture>`;
+    }
+    
+    // Function to add image slides to the gallery wrapper
+    function appendSlides(galleryWrapper, images) {
+        images.forEach(image => {
+            const slide = document.createElement('div');
+            slide.className = 'swiper-slide';
+            slide.innerHTML = createSlideHTML(image);
+            galleryWrapper.appendChild(slide);
+        });
     }
     
     // Function to initialize gallery
@@ -110,8 +174,8 @@ document.addEventListener('DOMContentLoaded', () => {
         
         console.log('Initializing dynamic gallery...');
         
-        // Load images
-        const images = await loadGalleryImages();
+        // Load the first page of images
+        const { images, nextOffset } = await loadGalleryImages();
         console.log(`Loaded ${images.length} images for gallery`);
         
         // Clear loading state
@@ -130,12 +194,7 @@ document.addEventListener('DOMContentLoaded', () => {
         }
         
         // Add image slides
-        images.forEach(image => {
-            const slide = document.createElement('div');
-            slide.className = 'swiper-slide';
-            slide.innerHTML = createSlideHTML(image);
-            galleryWrapper.appendChild(slide);
-        });
+        appendSlides(galleryWrapper, images);
         
         // Notify gallery-slider.js that images are loaded
         const event = new CustomEvent('galleryImagesLoaded', { 
@@ -149,6 +208,9 @@ document.addEventListener('DOMContentLoaded', () => {
         }, 100);
         
         isGalleryInitialized = true;
+        
+        // Fetch the rest of the gallery in pages
+        loadRemainingPages(galleryWrapper, nextOffset);
     }
     
     // Wait a bit for other scripts to load, then initialize
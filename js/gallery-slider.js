@@ -115,6 +115,17 @@ document.addEventListener('DOMContentLoaded', () => {
         }, 100);
     });
     
+    // Listen for further pages of images appended to the gallery
+    document.addEventListener('galleryImagesAppended', () => {
+        if (!gallerySwiper) return;
+        // Rebuild loop clones so the new slides are part of the loop
+        if (gallerySwiper.params.loop && typeof gallerySwiper.loopDestroy === 'function') {
+            gallerySwiper.loopDestroy();
+            gallerySwiper.loopCreate();
+        }
+        gallerySwiper.update();
+    });
+    
     // Try to initialize on load (in case images are already there)
     initializeGallerySwiper();
 }); 
\ No newline at end of file
@@ -3,10 +3,6 @@
  * Registers the service worker for offline functionality
  */
 
-// Service Worker temporarily disabled for debugging
-console.log('Service Worker registration disabled for debugging');
-
-/*
 if ('serviceWorker' in navigator) {
   window.addEventListener('load', () => {
     navigator.serviceWorker.register('/service-worker.js')
@@ -18,4 +14,3 @@ if ('serviceWorker' in navigator) {
       });
   });
 }
-*/
\ No newline at end of file
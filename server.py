@@ -1,48 +1,455 @@
 #!/usr/bin/env python
-from flask import Flask, request, jsonify, send_from_directory, make_response
+from flask import Flask, Response, abort, request, jsonify, send_from_directory, send_file, make_response, g, has_request_context, stream_with_context
+from werkzeug.security import safe_join
+from werkzeug.wsgi import wrap_file
 import gspread
+import requests
 from google.oauth2.service_account import Credentials
-from datetime import datetime
+from datetime import datetime, timedelta
 import pytz
 import re
 import os
 import csv
 import json
 import logging
+import logging.handlers
 import base64
-import tempfile
+import binascii
+import copy
+import hmac
+import io
+import urllib.parse
+import random
+import sys
+import cProfile
+import pstats
+import functools
+import collections
+import math
+import concurrent.futures
+import time
+import uuid
+import stat
+import struct
+import hashlib
+import gzip
+import mimetypes
+import posixpath
+import atexit
+import sqlite3
+import threading
+import queue
+
+try:
+    from PIL import Image, ImageOps, features as pil_features
+except ImportError:  # Pillow is optional; without it the gallery serves originals only
+    Image = None
+
+try:
+    import brotli
+except ImportError:  # Brotli is optional; assets are then served gzip-compressed only
+    brotli = None
+
+try:
+    import fcntl
+except ImportError:  # No flock (Windows): every process then replays the outbox itself
+    fcntl = None
 
 app = Flask(__name__, static_folder='.', static_url_path='')
 
-# Check for Google credentials in environment
-if os.environ.get('GOOGLE_CREDENTIALS'):
-    # Decode and save credentials temporarily
-    credentials_base64 = os.environ.get('GOOGLE_CREDENTIALS')
-    credentials_json = base64.b64decode(credentials_base64)
-    
-    # Write to a temporary file
-    with tempfile.NamedTemporaryFile(mode='w', suffix='.json', delete=False) as f:
-        f.write(credentials_json.decode('utf-8'))
-        SERVICE_ACCOUNT_FILE = f.name
-else:
-    SERVICE_ACCOUNT_FILE = 'service-account.json'
-
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+# Google credentials come from GOOGLE_CREDENTIALS (base64 JSON) or this file
+SERVICE_ACCOUNT_FILE = os.environ.get('SERVICE_ACCOUNT_FILE', 'service-account.json')
+
+# --- Logging ---
+# Request threads only put records on a queue; a QueueListener thread formats
+# them (as JSON lines by default) and writes them to stderr.
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json')
+LOG_DEBUG_SAMPLE_RATE = float(os.environ.get('LOG_DEBUG_SAMPLE_RATE', 1.0))
+
+REDACT_EMAIL_PATTERN = re.compile(r'\b([A-Za-z0-9._%+-])[A-Za-z0-9._%+-]*@([A-Za-z0-9-]+(?:\.[A-Za-z0-9-]+)+)\b')
+# 7-15 digits, the range the booking form accepts
+REDACT_PHONE_PATTERN = re.compile(r'(?<![\w.:-])\+?\d(?:[\s().-]?\d){6,14}(?![\w.:])')
+REDACTED_KEYS = {'email', 'phone', 'authorization', 'cookie', 'x-admin-token'}
+REQUEST_CONTEXT_FIELDS = ('request_id', 'method', 'path', 'route')
+LOG_EXTRA_FIELDS = ('status', 'duration_ms', 'payload')
+
+def redact(value):
+    """Masks email addresses and phone numbers in strings, dicts and lists."""
+    if isinstance(value, str):
+        value = REDACT_EMAIL_PATTERN.sub(r'\1***@\2', value)
+        return REDACT_PHONE_PATTERN.sub(lambda m: '*' * (len(m.group(0)) - 2) + m.group(0)[-2:], value)
+    if isinstance(value, dict):
+        return {k: '[redacted]' if str(k).lower() in REDACTED_KEYS and v else redact(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [redact(v) for v in value]
+    return value
+
+class RequestContextFilter(logging.Filter):
+    """Copies the current request's ID and route onto records (runs in the request thread)."""
+
+    def filter(self, record):
+        if has_request_context():
+            record.request_id = getattr(g, 'request_id', None)
+            record.method = request.method
+            record.path = request.path
+            record.route = request.endpoint
+        return True
+
+class JsonLogFormatter(logging.Formatter):
+    """One redacted JSON object per line."""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': redact(record.getMessage()),
+        }
+        for field in REQUEST_CONTEXT_FIELDS + LOG_EXTRA_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = redact(value)
+        exc = record.exc_text or (self.formatException(record.exc_info) if record.exc_info else None)
+        if exc:
+            entry['exc'] = redact(exc)
+        return json.dumps(entry, default=str)
+
+class TextLogFormatter(logging.Formatter):
+    """Redacted single-line text, for local development (LOG_FORMAT=text)."""
+
+    def format(self, record):
+        return redact(super().format(record))
+
+class LogQueueHandler(logging.handlers.QueueHandler):
+    """Queues records with the message merged and the traceback kept apart in exc_text.
+
+    The stock prepare() appends the traceback to msg, which left JsonLogFormatter's
+    'exc' field empty and put the traceback inside 'msg'.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.msg = record.getMessage()
+        record.args = None
+        record.exc_info = None
+        return record
+
+_log_queue = queue.SimpleQueue()
+_log_listener = None
+_log_listener_pid = None
+
+def start_log_listener():
+    """(Re)starts the listener thread for this process; threads don't survive fork."""
+    global _log_listener, _log_listener_pid
+    if _log_listener_pid == os.getpid():
+        return
+    stream_handler = logging.StreamHandler()
+    if LOG_FORMAT == 'text':
+        stream_handler.setFormatter(TextLogFormatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+    else:
+        stream_handler.setFormatter(JsonLogFormatter())
+    _log_listener = logging.handlers.QueueListener(_log_queue, stream_handler)
+    _log_listener.start()
+    _log_listener_pid = os.getpid()
+
+def stop_log_listener():
+    if _log_listener is not None and _log_listener_pid == os.getpid():
+        _log_listener.stop()
+
+def setup_logging():
+    queue_handler = LogQueueHandler(_log_queue)
+    queue_handler.addFilter(RequestContextFilter())
+    root = logging.getLogger()
+    root.handlers[:] = [queue_handler]
+    root.setLevel(LOG_LEVEL)
+    start_log_listener()
+    atexit.register(stop_log_listener)
+
+setup_logging()
 logger = logging.getLogger(__name__)
+access_logger = logging.getLogger('access')
+
+@app.before_request
+def start_request_log():
+    g.request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex[:16]
+    g.request_started = time.perf_counter()
+
+def log_request(response):
+    """Writes the access log line and metrics, and echoes the request ID back to the client."""
+    started = getattr(g, 'request_started', None)
+    duration_ms = round((time.perf_counter() - started) * 1000, 2) if started else None
+    if started:
+        record_request_metrics(response, started)
+    access_logger.info(f"{request.method} {request.path} {response.status_code}",
+                       extra={'status': response.status_code, 'duration_ms': duration_ms})
+    response.headers['X-Request-ID'] = g.get('request_id', '')
+    return response
+
+# --- Metrics ---
+# In-process counters and histograms rendered in Prometheus text format on /metrics.
+# With METRICS_DIR set, every process also snapshots its own values to
+# METRICS_DIR/<pid>-<token>.json and /metrics sums all snapshots, so counters stay
+# correct across gunicorn workers (clear the directory when the server restarts).
+# Snapshots of exited workers are folded into METRICS_DIR/retired.json, so the
+# number of files (and the cost of a scrape) stays bounded as workers recycle.
+METRICS_DIR = os.environ.get('METRICS_DIR', '')
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 5))
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+class MetricsRegistry:
+    """Thread-safe labelled counters and histograms with a mergeable JSON snapshot."""
+
+    def __init__(self, directory=''):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._help = {}
+        self._counters = {}
+        self._histograms = {}
+        self._snapshot_path = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def counter(self, name, help_text):
+        self._help[name] = ('counter', help_text)
+
+    def histogram(self, name, help_text):
+        self._help[name] = ('histogram', help_text)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            series = self._histograms.get(key)
+            if series is None:
+                series = self._histograms[key] = [[0] * len(LATENCY_BUCKETS), 0.0, 0]
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += seconds
+            series[2] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return self._as_snapshot(self._counters, self._histograms)
+
+    @staticmethod
+    def _as_snapshot(counters, histograms):
+        return {
+            'counters': [[name, dict(labels), value] for (name, labels), value in counters.items()],
+            'histograms': [[name, dict(labels), list(s[0]), s[1], s[2]] for (name, labels), s in histograms.items()],
+        }
+
+    @staticmethod
+    def _merge(snapshots):
+        """Sums snapshots into ({(name, labels): value}, {(name, labels): [buckets, sum, count]})."""
+        counters, histograms = {}, {}
+        for snap in snapshots:
+            for name, labels, value in snap['counters']:
+                key = (name, tuple(sorted(labels.items())))
+                counters[key] = counters.get(key, 0) + value
+            for name, labels, buckets, total, count in snap['histograms']:
+                key = (name, tuple(sorted(labels.items())))
+                merged = histograms.setdefault(key, [[0] * len(LATENCY_BUCKETS), 0.0, 0])
+                merged[0] = [a + b for a, b in zip(merged[0], buckets)]
+                merged[1] += total
+                merged[2] += count
+        return counters, histograms
+
+    # Multiprocess aggregation
+    def start(self):
+        """Starts snapshotting this process to METRICS_DIR (restarted per pid after fork)."""
+        if not self.directory:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        if self._snapshot_path is None:
+            atexit.register(self.retire)
+        else:
+            # Forked from a process that already snapshots its own values
+            with self._lock:
+                self._counters.clear()
+                self._histograms.clear()
+        self._snapshot_path = os.path.join(self.directory, f"{os.getpid()}-{uuid.uuid4().hex[:8]}.json")
+        self._thread = threading.Thread(target=self._run, name='metrics-snapshot', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(METRICS_FLUSH_INTERVAL):
+            self.write_snapshot()
+
+    def write_snapshot(self):
+        path = self._snapshot_path
+        if not path:
+            return
+        try:
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(self.snapshot(), f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Error writing metrics snapshot: {e}")
+
+    def _lock_directory(self, exclusive):
+        """Opens and flocks METRICS_DIR/.lock (shared to read snapshots, exclusive to fold them)."""
+        lock = open(os.path.join(self.directory, '.lock'), 'a')
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        return lock
+
+    @staticmethod
+    def _read(path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None  # A worker is mid-write or the file was just removed
+
+    def _fold(self, paths):
+        """Adds the given snapshots to retired.json and removes them."""
+        retired = os.path.join(self.directory, 'retired.json')
+        lock = self._lock_directory(exclusive=True)
+        try:
+            snapshots = [snap for snap in map(self._read, [retired] + paths) if snap is not None]
+            tmp_path = f"{retired}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(self._as_snapshot(*self._merge(snapshots)), f)
+            os.replace(tmp_path, retired)
+            for path in paths:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+        except OSError as e:
+            logger.warning(f"Error folding metrics snapshots: {e}")
+        finally:
+            lock.close()
+
+    def fold_dead_snapshots(self):
+        """Folds the snapshots of workers that died without retiring (e.g. killed on timeout)."""
+        dead = []
+        for filename in os.listdir(self.directory):
+            pid = filename.split('-', 1)[0]
+            path = os.path.join(self.directory, filename)
+            if not filename.endswith('.json') or not pid.isdigit() or path == self._snapshot_path:
+                continue
+            try:
+                os.kill(int(pid), 0)
+            except ProcessLookupError:
+                dead.append(path)
+            except PermissionError:
+                pass
+        if dead:
+            self._fold(dead)
+
+    def retire(self):
+        """At exit: folds this process's final values into retired.json."""
+        path = self._snapshot_path
+        if not path:
+            return
+        self._stop.set()
+        if self._thread is not None and self._thread.is_alive():
+            self._thread.join(1.0)
+        self.write_snapshot()
+        self._snapshot_path = None
+        self._fold([path])
+
+    def collect(self):
+        """Merged counters and histograms from every process (or just this one)."""
+        snapshots = [self.snapshot()]
+        if self._snapshot_path:
+            self.fold_dead_snapshots()
+            lock = self._lock_directory(exclusive=False)
+            try:
+                for filename in os.listdir(self.directory):
+                    path = os.path.join(self.directory, filename)
+                    if filename.endswith('.json') and path != self._snapshot_path:
+                        snapshots.append(self._read(path))
+            finally:
+                lock.close()
+        return self._merge(snap for snap in snapshots if snap is not None)
+
+    def render(self, gauges=()):
+        """Prometheus text exposition format (version 0.0.4)."""
+        counters, histograms = self.collect()
+        by_name = {}
+        for (name, labels), value in counters.items():
+            by_name.setdefault(name, []).append((labels, value))
+        for (name, labels), series in histograms.items():
+            by_name.setdefault(name, []).append((labels, series))
+        lines = []
+        for name in sorted(set(by_name) | set(self._help)):
+            kind, help_text = self._help.get(name, ('untyped', ''))
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in sorted(by_name.get(name, []), key=lambda item: item[0]):
+                if kind == 'histogram':
+                    buckets, total, count = value
+                    cumulative = 0
+                    for bound, n in zip(LATENCY_BUCKETS, buckets):
+                        cumulative += n
+                        lines.append(f"{name}_bucket{format_labels(labels + (('le', f'{bound:g}'),))} {cumulative}")
+                    lines.append(f"{name}_bucket{format_labels(labels + (('le', '+Inf'),))} {count}")
+                    lines.append(f"{name}_sum{format_labels(labels)} {total:.6f}")
+                    lines.append(f"{name}_count{format_labels(labels)} {count}")
+                else:
+                    lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+        for name, help_text, samples in gauges:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            for labels, value in samples:
+                lines.append(f"{name}{format_labels(tuple(sorted(labels.items())))} {format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+def format_value(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in labels)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + '}'
+
+metrics = MetricsRegistry(METRICS_DIR)
+metrics.counter('http_requests_total', "HTTP requests by Flask endpoint, method and status code.")
+metrics.histogram('http_request_duration_seconds', "HTTP request latency by Flask endpoint.")
+metrics.counter('http_response_bytes_total', "Response body bytes served by Flask endpoint.")
+metrics.histogram('sheets_call_duration_seconds', "Google Sheets API call latency (including retries) by operation.")
+metrics.counter('sheets_call_errors_total', "Failed Google Sheets API calls by operation and error type.")
+metrics.counter('sheets_call_retries_total', "Retried Google Sheets API attempts by operation.")
+metrics.counter('sheets_calls_rejected_total', "Google Sheets calls skipped because the circuit breaker was open.")
+metrics.histogram('outbox_write_duration_seconds', "Local outbox commit latency by inquiry kind.")
+metrics.counter('outbox_write_errors_total', "Inquiries that could not be saved to the local outbox.")
+metrics.counter('outbox_fallback_total', "Inquiries stored while Google Sheets was unavailable, by kind.")
+metrics.counter('outbox_rows_synced_total', "Outbox rows appended to Google Sheets.")
+metrics.counter('rate_limited_total', "POSTs rejected with 429 by the per-client rate limiter, by endpoint.")
+metrics.counter('idempotent_replays_total', "Repeated POSTs answered from the idempotency cache, by endpoint.")
+
+def record_request_metrics(response, started):
+    endpoint = request.endpoint or 'unmatched'
+    metrics.inc('http_requests_total', endpoint=endpoint, method=request.method, status=response.status_code)
+    metrics.observe('http_request_duration_seconds', time.perf_counter() - started, endpoint=endpoint)
+    metrics.inc('http_response_bytes_total', response.content_length or 0, endpoint=endpoint)
 
 # Helper function to add CORS headers
 def add_cors_headers(response):
     response.headers['Access-Control-Allow-Origin'] = '*'
     response.headers['Access-Control-Allow-Methods'] = 'GET, POST, OPTIONS, PUT, DELETE'
-    response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Accept, Authorization'
+    response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Accept, Authorization, Idempotency-Key, X-Profile'
+    response.headers['Access-Control-Expose-Headers'] = 'Retry-After, X-Request-ID, X-Next-Cursor, Link, X-Profile-ID'
     response.headers['Access-Control-Max-Age'] = '86400'
     return response
 
-# Add CORS to all responses
+# Add CORS to all responses and write the access log
 @app.after_request
 def after_request(response):
-    return add_cors_headers(response)
+    return log_request(add_cors_headers(response))
 
 # --- Google Sheets Configuration ---
 SPREADSHEET_ID = os.environ.get('SPREADSHEET_ID', '1PbwSgLYvDl_FN3oUfwsFFTidS12c68yu8yRAOiZHiNY')
@@ -51,12 +458,52 @@ SHEET_NAME = os.environ.get('SHEET_NAME', '2025')
 # Define the scope for Google Sheets and Drive API
 SCOPE = ['https://www.googleapis.com/auth/spreadsheets', 'https://www.googleapis.com/auth/drive']
 
-# Updated SHEET_HEADERS
-SHEET_HEADERS = ['Date', 'Time', 'Name', 'Email', 'Phone', 'VisitDate', 'Message']
+# Updated SHEET_HEADERS (ID is the outbox row_id, used to make replays idempotent)
+SHEET_HEADERS = ['Date', 'Time', 'Name', 'Email', 'Phone', 'VisitDate', 'Message', 'ID']
+ID_COLUMN = 8  # Column H
 
-# CSV Fallback file
+# Legacy CSV fallback file (imported into the SQLite outbox at startup; no longer written)
 CSV_FILE = 'inquiries.csv'
 
+# --- Time-partitioned worksheets ---
+# Rows go to one tab per period of their own (IST) date: '2026' by year or
+# '2026-10' by month. A tab is created with headers when its first row is
+# written; with SHEET_PARTITION=none every row goes to SHEET_NAME.
+IST = pytz.timezone('Asia/Kolkata')
+SHEET_PARTITION = os.environ.get('SHEET_PARTITION', 'year')  # 'year', 'month' or 'none'
+SHEET_PARTITION_ROWS = int(os.environ.get('SHEET_PARTITION_ROWS', 1000))
+# A past period's tab is read one last time this long after it ends, then never again
+PARTITION_CLOSE_GRACE = timedelta(days=float(os.environ.get('PARTITION_CLOSE_GRACE_DAYS', 7)))
+PARTITION_TITLE_PATTERNS = {'year': re.compile(r'^(\d{4})$'), 'month': re.compile(r'^(\d{4})-(\d{2})$')}
+
+def partition_title(date_str=None):
+    """Worksheet title for a row dated 'dd-mm-YYYY' (IST), or for today."""
+    if SHEET_PARTITION == 'none':
+        return SHEET_NAME
+    try:
+        day = datetime.strptime(date_str, '%d-%m-%Y') if date_str else datetime.now(IST)
+    except ValueError:
+        day = datetime.now(IST)
+    return day.strftime('%Y' if SHEET_PARTITION == 'year' else '%Y-%m')
+
+def is_partition_title(title):
+    """Whether a tab holds inquiry rows (any period's tab, or SHEET_NAME)."""
+    return title == SHEET_NAME or any(p.match(title) for p in PARTITION_TITLE_PATTERNS.values())
+
+def partition_closed(title, now=None):
+    """Whether a period tab's period ended more than PARTITION_CLOSE_GRACE ago (other tabs never close)."""
+    year = PARTITION_TITLE_PATTERNS['year'].match(title)
+    month = PARTITION_TITLE_PATTERNS['month'].match(title)
+    if year:
+        end = datetime(int(year.group(1)) + 1, 1, 1)
+    elif month and 1 <= int(month.group(2)) <= 12:
+        y, m = int(month.group(1)), int(month.group(2))
+        end = datetime(y + m // 12, m % 12 + 1, 1)
+    else:
+        return False
+    now = now or datetime.now(IST)
+    return IST.localize(end) + PARTITION_CLOSE_GRACE < now
+
 # --- Helper Function to Initialize Google Sheet and Add Headers ---
 def initialize_google_sheet(worksheet):
     """Checks if the sheet is empty and adds headers if it is."""
@@ -65,142 +512,1735 @@ def initialize_google_sheet(worksheet):
         # Check against new headers
         if not first_row_values or first_row_values != SHEET_HEADERS:
             if first_row_values and first_row_values != SHEET_HEADERS:
-                print(f"First row of '{worksheet.title}' exists but doesn't match new headers. Overwriting.")
-            # Update to new headers and range (A1:G1 for 7 columns)
-            if not worksheet.row_values(1) == SHEET_HEADERS:
-                worksheet.update('A1:G1', [SHEET_HEADERS]) # Updated range
-                print(f"Headers set/updated in '{worksheet.title}' to: {SHEET_HEADERS}")
+                logger.warning(f"First row of '{worksheet.title}' exists but doesn't match new headers. Overwriting.")
+            # Update to new headers and range (A1:H1 for 8 columns)
+            worksheet.update('A1:H1', [SHEET_HEADERS]) # Updated range
+            logger.info(f"Headers set/updated in '{worksheet.title}' to: {SHEET_HEADERS}")
     except gspread.exceptions.APIError as e:
         if hasattr(e, 'response') and e.response.status_code == 400:
-            print(f"Sheet '{worksheet.title}' appears empty or unformatted. Writing headers: {SHEET_HEADERS}")
-            worksheet.update('A1:G1', [SHEET_HEADERS]) # Updated range
+            logger.info(f"Sheet '{worksheet.title}' appears empty or unformatted. Writing headers: {SHEET_HEADERS}")
+            worksheet.update('A1:H1', [SHEET_HEADERS]) # Updated range
         else:
-            print(f"API error during Google Sheet header initialization: {e}")
+            logger.error(f"API error during Google Sheet header initialization: {e}")
     except Exception as e:
-        print(f"Error initializing Google Sheet headers: {e}")
-
-# --- Helper Function to Initialize CSV File ---
-def initialize_csv_file():
-    """Creates CSV file with headers if it doesn't exist."""
-    if not os.path.exists(CSV_FILE):
-        with open(CSV_FILE, 'w', newline='', encoding='utf-8') as file:
-            writer = csv.writer(file)
-            writer.writerow(SHEET_HEADERS)
-        print(f"Created CSV file '{CSV_FILE}' with headers.")
-
-# --- Helper Function to Write to CSV ---
-def write_to_csv(row_data):
-    """Writes data to CSV file."""
-    try:
-        with open(CSV_FILE, 'a', newline='', encoding='utf-8') as file:
-            writer = csv.writer(file)
-            writer.writerow(row_data)
-        print(f"Inquiry saved to CSV file: {row_data[2]} ({row_data[3]})")
+        logger.error(f"Error initializing Google Sheet headers: {e}")
+
+# --- Local SQLite outbox ---
+# Every inquiry and subscription is committed here first; a background
+# replayer pushes unsynced rows to Google Sheets in batches. The database
+# lives in data/, not the app root: the root is Flask's static folder.
+OUTBOX_DB = os.environ.get('OUTBOX_DB', os.path.join('data', 'inquiries.db'))
+OUTBOX_LOCK_FILE = os.environ.get('OUTBOX_LOCK_FILE', f'{OUTBOX_DB}.lock')
+OUTBOX_LEGACY_DB = 'inquiries.db'  # Default location before data/
+SHEETS_BATCH_SIZE = int(os.environ.get('SHEETS_BATCH_SIZE', 50))
+SHEETS_FLUSH_INTERVAL = float(os.environ.get('SHEETS_FLUSH_INTERVAL', 2.0))
+SHEETS_RETRY_INTERVAL = float(os.environ.get('SHEETS_RETRY_INTERVAL', 30.0))
+
+OUTBOX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    row_id TEXT NOT NULL UNIQUE,
+    kind TEXT NOT NULL,
+    date TEXT NOT NULL,
+    time TEXT NOT NULL,
+    name TEXT NOT NULL,
+    email TEXT NOT NULL,
+    phone TEXT NOT NULL DEFAULT '',
+    visit_date TEXT NOT NULL DEFAULT '',
+    message TEXT NOT NULL DEFAULT '',
+    created_at REAL NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    synced_at REAL,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_outbox_status ON outbox (status, id);
+CREATE INDEX IF NOT EXISTS idx_outbox_email ON outbox (email);
+CREATE INDEX IF NOT EXISTS idx_outbox_email_nocase ON outbox (email COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS idx_outbox_created ON outbox (created_at, id);
+CREATE TABLE IF NOT EXISTS service_state (
+    key TEXT PRIMARY KEY,
+    value REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sheet_emails (
+    email TEXT PRIMARY KEY,
+    worksheet TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS sheet_partitions (
+    title TEXT PRIMARY KEY,
+    rows_read INTEGER NOT NULL DEFAULT 0,
+    closed INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+# Sync states: 'pending' -> 'sending' -> 'synced'. Rows left in 'sending'
+# (e.g. a timeout or crash mid-append) are reconciled against the sheet's ID
+# column before being retried, so a retry never duplicates a row. Rows
+# imported from the legacy CSV start as 'legacy': the replayer looks each one
+# up in the worksheets once (by Date, Time and Email) and marks it 'synced' if
+# found, 'pending' otherwise.
+#
+# The database is shared by every gunicorn worker: writes are serialized by
+# SQLite, and only the worker holding OUTBOX_LOCK_FILE runs the replayer.
+OUTBOX_COLUMNS = ['date', 'time', 'name', 'email', 'phone', 'visit_date', 'message']
+
+class Outbox:
+    """SQLite (WAL mode) store of every row we accept, with per-row sync status."""
+
+    def __init__(self, path=OUTBOX_DB):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with self._conn() as conn:
+            conn.executescript(OUTBOX_SCHEMA)
+        self._migrate()
+
+    def _migrate(self):
+        """Adds columns introduced after a database was created (workers may race, hence the transaction)."""
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            columns = {r['name'] for r in conn.execute("PRAGMA table_info(outbox)")}
+            if 'idempotency_key' not in columns:
+                conn.execute("ALTER TABLE outbox ADD COLUMN idempotency_key TEXT")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_idempotency ON outbox (idempotency_key, created_at)")
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=FULL')
+            self._local.conn = conn
+        return conn
+
+    def add(self, kind, row_data, unique_email=False, idempotency_key=None, window=0):
+        """Commits a SHEET_HEADERS-ordered row and returns its row_id.
+
+        With unique_email, returns None instead if the email is already stored.
+        With idempotency_key, returns the row_id of a row stored under the same
+        key in the last ``window`` seconds instead of adding another. The checks
+        and insert share one transaction, so concurrent workers can't both add
+        the same address or the same submission.
+        """
+        row_id = uuid.uuid4().hex
+        now = time.time()
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if idempotency_key:
+                existing = conn.execute(
+                    "SELECT row_id FROM outbox WHERE idempotency_key = ? AND created_at >= ? ORDER BY id LIMIT 1",
+                    (idempotency_key, now - window)).fetchone()
+                if existing is not None:
+                    conn.execute('ROLLBACK')
+                    return existing['row_id']
+            if unique_email and self.has_email(row_data[3]):
+                conn.execute('ROLLBACK')
+                return None
+            conn.execute(
+                f"INSERT INTO outbox (row_id, kind, {', '.join(OUTBOX_COLUMNS)}, created_at, idempotency_key) "
+                f"VALUES (?, ?, {', '.join('?' * len(OUTBOX_COLUMNS))}, ?, ?)",
+                [row_id, kind] + [str(v) for v in row_data[:len(OUTBOX_COLUMNS)]] + [now, idempotency_key])
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return row_id
+
+    def has_email(self, email):
+        """Whether the address is in the outbox or was read from any worksheet (sheet_emails)."""
+        email = email.strip()
+        return self._conn().execute(
+            "SELECT 1 FROM outbox WHERE email = ? COLLATE NOCASE "
+            "UNION ALL SELECT 1 FROM sheet_emails WHERE email = ? LIMIT 1",
+            (email, email.lower())).fetchone() is not None
+
+    @staticmethod
+    def sheet_row(record):
+        """Builds the sheet row (SHEET_HEADERS order, ID last) for an outbox record."""
+        return [record[c] for c in OUTBOX_COLUMNS] + [record['row_id']]
+
+    def claim_batch(self, limit):
+        """Marks up to ``limit`` pending rows as 'sending' and returns them, oldest first."""
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            records = conn.execute(
+                "SELECT * FROM outbox WHERE status = 'pending' ORDER BY id LIMIT ?", (limit,)).fetchall()
+            conn.executemany(
+                "UPDATE outbox SET status = 'sending', attempts = attempts + 1 WHERE id = ?",
+                [(r['id'],) for r in records])
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return records
+
+    def mark_synced(self, row_ids):
+        self._conn().executemany(
+            "UPDATE outbox SET status = 'synced', synced_at = ?, last_error = NULL WHERE row_id = ?",
+            [(time.time(), row_id) for row_id in row_ids])
+
+    def mark_pending(self, row_ids, error=None):
+        self._conn().executemany(
+            "UPDATE outbox SET status = 'pending', last_error = ? WHERE row_id = ?",
+            [(error, row_id) for row_id in row_ids])
+
+    def in_flight(self):
+        """(row_id, date) of the rows whose append may or may not have reached the sheet."""
+        return self._conn().execute("SELECT row_id, date FROM outbox WHERE status = 'sending'").fetchall()
+
+    def emails(self):
+        return [r['email'] for r in self._conn().execute(
+            "SELECT DISTINCT email FROM outbox UNION SELECT email FROM sheet_emails")]
+
+    # Cross-partition index of the emails found in the worksheets, read incrementally per tab
+    def sheet_partitions(self):
+        """{worksheet title: (rows already read into sheet_emails, closed)}."""
+        return {r['title']: (r['rows_read'], bool(r['closed'])) for r in self._conn().execute(
+            "SELECT title, rows_read, closed FROM sheet_partitions")}
+
+    def record_sheet_emails(self, title, emails, rows_read, closed=False):
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany("INSERT OR IGNORE INTO sheet_emails (email, worksheet) VALUES (?, ?)",
+                             [(email.strip().lower(), title) for email in emails])
+            conn.execute(
+                "INSERT INTO sheet_partitions (title, rows_read, closed) VALUES (?, ?, ?) "
+                "ON CONFLICT(title) DO UPDATE SET rows_read = MAX(rows_read, excluded.rows_read), "
+                "closed = excluded.closed", (title, rows_read, int(closed)))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def legacy_rows(self):
+        """(row_id, date, time, email) of the imported CSV rows not yet checked against the sheet."""
+        return self._conn().execute(
+            "SELECT row_id, date, time, email FROM outbox WHERE status = 'legacy'").fetchall()
+
+    def unsynced_summary(self):
+        """(count, created_at of the oldest unsynced row)."""
+        row = self._conn().execute(
+            "SELECT COUNT(*), MIN(created_at) FROM outbox WHERE status IN ('pending', 'sending')").fetchone()
+        return row[0], row[1]
+
+    def counts(self):
+        rows = self._conn().execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
+
+    def import_rows(self, records, status='legacy'):
+        """Inserts already-normalized records, skipping row_ids that exist. Returns rows added."""
+        conn = self._conn()
+        before = conn.total_changes
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany(
+                f"INSERT OR IGNORE INTO outbox (row_id, kind, {', '.join(OUTBOX_COLUMNS)}, created_at, status) "
+                f"VALUES (:row_id, :kind, {', '.join(':' + c for c in OUTBOX_COLUMNS)}, :created_at, '{status}')",
+                records)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return conn.total_changes - before
+
+    @staticmethod
+    def _filters(start=None, end=None, kind=None, email=None, after=None):
+        clauses, params = [], []
+        if start is not None:
+            clauses.append("created_at >= ?")
+            params.append(start)
+        if end is not None:
+            clauses.append("created_at < ?")
+            params.append(end)
+        if kind:
+            clauses.append("kind = ?")
+            params.append(kind)
+        if email:
+            clauses.append("email = ? COLLATE NOCASE")
+            params.append(email.strip())
+        if after is not None:
+            clauses.append("(created_at > ? OR (created_at = ? AND id > ?))")
+            params.extend([after[0], after[0], after[1]])
+        return (' WHERE ' + ' AND '.join(clauses)) if clauses else '', params
+
+    def query(self, limit, **filters):
+        """Cursor over matching rows in (created_at, id) order; rows are fetched as it's iterated."""
+        where, params = self._filters(**filters)
+        return self._conn().execute(
+            f"SELECT * FROM outbox{where} ORDER BY created_at, id LIMIT ?", params + [limit])
+
+    def page_end(self, limit, **filters):
+        """(created_at, id) of the page's last row if more rows follow it, else None."""
+        where, params = self._filters(**filters)
+        rows = self._conn().execute(
+            f"SELECT created_at, id FROM outbox{where} ORDER BY created_at, id LIMIT 2 OFFSET ?",
+            params + [limit - 1]).fetchall()
+        return tuple(rows[0]) if len(rows) == 2 else None
+
+    # Small key/value table for state every worker must agree on
+    def get_state(self, key, default=None):
+        row = self._conn().execute("SELECT value FROM service_state WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_state(self, key, value):
+        self._conn().execute(
+            "INSERT INTO service_state (key, value) VALUES (?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value", (key, value))
+
+
+class OutboxReplayer:
+    """Background thread that pushes unsynced outbox rows to Google Sheets.
+
+    Rows are flushed with append_rows once batch_size rows are waiting or the
+    oldest has waited max_delay seconds. Failed flushes are retried with
+    exponential backoff, and everything pending is flushed on shutdown.
+
+    With several worker processes only the one holding an exclusive flock on
+    lock_path replays (the others retry the lock every max_delay seconds and
+    take over if the leader exits), so batches are never claimed or
+    reconciled by two processes at once.
+    """
+
+    def __init__(self, outbox, batch_size=SHEETS_BATCH_SIZE, max_delay=SHEETS_FLUSH_INTERVAL,
+                 retry_interval=SHEETS_RETRY_INTERVAL, lock_path=OUTBOX_LOCK_FILE):
+        self.outbox = outbox
+        self.lock_path = lock_path
+        self.is_leader = False
+        self._lock_file = None
+        self._lock_pid = None
+        self.batch_size = max(1, batch_size)
+        self.max_delay = max(0.0, max_delay)
+        self.retry_interval = retry_interval
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._failures = 0
+        self._retry_at = 0.0
+        self.rows_flushed = 0
+        self.last_flush_at = None
+        self.last_error = None
+
+    def start(self):
+        """Starts the background replay thread (safe to call more than once)."""
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='outbox-replayer', daemon=True)
+            self._thread.start()
+
+    def notify(self):
+        """Tells the replayer a new row was committed."""
+        self._wake.set()
+
+    def _acquire_leadership(self):
+        """Tries (without blocking) to become the one process that replays."""
+        if fcntl is None:
+            return True
+        if self._lock_pid != os.getpid():
+            # A lock file inherited across fork shares the parent's lock; open our own
+            self._lock_file = open(self.lock_path, 'a')
+            self._lock_pid = os.getpid()
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return False
+        logger.info(f"Outbox replayer leader is now pid {os.getpid()}")
         return True
+
+    def _next_wait(self):
+        """Seconds until the next replay is due (0 means now)."""
+        if not sheets.connected:
+            return self.retry_interval  # notify() wakes us once connected
+        now = time.time()
+        if self._retry_at > now:
+            return self._retry_at - now
+        if not sheets_breaker.available():
+            return max(1.0, sheets_breaker.retry_in())
+        count, oldest = self.outbox.unsynced_summary()
+        if not count:
+            # Other workers commit rows without waking us, so keep polling
+            return max(1.0, self.max_delay)
+        if count >= self.batch_size:
+            return 0
+        return max(0.0, oldest + self.max_delay - now)
+
+    def _run(self):
+        while not self._stop.is_set():
+            if not self.is_leader:
+                self.is_leader = self._acquire_leadership()
+            wait = self._next_wait() if self.is_leader else max(1.0, self.max_delay)
+            if wait > 0:
+                # Woken early by notify() or shutdown; re-check what's due
+                self._wake.wait(wait)
+                self._wake.clear()
+                continue
+            self.replay()
+        # Flush whatever is left before the thread exits (the lock is released at exit)
+        if self.is_leader:
+            self.replay()
+
+    @staticmethod
+    def _by_partition(records):
+        """{worksheet title: [records]} in order of first appearance."""
+        groups = {}
+        for record in records:
+            groups.setdefault(partition_title(record['date']), []).append(record)
+        return groups
+
+    def _reconcile(self):
+        """Resolves rows stuck in 'sending' by checking which IDs already reached their partition's tab."""
+        stuck = self.outbox.in_flight()
+        if not stuck:
+            return
+        landed, missing = [], []
+        for title, records in self._by_partition(stuck).items():
+            ws = sheets.worksheets.get(title)
+            in_sheet = set(ws.col_values(ID_COLUMN)[1:]) if ws is not None else set()
+            for record in records:
+                (landed if record['row_id'] in in_sheet else missing).append(record['row_id'])
+        self.outbox.mark_synced(landed)
+        self.outbox.mark_pending(missing)
+        logger.info(f"Reconciled {len(stuck)} in-flight row(s): {len(landed)} already in Google Sheet")
+
+    @staticmethod
+    def _sheet_key(date, time_str, email):
+        """(date, time, email) normalized so a CSV row matches the sheet row it was copied from."""
+        day = normalize_legacy_date(date)
+        clock = time_str.strip().upper()
+        for fmt in ('%I:%M:%S %p', '%H:%M:%S', '%I:%M %p', '%H:%M'):
+            try:
+                clock = datetime.strptime(clock, fmt).strftime('%H:%M:%S')
+                break
+            except ValueError:
+                continue
+        return day, clock, email.strip().lower()
+
+    def _reconcile_legacy(self):
+        """Resolves rows imported from the legacy CSV: synced if a worksheet has them, else queued.
+
+        Runs once, when there are 'legacy' rows; reads columns A:D of every inquiry tab.
+        """
+        legacy = self.outbox.legacy_rows()
+        if not legacy:
+            return
+        in_sheet = set()
+        for title, ws in sheets.worksheets.items():
+            if is_partition_title(title):
+                in_sheet.update(self._sheet_key(row[0], row[1], row[3])
+                                for row in ws.get_values('A2:D') if len(row) >= 4)
+        landed, missing = [], []
+        for record in legacy:
+            key = self._sheet_key(record['date'], record['time'], record['email'])
+            (landed if key in in_sheet else missing).append(record['row_id'])
+        self.outbox.mark_synced(landed)
+        self.outbox.mark_pending(missing)
+        logger.info(f"Checked {len(legacy)} legacy CSV row(s) against Google Sheets: "
+                    f"{len(landed)} already there, {len(missing)} queued")
+
+    def replay(self):
+        """Pushes every pending row to its partition's tab in batches. Returns the number of rows synced."""
+        if not sheets.connected or not sheets_breaker.available():
+            return 0
+        synced = 0
+        try:
+            self._reconcile_legacy()
+            self._reconcile()
+            while True:
+                records = self.outbox.claim_batch(self.batch_size)
+                if not records:
+                    break
+                groups = list(self._by_partition(records).items())
+                for i, (title, group) in enumerate(groups):
+                    row_ids = [r['row_id'] for r in group]
+                    unsent = [r['row_id'] for _, later in groups[i + 1:] for r in later]
+                    try:
+                        ws = sheets.worksheet_for(title)
+                        ws.append_rows([Outbox.sheet_row(r) for r in group], value_input_option='USER_ENTERED')
+                    except gspread.exceptions.APIError as e:
+                        status = e.response.status_code
+                        if status < 500:
+                            # Google rejected the request (4xx, 429 included), so nothing was written
+                            self.outbox.mark_pending(row_ids + unsent, str(e))
+                        else:
+                            # A 5xx append may still have landed; leave it 'sending' for _reconcile
+                            self.outbox.mark_pending(unsent, str(e))
+                        if status in (401, 403, 404):
+                            sheets.mark_broken(e)
+                        raise
+                    except CircuitOpenError as e:
+                        self.outbox.mark_pending(row_ids + unsent, str(e))
+                        raise
+                    self.outbox.mark_synced(row_ids)
+                    synced += len(group)
+                    self.rows_flushed += len(group)
+                    metrics.inc('outbox_rows_synced_total', len(group))
+                    self.last_flush_at = time.time()
+                    logger.info(f"Flushed {len(group)} row(s) to worksheet '{title}'")
+            self._failures = 0
+            self._retry_at = 0.0
+        except Exception as e:
+            # Anything else (e.g. a timeout) may have landed; leave it 'sending' to reconcile
+            self._failures += 1
+            self._retry_at = time.time() + min(self.retry_interval * 2 ** (self._failures - 1), 600)
+            self.last_error = str(e)
+            logger.warning(f"Failed to sync outbox to Google Sheets (rows kept locally): {e}")
+        return synced
+
+    def flush_and_stop(self, timeout=10.0):
+        """Stops the thread after one last replay of everything pending."""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None and self._thread.is_alive():
+            self._thread.join(timeout)
+
+    def stats(self):
+        """Unsynced row count and how long the oldest one has been waiting."""
+        count, oldest = self.outbox.unsynced_summary()
+        return {
+            "leader": self.is_leader,
+            "pid": os.getpid(),
+            "depth": count,
+            "lag_seconds": round(time.time() - oldest, 3) if oldest else 0.0,
+            "status_counts": self.outbox.counts(),
+            "rows_flushed": self.rows_flushed,
+            "last_flush_at": datetime.fromtimestamp(self.last_flush_at).isoformat() if self.last_flush_at else None,
+            "last_error": self.last_error,
+            "batch_size": self.batch_size,
+            "max_delay_seconds": self.max_delay,
+        }
+
+def migrate_legacy_outbox(path=OUTBOX_DB, legacy_path=OUTBOX_LEGACY_DB):
+    """Moves an outbox left at the old default path (and its WAL files) to path.
+
+    Workers start together, so the move happens under a flock and only while
+    nothing exists at path yet.
+    """
+    if 'OUTBOX_DB' in os.environ or not os.path.exists(legacy_path):
+        return
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(f'{path}.migrate', 'a') as lock:
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        if os.path.exists(legacy_path) and not os.path.exists(path):
+            for suffix in ('-wal', '-shm', ''):  # The database last, so its presence means done
+                if os.path.exists(legacy_path + suffix):
+                    os.replace(legacy_path + suffix, path + suffix)
+            logger.info(f"Moved outbox {legacy_path} to {path}")
+
+migrate_legacy_outbox()
+outbox = Outbox()
+outbox_replayer = OutboxReplayer(outbox)
+
+# Server state that sits under the app root must never go out through the
+# static route (the root is Flask's static folder)
+PRIVATE_FILES = {os.path.realpath(p) for p in (
+    OUTBOX_DB, f'{OUTBOX_DB}-wal', f'{OUTBOX_DB}-shm', OUTBOX_LOCK_FILE, f'{OUTBOX_DB}.migrate',
+    OUTBOX_LEGACY_DB, f'{OUTBOX_LEGACY_DB}-wal', f'{OUTBOX_LEGACY_DB}-shm', f'{OUTBOX_LEGACY_DB}.lock',
+    CSV_FILE, SERVICE_ACCOUNT_FILE)}
+PRIVATE_DIRS = [os.path.realpath(d) for d in {os.path.dirname(OUTBOX_DB), os.path.dirname(OUTBOX_LOCK_FILE)}
+                if os.path.realpath(d or '.') != os.path.realpath(app.static_folder)]
+
+@app.before_request
+def block_private_files():
+    if request.endpoint != 'static':
+        return None
+    path = safe_join(app.static_folder, request.view_args.get('filename', ''))
+    full = os.path.realpath(path) if path else ''
+    if full in PRIVATE_FILES or any(full.startswith(d + os.sep) for d in PRIVATE_DIRS):
+        abort(404)
+    return None
+atexit.register(outbox_replayer.flush_and_stop)
+
+def store_row(kind, row_data, unique_email=False, idempotency_key=None):
+    """Commits a row to the outbox and wakes the replayer.
+
+    Returns the row_id (the earlier row's, if idempotency_key matches a row
+    stored within IDEMPOTENCY_WINDOW by any worker), None if unique_email is
+    set and the email is already stored, or False if it couldn't be saved.
+    """
+    started = time.perf_counter()
+    try:
+        row_id = outbox.add(kind, row_data, unique_email=unique_email,
+                            idempotency_key=idempotency_key, window=IDEMPOTENCY_WINDOW)
     except Exception as e:
-        print(f"Error writing to CSV: {e}")
+        metrics.inc('outbox_write_errors_total', kind=kind)
+        logger.error(f"Error saving {kind} to outbox: {e}")
         return False
+    metrics.observe('outbox_write_duration_seconds', time.perf_counter() - started, kind=kind)
+    email_index.add(row_data[3])
+    if row_id is None:
+        return None
+    if not sheets.connected or not sheets_breaker.available():
+        metrics.inc('outbox_fallback_total', kind=kind)
+    outbox_replayer.notify()
+    logger.info(f"{kind.capitalize()} saved to outbox: {row_data[2]} ({row_data[3]})")
+    return row_id
 
-# --- Authenticate and get worksheet ---
-gc = None
-worksheet = None
-use_csv_fallback = False
+# --- Legacy CSV import ---
+# inquiries.csv predates the outbox and mixes layouts: an early
+# Timestamp,Name,Email,Phone,VisitDate,Message format (where a missing newline
+# glued two rows together) and the later Date,Time,... SHEET_HEADERS order.
+# Its rows are normalized into the outbox once, with status 'legacy'. Some
+# are fallback-only rows that never reached the sheet, so the replayer looks
+# them up in the worksheets and queues the missing ones.
+LEGACY_TIMESTAMP_FORMATS = ('%m/%d/%y %H:%M', '%Y-%m-%d %H:%M:%S', '%m/%d/%Y %H:%M', '%d-%m-%Y %I:%M:%S %p')
+LEGACY_VISIT_DATE_FORMATS = ('%Y-%m-%d', '%m/%d/%y', '%m/%d/%Y', '%d-%m-%Y')
+LEGACY_GLUED_TIMESTAMP = re.compile(r'^(.*?)(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})$')
+LEGACY_DATE_PATTERN = re.compile(r'^\d{2}-\d{2}-\d{4}$')
 
-# Initialize CSV file regardless
-initialize_csv_file()
+def parse_legacy_timestamp(value):
+    for fmt in LEGACY_TIMESTAMP_FORMATS:
+        try:
+            return IST.localize(datetime.strptime(value.strip(), fmt))
+        except ValueError:
+            continue
+    return None
 
-if os.path.exists(SERVICE_ACCOUNT_FILE):
-    try:
-        # Read service account file to get email
+def normalize_legacy_date(value):
+    """A sheet or CSV date as 'dd-mm-YYYY' (Sheets may have reformatted it)."""
+    for fmt in ('%d-%m-%Y', '%d/%m/%Y', '%Y-%m-%d'):
+        try:
+            return datetime.strptime(value.strip(), fmt).strftime('%d-%m-%Y')
+        except ValueError:
+            continue
+    return value.strip()
+
+def normalize_visit_date(value):
+    for fmt in LEGACY_VISIT_DATE_FORMATS:
+        try:
+            return datetime.strptime(value.strip(), fmt).strftime('%Y-%m-%d')
+        except ValueError:
+            continue
+    return value.strip()
+
+def normalize_legacy_fields(fields):
+    """Yields outbox records (OUTBOX_COLUMNS + created_at/kind/row_id) for one raw CSV row."""
+    fields = [f.strip() for f in fields]
+    if not fields or not any(fields) or fields[0] in ('Timestamp', 'Date'):
+        return
+    if LEGACY_DATE_PATTERN.match(fields[0]) and len(fields) >= 7:
+        # Date, Time, Name, Email, Phone, VisitDate, Message
+        stamp = parse_legacy_timestamp(f'{fields[0]} {fields[1]}')
+        name, email, phone, visit_date, message = fields[2:7]
+        rest = []
+    elif len(fields) >= 6:
+        # Timestamp, Name, Email, Phone, VisitDate, Message (+ a glued-on next row)
+        stamp = parse_legacy_timestamp(fields[0])
+        name, email, phone, visit_date, message = fields[1:6]
+        rest = fields[6:]
+        glued = LEGACY_GLUED_TIMESTAMP.match(message) if rest else None
+        if glued:
+            message = glued.group(1)
+            rest = [glued.group(2)] + rest
+    else:
+        logger.warning(f"Skipping unrecognized legacy CSV row with {len(fields)} field(s)")
+        return
+    if stamp is None:
+        logger.warning("Skipping legacy CSV row with an unparseable timestamp")
+    else:
+        record = {
+            'date': stamp.strftime('%d-%m-%Y'),
+            'time': stamp.strftime('%I:%M:%S %p'),
+            'name': name,
+            'email': email,
+            'phone': phone,
+            'visit_date': normalize_visit_date(visit_date),
+            'message': message,
+            'created_at': stamp.timestamp(),
+            'kind': 'subscription' if name == 'Newsletter Subscriber' else 'booking',
+        }
+        # Deterministic ID, so importing the same file again adds nothing
+        fingerprint = '\x1f'.join(record[c] for c in OUTBOX_COLUMNS)
+        record['row_id'] = 'legacy-' + hashlib.sha1(fingerprint.encode()).hexdigest()[:24]
+        yield record
+    if rest:
+        yield from normalize_legacy_fields(rest)
+
+def parse_legacy_csv(path):
+    """Every row of a legacy inquiries.csv, normalized to the SHEET_HEADERS schema."""
+    with open(path, 'r', newline='', encoding='utf-8') as file:
+        for fields in csv.reader(file):
+            yield from normalize_legacy_fields(fields)
+
+def import_legacy_csv(path=CSV_FILE):
+    """Copies legacy CSV rows into the outbox (idempotent). Returns the number of new rows."""
+    if not os.path.exists(path):
+        return 0
+    added = outbox.import_rows(parse_legacy_csv(path))
+    if added:
+        logger.info(f"Imported {added} legacy row(s) from {path}")
+    return added
+
+# --- Email index for subscription dedup ---
+EMAIL_INDEX_REFRESH_INTERVAL = float(os.environ.get('EMAIL_INDEX_REFRESH_INTERVAL', 300))
+
+class EmailIndex:
+    """Lower-cased set of every email already stored, so dedup checks are O(1) and offline.
+
+    Seeded from the outbox (which also holds the emails read from every
+    worksheet, see sheet_emails) and updated on every write. Worksheets are
+    read incrementally: only rows past each tab's last read row are fetched,
+    and a past period's tab is read one last time once closed, so a refresh
+    costs one small read per open partition however many tabs there are.
+    """
+
+    def __init__(self):
+        self._emails = set()
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self.last_refresh_at = None
+
+    @staticmethod
+    def normalize(email):
+        return email.strip().lower()
+
+    def __contains__(self, email):
+        return self.normalize(email) in self._emails
+
+    def __len__(self):
+        return len(self._emails)
+
+    def add(self, email):
+        if email:
+            with self._lock:
+                self._emails.add(self.normalize(email))
+
+    def _add_many(self, emails):
+        normalized = {self.normalize(e) for e in emails if e and e.strip()}
+        with self._lock:
+            self._emails.update(normalized)
+
+    def refresh_from_sheets(self, worksheets):
+        """Reads the rows appended to each open partition tab since its last read. Returns rows read."""
+        partitions = outbox.sheet_partitions()
+        added = 0
+        for title, ws in worksheets.items():
+            rows_read, closed = partitions.get(title, (0, False))
+            if closed or not is_partition_title(title):
+                continue
+            start = max(rows_read, 1) + 1  # Row 1 is the header
+            values = ws.get_values(f'D{start}:D')
+            emails = [row[0] for row in values if row and row[0].strip()]
+            outbox.record_sheet_emails(title, emails, start - 1 + len(values), partition_closed(title))
+            self._add_many(emails)
+            added += len(values)
+        self.last_refresh_at = time.time()
+        return added
+
+    def maybe_refresh(self, connection):
+        """Starts a background refresh if the index is older than EMAIL_INDEX_REFRESH_INTERVAL."""
+        if not connection.connected or self._refreshing:
+            return
+        if self.last_refresh_at and time.time() - self.last_refresh_at < EMAIL_INDEX_REFRESH_INTERVAL:
+            return
+        self._refreshing = True
+
+        def run():
+            try:
+                added = self.refresh_from_sheets(connection.worksheets)
+                if added:
+                    logger.info(f"Email index refreshed with {added} new sheet row(s)")
+            except Exception as e:
+                logger.warning(f"Error refreshing email index: {e}")
+                self.last_refresh_at = time.time()
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=run, name='email-index-refresh', daemon=True).start()
+
+email_index = EmailIndex()
+
+# --- Circuit breaker around Google Sheets calls ---
+SHEETS_CALL_DEADLINE = float(os.environ.get('SHEETS_CALL_DEADLINE', 8))
+SHEETS_CALL_RETRIES = int(os.environ.get('SHEETS_CALL_RETRIES', 2))
+SHEETS_BREAKER_THRESHOLD = int(os.environ.get('SHEETS_BREAKER_THRESHOLD', 5))
+SHEETS_BREAKER_COOLDOWN = float(os.environ.get('SHEETS_BREAKER_COOLDOWN', 30))
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Reads and same-range updates are safe to repeat; an append that timed out
+# may already have landed, so appends are only retried on 429 (rejected outright).
+IDEMPOTENT_SHEET_OPERATIONS = {'get_all_values', 'get_values', 'col_values', 'row_values', 'update'}
+GUARDED_SHEET_OPERATIONS = IDEMPOTENT_SHEET_OPERATIONS | {'append_row', 'append_rows'}
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling Google Sheets while the breaker is open."""
+
+class SheetsCallTimeout(Exception):
+    """Raised when a Google Sheets call runs past its deadline."""
+
+def is_retryable(error, idempotent):
+    if isinstance(error, gspread.exceptions.APIError):
+        status = getattr(error.response, 'status_code', None)
+        return status == 429 or (idempotent and status in RETRYABLE_STATUS_CODES)
+    return idempotent and isinstance(error, (SheetsCallTimeout, ConnectionError, requests.exceptions.RequestException))
+
+class CircuitBreaker:
+    """Closed / open / half-open breaker with per-call deadlines and jittered retries.
+
+    After ``threshold`` consecutive failed calls the breaker opens and every
+    call fails immediately with CircuitOpenError. After ``cooldown`` seconds a
+    single probe call is let through (half-open); success closes the breaker,
+    failure opens it again.
+
+    With a shared_state store (the outbox), opening publishes the reopen time
+    so breakers in other worker processes open too instead of each paying for
+    ``threshold`` failures of its own.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+    SHARED_STATE_KEY = 'sheets_circuit_open_until'
+    SHARED_STATE_CHECK_INTERVAL = 1.0
+
+    def __init__(self, threshold=SHEETS_BREAKER_THRESHOLD, cooldown=SHEETS_BREAKER_COOLDOWN,
+                 deadline=SHEETS_CALL_DEADLINE, retries=SHEETS_CALL_RETRIES, shared_state=None):
+        self.shared_state = shared_state
+        self._shared_checked_at = 0.0
+        self.threshold = max(1, threshold)
+        self.cooldown = cooldown
+        self.deadline = deadline
+        self.retries = retries
+        self.state = self.CLOSED
+        self.failures = 0
+        self.trips = 0
+        self.opened_at = None
+        self.last_error = None
+        self.calls_rejected = 0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=4, thread_name_prefix='sheets-call')
+
+    def _sync_shared_state(self):
+        """Adopts an open breaker published by another worker (caller holds the lock)."""
+        if self.shared_state is None or self.state != self.CLOSED:
+            return
+        now = time.time()
+        if now - self._shared_checked_at < self.SHARED_STATE_CHECK_INTERVAL:
+            return
+        self._shared_checked_at = now
+        try:
+            open_until = self.shared_state.get_state(self.SHARED_STATE_KEY, 0.0)
+        except sqlite3.Error:
+            return
+        if open_until > now:
+            self.state = self.OPEN
+            self.opened_at = time.monotonic() - self.cooldown + (open_until - now)
+            self.last_error = "opened by another worker"
+
+    def _publish_shared_state(self, open_until):
+        if self.shared_state is None:
+            return
+        try:
+            self.shared_state.set_state(self.SHARED_STATE_KEY, open_until)
+        except sqlite3.Error as e:
+            logger.warning(f"Error sharing circuit breaker state: {e}")
+
+    def available(self):
+        """True if a call would be attempted right now (doesn't change state)."""
+        with self._lock:
+            self._sync_shared_state()
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN:
+                return time.monotonic() - self.opened_at >= self.cooldown
+            return not self._probe_in_flight
+
+    def _allow(self):
+        with self._lock:
+            self._sync_shared_state()
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.cooldown:
+                self.state = self.HALF_OPEN
+                self._probe_in_flight = False
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            self.calls_rejected += 1
+            return False
+
+    def _record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.info("Google Sheets circuit breaker closed")
+                self._publish_shared_state(0.0)
+            self.state = self.CLOSED
+            self.failures = 0
+            self._probe_in_flight = False
+
+    def _record_failure(self, error):
+        with self._lock:
+            self.failures += 1
+            self.last_error = str(error)
+            self._probe_in_flight = False
+            if self.state == self.HALF_OPEN or self.failures >= self.threshold:
+                if self.state != self.OPEN:
+                    self.trips += 1
+                    logger.warning(f"Google Sheets circuit breaker opened after {self.failures} failure(s): {error}")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                self._publish_shared_state(time.time() + self.cooldown)
+
+    def _run_with_deadline(self, operation, fn, remaining, args, kwargs):
+        try:
+            future = self._executor.submit(fn, *args, **kwargs)
+        except RuntimeError:
+            # Executors refuse new work during interpreter shutdown (e.g. the
+            # final outbox flush); run inline, the client's HTTP timeout still applies
+            return fn(*args, **kwargs)
+        try:
+            return future.result(timeout=remaining)
+        except concurrent.futures.TimeoutError:
+            raise SheetsCallTimeout(f"{operation} exceeded its {self.deadline:g}s deadline") from None
+
+    def call(self, operation, fn, *args, **kwargs):
+        """Runs fn under the breaker, the call deadline and the retry policy."""
+        if not self._allow():
+            metrics.inc('sheets_calls_rejected_total', operation=operation)
+            raise CircuitOpenError(f"Google Sheets circuit is open; skipped {operation}")
+        idempotent = operation in IDEMPOTENT_SHEET_OPERATIONS
+        started = time.monotonic()
+        deadline = started + self.deadline
+        attempt = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    raise SheetsCallTimeout(f"{operation} exceeded its {self.deadline:g}s deadline")
+                result = self._run_with_deadline(operation, fn, remaining, args, kwargs)
+            except Exception as e:
+                backoff = min(4.0, 0.25 * 2 ** attempt) * random.uniform(0.5, 1.5)
+                if attempt < self.retries and is_retryable(e, idempotent) and time.monotonic() + backoff < deadline:
+                    attempt += 1
+                    metrics.inc('sheets_call_retries_total', operation=operation)
+                    time.sleep(backoff)
+                    continue
+                metrics.observe('sheets_call_duration_seconds', time.monotonic() - started, operation=operation)
+                metrics.inc('sheets_call_errors_total', operation=operation, error=type(e).__name__)
+                self._record_failure(e)
+                raise
+            metrics.observe('sheets_call_duration_seconds', time.monotonic() - started, operation=operation)
+            self._record_success()
+            return result
+
+    def retry_in(self):
+        """Seconds until an open breaker lets a probe call through."""
+        if self.state != self.OPEN:
+            return 0.0
+        return max(0.0, self.opened_at + self.cooldown - time.monotonic())
+
+    def stats(self):
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.failures,
+                "trips": self.trips,
+                "calls_rejected": self.calls_rejected,
+                "retry_in_seconds": round(self.retry_in(), 1),
+                "last_error": self.last_error,
+            }
+
+class GuardedWorksheet:
+    """Worksheet proxy that routes every API call through the circuit breaker."""
+
+    def __init__(self, worksheet, breaker):
+        self._worksheet = worksheet
+        self._breaker = breaker
+
+    def __getattr__(self, name):
+        attr = getattr(self._worksheet, name)
+        if name in GUARDED_SHEET_OPERATIONS:
+            return functools.partial(self._breaker.call, name, attr)
+        return attr
+
+sheets_breaker = CircuitBreaker(shared_state=outbox)
+
+# --- Google Sheets connection manager ---
+SHEETS_HTTP_TIMEOUT = float(os.environ.get('SHEETS_HTTP_TIMEOUT', 10))
+SHEETS_RECONNECT_MIN = float(os.environ.get('SHEETS_RECONNECT_MIN', 5))
+SHEETS_RECONNECT_MAX = float(os.environ.get('SHEETS_RECONNECT_MAX', 300))
+
+def load_service_account_info():
+    """Service account JSON from GOOGLE_CREDENTIALS (base64) or SERVICE_ACCOUNT_FILE, or None."""
+    if os.environ.get('GOOGLE_CREDENTIALS'):
+        return json.loads(base64.b64decode(os.environ['GOOGLE_CREDENTIALS']).decode('utf-8'))
+    if os.path.exists(SERVICE_ACCOUNT_FILE):
         with open(SERVICE_ACCOUNT_FILE, 'r') as f:
-            service_account_info = json.load(f)
-            service_account_email = service_account_info.get('client_email', 'Not found')
-        
-        print(f"Service account email: {service_account_email}")
-        print(f"Project ID: {service_account_info.get('project_id', 'Not found')}")
-        
-        # Create credentials
-        creds = Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE, scopes=SCOPE)
-        
-        # Authorize gspread client
-        gc = gspread.authorize(creds)
-        print(f"✓ Google Sheets client authorized successfully")
+            return json.load(f)
+    return None
+
+def log_connection_help(error_str, service_account_email):
+    """Logs troubleshooting steps for common Google Sheets connection errors."""
+    if 'Invalid JWT Signature' in error_str or 'invalid_grant' in error_str:
+        lines = [
+            "JWT Signature Error - Using Local Outbox",
+            f"Service account email: {service_account_email}",
+            "To fix this issue:",
+            "1. Check system time synchronization:",
+            f"   Current system time: {datetime.now()}",
+            "2. In Google Cloud Console:",
+            "   - Go to IAM & Admin > Service Accounts",
+            "   - Find your service account and create a new key",
+            "   - Download the JSON key and replace service-account.json",
+            "3. Share the Google Sheet with the service account email:",
+            f"   {service_account_email}",
+            "   Give it 'Editor' permissions",
+            "4. Check that the spreadsheet ID is correct:",
+            f"   {SPREADSHEET_ID}",
+        ]
+    elif '404' in error_str or 'File not found' in error_str:
+        lines = [
+            "Spreadsheet Not Found (404) - Using Local Outbox",
+            "The Google Sheet cannot be accessed. This usually means:",
+            "1. The spreadsheet ID is incorrect",
+            "2. The service account doesn't have access to the spreadsheet",
+            f"3. Share the spreadsheet with: {service_account_email}",
+            "   Give it 'Editor' permissions",
+            f"4. Spreadsheet ID: {SPREADSHEET_ID}",
+        ]
+    else:
+        lines = [
+            "Google Sheets Error - Using Local Outbox",
+            f"Error details: {error_str}",
+        ]
+    lines.append("Storing inquiries in the local outbox until Google Sheets is reachable")
+    logger.warning("\n".join(lines))
+
+class SheetsConnection:
+    """Connects to Google Sheets in the background and keeps the handles cached.
+
+    The server takes traffic immediately; rows wait in the outbox until the
+    spreadsheet is ready. Failed attempts are retried with exponential backoff,
+    and mark_broken() lets callers request a reconnect at runtime. Every tab's
+    handle is listed once on connect, so routing a row to its partition never
+    costs an API call; only creating a new period's tab does.
+    """
+
+    def __init__(self):
+        self.client = None
+        self.spreadsheet = None
+        self.worksheets = {}  # Tab title -> GuardedWorksheet
+        self.attempts = 0
+        self.connected_at = None
+        self.last_error = None
+        self.service_account_email = None
+        self._wake = threading.Event()
+        self._thread = None
+        self._last_reported_error = None
+        self._lock = threading.Lock()
+        self._create_lock = threading.Lock()
 
-        # Open the spreadsheet
-        print(f"Attempting to open spreadsheet with ID: {SPREADSHEET_ID}")
+    @property
+    def connected(self):
+        return self.spreadsheet is not None
+
+    @property
+    def worksheet(self):
+        """The current period's tab, or None until it exists."""
+        return self.worksheets.get(partition_title())
+
+    def worksheet_for(self, title):
+        """Cached handle for a partition's tab, creating it (with headers) on first use."""
+        ws = self.worksheets.get(title)
+        if ws is not None:
+            return ws
+        with self._create_lock:
+            ws = self.worksheets.get(title)
+            if ws is None:
+                spreadsheet = self.spreadsheet
+                if spreadsheet is None:
+                    raise RuntimeError("Google Sheets is not connected")
+                ws = self._create_worksheet(spreadsheet, title)
+                with self._lock:
+                    if self.spreadsheet is spreadsheet:
+                        self.worksheets = {**self.worksheets, title: ws}
+        return ws
+
+    @staticmethod
+    def _create_worksheet(spreadsheet, title):
+        logger.info(f"Creating new worksheet: '{title}'")
+        try:
+            ws = GuardedWorksheet(
+                spreadsheet.add_worksheet(title=title, rows=SHEET_PARTITION_ROWS, cols=len(SHEET_HEADERS)),
+                sheets_breaker)
+            ws.update('A1:H1', [SHEET_HEADERS])
+        except gspread.exceptions.APIError as e:
+            if e.response.status_code != 400:
+                raise
+            # Added by someone else since the tabs were listed
+            ws = GuardedWorksheet(spreadsheet.worksheet(title), sheets_breaker)
+            initialize_google_sheet(ws)
+        return ws
+
+    def start(self):
+        """Starts the background connect loop (safe to call more than once)."""
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='sheets-connection', daemon=True)
+            self._thread.start()
+
+    def connect(self):
+        """One connection attempt. Raises on failure."""
+        service_account_info = load_service_account_info()
+        if service_account_info is None:
+            raise FileNotFoundError(f"Service account file '{SERVICE_ACCOUNT_FILE}' not found and GOOGLE_CREDENTIALS is not set")
+        self.service_account_email = service_account_info.get('client_email', 'Not found')
+
+        creds = Credentials.from_service_account_info(service_account_info, scopes=SCOPE)
+        client = gspread.authorize(creds)
+        client.set_timeout(SHEETS_HTTP_TIMEOUT)
+        spreadsheet = client.open_by_key(SPREADSHEET_ID)
+        worksheets = {ws.title: GuardedWorksheet(ws, sheets_breaker) for ws in spreadsheet.worksheets()}
+        title = partition_title()
+        if title in worksheets:
+            initialize_google_sheet(worksheets[title])
+        else:
+            worksheets[title] = self._create_worksheet(spreadsheet, title)
+
+        with self._lock:
+            self.client, self.spreadsheet = client, spreadsheet
+            self.worksheets = worksheets
+            self.connected_at = time.time()
+            self.last_error = None
+        self._last_reported_error = None
+        logger.info(f"Google Sheets connected: '{spreadsheet.title}' / '{title}' "
+                    f"({len(worksheets)} tab(s), {self.service_account_email})")
+
+    def _run(self):
+        while True:
+            if not self.connected:
+                self.attempts += 1
+                try:
+                    self.connect()
+                    self._on_connected()
+                except Exception as e:
+                    self.last_error = str(e)
+                    if self.last_error != self._last_reported_error:
+                        # Only print troubleshooting help when the error changes
+                        log_connection_help(self.last_error, self.service_account_email)
+                        self._last_reported_error = self.last_error
+            delay = None
+            if not self.connected:
+                delay = min(SHEETS_RECONNECT_MAX, SHEETS_RECONNECT_MIN * 2 ** min(self.attempts - 1, 16))
+                delay *= random.uniform(0.8, 1.2)
+            self._wake.wait(delay)
+            self._wake.clear()
+
+    def _on_connected(self):
         try:
-            spreadsheet = gc.open_by_key(SPREADSHEET_ID)
-            print(f"✓ Spreadsheet opened: '{spreadsheet.title}'")
+            read = email_index.refresh_from_sheets(self.worksheets)
+            logger.info(f"Email index loaded: {len(email_index)} unique email(s), {read} new sheet row(s) read")
         except Exception as e:
-            print(f"Failed to open spreadsheet: {e}")
-            raise  # Re-raise to be caught by outer exception handler
+            logger.warning(f"Error loading email index from Google Sheet: {e}")
+        outbox_replayer.notify()
+
+    def mark_broken(self, error):
+        """Drops the cached handles and schedules a reconnect."""
+        with self._lock:
+            if self.connected:
+                logger.warning(f"Google Sheets connection lost, reconnecting: {error}")
+            self.spreadsheet = None
+            self.worksheets = {}
+            self.last_error = str(error)
+            self.attempts = 0
+        self._wake.set()
+
+    def stats(self):
+        return {
+            "connected": self.connected,
+            "attempts": self.attempts,
+            "connected_at": datetime.fromtimestamp(self.connected_at).isoformat() if self.connected_at else None,
+            "last_error": self.last_error,
+            "partition": SHEET_PARTITION,
+            "worksheets": sorted(self.worksheets),
+        }
+
+sheets = SheetsConnection()
 
-        # Get the worksheet
+# Import the legacy CSV file, then seed the email index from the outbox
+try:
+    import_legacy_csv()
+    email_index._add_many(outbox.emails())
+except Exception as e:
+    logger.error(f"Error loading emails from local storage: {e}")
+
+# --- Background services ---
+# Threads don't survive fork, so each process starts its own on first use.
+_services_pid = None
+_services_lock = threading.Lock()
+
+def start_background_services():
+    """Starts the log listener, Sheets connection and outbox replayer for this process."""
+    global _services_pid
+    if _services_pid == os.getpid():
+        return
+    with _services_lock:
+        if _services_pid == os.getpid():
+            return
+        start_log_listener()
+        metrics.start()
+        sheets.start()
+        outbox_replayer.start()
+        _services_pid = os.getpid()
+
+@app.before_request
+def ensure_background_services():
+    start_background_services()
+
+# --- Media files: byte ranges, sendfile and proxy offload ---
+# Photos, derivatives and uncompressed assets (images, video) are answered
+# with If-None-Match / If-Modified-Since, single Range requests (206, 416)
+# and If-Range. In the default 'sendfile' mode the body is handed to the WSGI
+# server's file wrapper, so gunicorn copies it to the socket with sendfile()
+# instead of reading it through Python. 'x-accel' (nginx) and 'x-sendfile'
+# (Apache, lighttpd) return only headers and let the front proxy stream the
+# file, so a slow download doesn't hold a worker thread at all.
+MEDIA_SERVE_MODE = os.environ.get('MEDIA_SERVE_MODE', 'sendfile')  # 'sendfile', 'x-accel' or 'x-sendfile'
+MEDIA_ACCEL_PREFIX = os.environ.get('MEDIA_ACCEL_PREFIX', '/_media/')  # nginx 'internal' location aliasing the app root
+MEDIA_CACHE_ENTRIES = int(os.environ.get('MEDIA_CACHE_ENTRIES', 128))
+MEDIA_IDLE_HANDLES = int(os.environ.get('MEDIA_IDLE_HANDLES', 4))  # Open files kept per cached path
+MEDIA_STAT_TTL = float(os.environ.get('MEDIA_STAT_TTL', 2))
+MEDIA_CHUNK_SIZE = 256 * 1024
+
+metrics.counter('media_responses_total', "Media responses by serving mode and status code.")
+metrics.counter('media_file_opens_total', "Files opened for media responses (the rest reuse a cached handle).")
+
+class MediaEntry:
+    """stat() result, validators and idle open files for one media path."""
+
+    def __init__(self, path, st, checked_at):
+        self.path = path
+        self.key = (st.st_ino, st.st_size, st.st_mtime_ns)
+        self.size = st.st_size
+        self.last_modified = datetime.fromtimestamp(int(st.st_mtime), pytz.utc)
+        self.etag = f"{st.st_size:x}-{st.st_mtime_ns:x}"
+        self.mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        self.checked_at = checked_at
+        self.idle = []
+        self.retired = False
+
+class MediaFileCache:
+    """LRU of stat results and open file handles for media paths.
+
+    Paths are re-stat'ed at most every stat_ttl seconds; a changed file gets a
+    new entry and the old entry's files are closed as they come back. Every
+    response checks out a file of its own (sendfile needs a private offset)
+    and returns it to the entry's idle list when the response is closed.
+    """
+
+    def __init__(self, max_entries=MEDIA_CACHE_ENTRIES, stat_ttl=MEDIA_STAT_TTL, idle_handles=MEDIA_IDLE_HANDLES):
+        self.max_entries = max(1, max_entries)
+        self.stat_ttl = stat_ttl
+        self.idle_handles = idle_handles
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+
+    def lookup(self, path, force=False):
+        """The entry for a regular file at path, or None if there isn't one."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and not force and now - entry.checked_at < self.stat_ttl:
+                self._entries.move_to_end(path)
+                return entry
         try:
-            worksheet = spreadsheet.worksheet(SHEET_NAME)
-            print(f"✓ Found existing worksheet: '{SHEET_NAME}'")
-        except gspread.exceptions.WorksheetNotFound:
-            print(f"Creating new worksheet: '{SHEET_NAME}'")
-            worksheet = spreadsheet.add_worksheet(title=SHEET_NAME, rows="100", cols="20")
-        
-        # Initialize headers
-        initialize_google_sheet(worksheet)
-        print(f"✓ Google Sheets integration ready!")
-        use_csv_fallback = False
-        
-    except (gspread.exceptions.APIError, gspread.exceptions.GSpreadException) as api_error:
-        print(f"Google Sheets API Error: {api_error}")
-        error_str = str(api_error)
-        if 'Invalid JWT Signature' in error_str or 'invalid_grant' in error_str:
-            print("\n=== JWT Signature Error - Using CSV Fallback ===")
-            print(f"Service account email: {service_account_email}")
-            print("\nTo fix this issue:")
-            print("1. Check system time synchronization:")
-            print(f"   Current system time: {datetime.now()}")
-            print("2. In Google Cloud Console:")
-            print("   - Go to IAM & Admin > Service Accounts")
-            print("   - Find your service account and create a new key")
-            print("   - Download the JSON key and replace service-account.json")
-            print("3. Share the Google Sheet with the service account email:")
-            print(f"   {service_account_email}")
-            print("   Give it 'Editor' permissions")
-            print("4. Check that the spreadsheet ID is correct:")
-            print(f"   {SPREADSHEET_ID}")
-            print("\n=== Using CSV file for storing inquiries ===")
-        elif '404' in error_str or 'File not found' in error_str:
-            print("\n=== Spreadsheet Not Found (404) - Using CSV Fallback ===")
-            print("The Google Sheet cannot be accessed. This usually means:")
-            print("1. The spreadsheet ID is incorrect")
-            print("2. The service account doesn't have access to the spreadsheet")
-            print(f"3. Share the spreadsheet with: {service_account_email}")
-            print("   Give it 'Editor' permissions")
-            print(f"4. Spreadsheet ID: {SPREADSHEET_ID}")
-            print("\n=== Using CSV file for storing inquiries ===")
+            st = os.stat(path)
+        except (FileNotFoundError, NotADirectoryError):
+            st = None
+        with self._lock:
+            entry = self._entries.get(path)
+            if st is None or not stat.S_ISREG(st.st_mode):
+                if entry is not None:
+                    self._retire(self._entries.pop(path))
+                return None
+            if entry is not None and entry.key == (st.st_ino, st.st_size, st.st_mtime_ns):
+                entry.checked_at = now
+                self._entries.move_to_end(path)
+                return entry
+            if entry is not None:
+                self._retire(entry)
+            entry = self._entries[path] = MediaEntry(path, st, now)
+            while len(self._entries) > self.max_entries:
+                self._retire(self._entries.popitem(last=False)[1])
+            return entry
+
+    def checkout(self, entry):
+        """An open file of the entry's content, or None if the file changed since it was stat'ed."""
+        with self._lock:
+            if entry.idle:
+                return entry.idle.pop()
+        f = open(entry.path, 'rb')
+        metrics.inc('media_file_opens_total')
+        st = os.fstat(f.fileno())
+        if (st.st_ino, st.st_size, st.st_mtime_ns) != entry.key:
+            f.close()
+            return None
+        return f
+
+    def checkin(self, entry, f):
+        with self._lock:
+            if not entry.retired and len(entry.idle) < self.idle_handles:
+                entry.idle.append(f)
+                return
+        f.close()
+
+    @staticmethod
+    def _retire(entry):
+        entry.retired = True
+        for f in entry.idle:
+            f.close()
+        entry.idle = []
+
+    def __len__(self):
+        return len(self._entries)
+
+media_files = MediaFileCache()
+
+class MediaBody:
+    """File-like view of [start, end) of a checked-out file, for wsgi.file_wrapper.
+
+    Exposes fileno() so gunicorn can sendfile() it; read() stops at end for
+    servers that iterate instead. close() returns the file to the cache.
+    """
+
+    mode = 'rb'
+
+    def __init__(self, entry, f, start, end):
+        self._entry = entry
+        self._file = f
+        self._end = end
+        self._closed = False
+        f.seek(start)
+
+    def fileno(self):
+        return self._file.fileno()
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        return self._file.seek(offset, whence)
+
+    def tell(self):
+        return self._file.tell()
+
+    def read(self, size=-1):
+        remaining = self._end - self._file.tell()
+        if remaining <= 0:
+            return b''
+        return self._file.read(remaining if size is None or size < 0 else min(size, remaining))
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            media_files.checkin(self._entry, self._file)
+
+def media_range(entry, etag):
+    """(start, end) of a satisfiable single byte range, 'unsatisfiable', or None to send the whole file."""
+    byte_range = request.range
+    if byte_range is None or byte_range.units != 'bytes' or len(byte_range.ranges) != 1:
+        return None
+    if_range = request.if_range
+    if if_range.etag is not None and if_range.etag != etag:
+        return None
+    if if_range.date is not None and if_range.date != entry.last_modified:
+        return None
+    bounds = byte_range.range_for_length(entry.size)
+    return bounds if bounds is not None else 'unsatisfiable'
+
+def serve_media(path, cache_control='no-cache', etag=None):
+    """Serves the file at path (relative to the app root) per MEDIA_SERVE_MODE; 404 if it isn't a file."""
+    entry = media_files.lookup(path)
+    if entry is None:
+        abort(404)
+    etag = etag or entry.etag
+    if request.if_none_match:
+        not_modified = request.if_none_match.contains(etag)
+    else:
+        not_modified = request.if_modified_since is not None and entry.last_modified <= request.if_modified_since
+
+    if not_modified:
+        response = make_response('', 304)
+    elif MEDIA_SERVE_MODE in ('x-accel', 'x-sendfile'):
+        # The proxy answers Range itself from the file it's pointed at
+        response = make_response('')
+        if MEDIA_SERVE_MODE == 'x-accel':
+            response.headers['X-Accel-Redirect'] = MEDIA_ACCEL_PREFIX + urllib.parse.quote(os.path.relpath(path).replace(os.sep, '/'))
         else:
-            print(f"\n=== Google Sheets Error - Using CSV Fallback ===")
-            print(f"Error details: {error_str}")
-            print("\n=== Using CSV file for storing inquiries ===")
-        use_csv_fallback = True
-        worksheet = None
-    except Exception as e:
-        print(f"!!! ERROR: Could not connect to Google Sheets. Error: {e}")
-        print("=== Using CSV file for storing inquiries ===")
-        use_csv_fallback = True
-        worksheet = None
-else:
-    print(f"!!! ERROR: Service account file '{SERVICE_ACCOUNT_FILE}' not found.")
-    print("=== Using CSV file for storing inquiries ===")
-    use_csv_fallback = True
+            response.headers['X-Sendfile'] = os.path.abspath(path)
+    else:
+        bounds = media_range(entry, etag)
+        if bounds == 'unsatisfiable':
+            response = make_response('', 416)
+            response.headers['Content-Range'] = f"bytes */{entry.size}"
+        else:
+            start, end = bounds or (0, entry.size)
+            body = None
+            if request.method != 'HEAD':
+                f = media_files.checkout(entry)
+                if f is None:
+                    # Replaced between stat() and open(); serve the new file from scratch
+                    media_files.lookup(path, force=True)
+                    return serve_media(path, cache_control, etag if etag != entry.etag else None)
+                body = wrap_file(request.environ, MediaBody(entry, f, start, end), MEDIA_CHUNK_SIZE)
+            response = Response(body, status=206 if bounds else 200, direct_passthrough=True)
+            response.content_length = end - start
+            if bounds:
+                response.headers['Content-Range'] = f"bytes {start}-{end - 1}/{entry.size}"
+
+    response.mimetype = entry.mimetype
+    response.set_etag(etag)
+    response.last_modified = entry.last_modified
+    response.headers['Cache-Control'] = cache_control
+    response.headers['Accept-Ranges'] = 'bytes'
+    metrics.inc('media_responses_total', mode=MEDIA_SERVE_MODE, status=response.status_code)
+    return response
+
+# --- Fingerprinted, precompressed static assets ---
+def file_sha256(path, chunk_size=1024 * 1024):
+    """Hex SHA-256 of a file's contents, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+ASSET_DIRS = ('css', 'js', 'assets')
+ASSET_CACHE_DIR = os.environ.get('ASSET_CACHE_DIR', os.path.join('.cache', 'assets'))
+COMPRESSIBLE_EXTENSIONS = {'.css', '.js', '.json', '.svg', '.html', '.txt', '.xml', '.ico'}
+ASSET_HASH_LENGTH = 12
+HASHED_NAME_PATTERN = re.compile(r'^(?P<stem>.+)\.(?P<hash>[0-9a-f]{%d})(?P<ext>\.[^./]+)$' % ASSET_HASH_LENGTH)
+ASSET_REFERENCE_PATTERN = re.compile(r'''(?P<prefix>\b(?:href|src)=["'])(?P<slash>/?)(?P<path>(?:css|js|assets)/[^"'?#]+)''')
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+class StaticAssets:
+    """Content-hashed names and gzip/brotli variants for files under css/, js/ and assets/.
+
+    Hashes are computed on first use and refreshed whenever a file's mtime
+    changes. Compressed variants are written once per content hash to
+    ASSET_CACHE_DIR, so they are shared between restarts and workers.
+    """
+
+    def __init__(self, cache_dir=ASSET_CACHE_DIR):
+        self.cache_dir = cache_dir
+        self._lock = threading.Lock()
+        self._assets = {}
+
+    def get(self, rel_path):
+        """Returns the asset record for 'css/style.css', or None if it isn't an existing regular file."""
+        try:
+            st = os.stat(rel_path)
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+        if not stat.S_ISREG(st.st_mode):
+            return None
+        cached = self._assets.get(rel_path)
+        if cached and cached['mtime'] == st.st_mtime_ns:
+            return cached
+        asset = {
+            'path': rel_path,
+            'mtime': st.st_mtime_ns,
+            'size': st.st_size,
+            'hash': file_sha256(rel_path)[:ASSET_HASH_LENGTH],
+            'mimetype': mimetypes.guess_type(rel_path)[0] or 'application/octet-stream',
+            'variants': None,
+        }
+        with self._lock:
+            self._assets[rel_path] = asset
+        return asset
+
+    def hashed_url(self, rel_path):
+        """'css/style.css' -> 'css/style.<hash>.css' (unchanged if the file doesn't exist)."""
+        asset = self.get(rel_path)
+        if asset is None:
+            return rel_path
+        stem, ext = os.path.splitext(rel_path)
+        return f"{stem}.{asset['hash']}{ext}"
+
+    def resolve(self, directory, filename):
+        """Maps a requested (possibly hashed) filename to (asset, is_hashed_url).
+
+        Names that would escape directory (e.g. an encoded '..') resolve to nothing.
+        """
+        path = safe_join(directory, filename)
+        if path is None:
+            return None, False
+        asset = self.get(path)
+        if asset is not None:
+            return asset, False
+        match = HASHED_NAME_PATTERN.match(filename)
+        if match:
+            path = safe_join(directory, match.group('stem') + match.group('ext'))
+            asset = self.get(path) if path is not None else None
+            if asset is not None:
+                return asset, asset['hash'] == match.group('hash')
+        return None, False
+
+    def variants(self, asset):
+        """{encoding: file path} for the asset, compressing it on first use."""
+        if asset['variants'] is not None:
+            return asset['variants']
+        variants = {'identity': asset['path']}
+        if os.path.splitext(asset['path'])[1].lower() in COMPRESSIBLE_EXTENSIONS:
+            with open(asset['path'], 'rb') as f:
+                data = f.read()
+            encoders = {'gzip': lambda d: gzip.compress(d, compresslevel=9, mtime=0)}
+            if brotli is not None:
+                encoders['br'] = lambda d: brotli.compress(d, quality=11)
+            os.makedirs(self.cache_dir, exist_ok=True)
+            base = asset['path'].replace(os.sep, '_')
+            for encoding, compress in encoders.items():
+                suffix = '.gz' if encoding == 'gzip' else '.br'
+                target = os.path.join(self.cache_dir, f"{base}.{asset['hash']}{suffix}")
+                if not os.path.exists(target):
+                    compressed = compress(data)
+                    if len(compressed) >= len(data):
+                        continue
+                    tmp_path = f'{target}.{os.getpid()}.tmp'
+                    with open(tmp_path, 'wb') as f:
+                        f.write(compressed)
+                    os.replace(tmp_path, target)
+                variants[encoding] = target
+        asset['variants'] = variants
+        return variants
+
+    def rewrite_references(self, html):
+        """Points css/, js/ and assets/ references in an HTML document at hashed URLs."""
+        def replace(match):
+            return match.group('prefix') + match.group('slash') + self.hashed_url(match.group('path'))
+        return ASSET_REFERENCE_PATTERN.sub(replace, html)
+
+static_assets = StaticAssets()
+
+def negotiate_encoding(variants):
+    """Picks the best encoding the client accepts among the available variants."""
+    for encoding in ('br', 'gzip'):
+        if encoding in variants and request.accept_encodings[encoding]:
+            return encoding
+    return 'identity'
+
+def serve_static_asset(directory, filename):
+    """Serves a file from css/, js/ or assets/ with compression and caching.
+
+    Hashed URLs are cached for a year as immutable; plain URLs must revalidate.
+    Both answer If-None-Match with 304.
+    """
+    if safe_join(directory, filename) is None:
+        abort(404)
+    asset, is_hashed_url = static_assets.resolve(directory, filename)
+    if asset is None:
+        return send_from_directory(directory, filename)
+    variants = static_assets.variants(asset)
+    if len(variants) == 1:
+        # Images and video: nothing to negotiate, but clients may ask for ranges
+        return serve_media(asset['path'], IMMUTABLE_CACHE_CONTROL if is_hashed_url else 'no-cache', asset['hash'])
+    encoding = negotiate_encoding(variants)
+    etag = asset['hash'] if encoding == 'identity' else f"{asset['hash']}-{encoding}"
+
+    if request.if_none_match.contains(etag):
+        response = make_response('', 304)
+    else:
+        response = send_file(variants[encoding], mimetype=asset['mimetype'], etag=False, conditional=False)
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL if is_hashed_url else 'no-cache'
+    response.vary.add('Accept-Encoding')
+    return response
+
+# --- Inlined first render of index.html ---
+# In 'inline' mode (the default) the page is rebuilt with the CSS needed for the
+# header and hero inlined, every stylesheet loaded without blocking render,
+# classic scripts deferred and the first page of the gallery manifest embedded
+# as JSON, so the gallery renders without a separate API round trip.
+INDEX_RENDER_MODE = os.environ.get('INDEX_RENDER_MODE', 'inline')
+GALLERY_EMBED_COUNT = int(os.environ.get('GALLERY_EMBED_COUNT', 12))
+INDEX_CHECK_INTERVAL = float(os.environ.get('INDEX_CHECK_INTERVAL', 2))  # Seconds between source change checks
+
+CSS_COMMENT_PATTERN = re.compile(r'/\*.*?\*/', re.S)
+CSS_URL_PATTERN = re.compile(r'''url\(\s*(['"]?)(?!data:|https?:|/)([^'")]+)\1\s*\)''')
+SELECTOR_NOISE_PATTERN = re.compile(r'::?[\w-]+(?:\((?:[^()]|\([^()]*\))*\))?|\[[^\]]*\]')
+SELECTOR_TOKEN_PATTERN = re.compile(r'([.#]?)(-?[A-Za-z_][\w-]*)')
+STYLESHEET_LINK_PATTERN = re.compile(r'''<link\b[^>]*\brel=["']stylesheet["'][^>]*>''')
+LOCAL_STYLESHEET_PATTERN = re.compile(r'''\bhref=["'](?P<path>css/[^"'?#]+)["']''')
+BLOCKING_SCRIPT_PATTERN = re.compile(r'''<script\b(?![^>]*\b(?:defer|async|type=["']module["']))(?P<attrs>[^>]*\bsrc=[^>]*)>''')
+
+def split_css_rules(css):
+    """Top-level (prelude, block) pairs of a stylesheet; block is None for statements like @import."""
+    rules, depth, start, prelude = [], 0, 0, None
+    for i, ch in enumerate(css):
+        if ch == '{':
+            if depth == 0:
+                prelude, start = css[start:i].strip(), i + 1
+            depth += 1
+        elif ch == '}' and depth:
+            depth -= 1
+            if depth == 0:
+                rules.append((prelude, css[start:i]))
+                start = i + 1
+        elif ch == ';' and depth == 0:
+            if css[start:i].strip():
+                rules.append((css[start:i].strip(), None))
+            start = i + 1
+    return rules
+
+def selector_is_critical(selector_list, present):
+    """True if any selector only names tags, classes and ids that occur above the fold."""
+    for selector in selector_list.split(','):
+        tokens = SELECTOR_TOKEN_PATTERN.findall(SELECTOR_NOISE_PATTERN.sub('', selector))
+        if all((prefix + name if prefix else name.lower()) in present for prefix, name in tokens):
+            return True
+    return False
+
+def critical_css(css, present):
+    """The rules of css (recursing into @media/@supports) that can apply above the fold."""
+    kept = []
+    for prelude, block in split_css_rules(css):
+        if block is None:
+            if prelude.startswith('@import'):
+                kept.append(prelude + ';')
+        elif prelude.startswith(('@media', '@supports')):
+            inner = critical_css(block, present)
+            if inner:
+                kept.append(f'{prelude}{{{inner}}}')
+        elif prelude.startswith('@font-face') or (not prelude.startswith('@') and selector_is_critical(prelude, present)):
+            kept.append(f"{prelude}{{{' '.join(block.split())}}}")
+        # @keyframes and other at-rules arrive with the full stylesheet
+    return ''.join(kept)
+
+def above_the_fold_tokens(html):
+    """Tags, .classes and #ids used from <body> through the end of the first <section> (the hero)."""
+    body = html.find('<body')
+    end = html.find('</section>', body)
+    fragment = html[body:end if end != -1 else len(html)]
+    present = {'html', 'body'}
+    present.update(tag.lower() for tag in re.findall(r'<([a-zA-Z][\w-]*)', fragment))
+    for classes in re.findall(r'''\bclass=["']([^"']+)''', fragment):
+        present.update('.' + c for c in classes.split())
+    present.update('#' + i for i in re.findall(r'''\bid=["']([^"']+)''', fragment))
+    return present
+
+def inline_stylesheet_urls(css, css_path):
+    """Makes url() references in a stylesheet absolute, since the rules now live in /index.html."""
+    base = os.path.dirname(css_path)
+
+    def replace(match):
+        target = posixpath.normpath(posixpath.join(base, match.group(2)))
+        if target.startswith(ASSET_DIRS):
+            target = static_assets.hashed_url(target)
+        return f'url("/{target}")'
+    return CSS_URL_PATTERN.sub(replace, css)
+
+def defer_stylesheet(link):
+    """A stylesheet <link> that loads without blocking render, with a <noscript> fallback."""
+    preload = re.sub(r'''\brel=["']stylesheet["']''', 'rel="preload" as="style"', link)
+    preload = preload[:-1].rstrip('/ ') + ''' onload="this.onload=null;this.rel='stylesheet'">'''
+    return f'{preload}<noscript>{link}</noscript>'
+
+def gallery_manifest_script():
+    """The first page of /api/gallery-images as an inline JSON data block."""
+    images, _ = gallery_manifest.get()
+    page = images[:GALLERY_EMBED_COUNT]
+    data = {
+        'success': True,
+        'images': page,
+        'count': len(page),
+        'total': len(images),
+        'offset': 0,
+        'limit': GALLERY_EMBED_COUNT,
+        'next_offset': len(page) if len(page) < len(images) else None,
+    }
+    payload = json.dumps(data, separators=(',', ':')).replace('<', '\\u003c')
+    return f'<script type="application/json" id="gallery-manifest">{payload}</script>'
+
+def render_inline_index(html):
+    """Applies the inline render mode to the index.html source."""
+    present = above_the_fold_tokens(html)
+    critical = []
+    for link in STYLESHEET_LINK_PATTERN.findall(html):
+        match = LOCAL_STYLESHEET_PATTERN.search(link)
+        if match and os.path.isfile(match.group('path')):
+            with open(match.group('path'), 'r', encoding='utf-8') as f:
+                css = CSS_COMMENT_PATTERN.sub('', f.read())
+            critical.append(critical_css(inline_stylesheet_urls(css, match.group('path')), present))
+    first_link = STYLESHEET_LINK_PATTERN.search(html)
+    if first_link:
+        style = f'<style id="critical-css">{"".join(critical)}</style>\n    '
+        html = html[:first_link.start()] + style + html[first_link.start():]
+    html = STYLESHEET_LINK_PATTERN.sub(lambda m: defer_stylesheet(m.group(0)), html)
+    html = BLOCKING_SCRIPT_PATTERN.sub(lambda m: f"<script{m.group('attrs').rstrip()} defer>", html)
+    return html.replace('</body>', f'    {gallery_manifest_script()}\n</body>', 1)
+
+class IndexPage:
+    """index.html with asset references rewritten to hashed URLs (and inlined, see INDEX_RENDER_MODE).
+
+    Built once and kept in memory; rebuilt when index.html, any asset it
+    references or (in inline mode) the gallery manifest changes. Those are
+    checked at most once per check_interval, so most requests return the
+    cached build without taking the lock or touching the disk.
+    """
+
+    def __init__(self, path='index.html', mode=INDEX_RENDER_MODE, check_interval=INDEX_CHECK_INTERVAL):
+        self.path = path
+        self.mode = mode
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._key = None
+        self._references = []
+        self._build = None  # (body, gzipped body, etag)
+        self._checked_until = 0.0
+
+    def _current_key(self):
+        manifest_etag = gallery_manifest.get()[1] if self.mode == 'inline' else None
+        return (os.stat(self.path).st_mtime_ns, manifest_etag,
+                tuple(static_assets.hashed_url(p) for p in self._references))
+
+    def get(self):
+        """Returns (body, gzipped body, etag)."""
+        build = self._build
+        if build is not None and time.monotonic() < self._checked_until:
+            return build
+        with self._lock:
+            if self._build is None or time.monotonic() >= self._checked_until:
+                if self._key is None or self._current_key() != self._key:
+                    with open(self.path, 'r', encoding='utf-8') as f:
+                        html = f.read()
+                    self._references = [m.group('path') for m in ASSET_REFERENCE_PATTERN.finditer(html)]
+                    if self.mode == 'inline':
+                        html = render_inline_index(html)
+                    body = static_assets.rewrite_references(html).encode('utf-8')
+                    self._build = (body, gzip.compress(body, compresslevel=9, mtime=0),
+                                   hashlib.sha256(body).hexdigest()[:32])
+                    self._key = self._current_key()
+                self._checked_until = time.monotonic() + self.check_interval
+            return self._build
+
+index_page = IndexPage()
 
 @app.route('/')
 def index():
-    """Serves the index.html file."""
-    return send_from_directory(app.static_folder, 'index.html')
+    """Serves the in-memory index.html build (hashed asset URLs; inlined in 'inline' mode)."""
+    body, gzipped, etag = index_page.get()
+    if request.if_none_match.contains(etag):
+        response = make_response('', 304)
+    elif request.accept_encodings['gzip']:
+        response = make_response(gzipped)
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = make_response(body)
+    response.mimetype = 'text/html'
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.vary.add('Accept-Encoding')
+    return response
 
 @app.route('/test', methods=['GET', 'POST'])
 def test_endpoint():
     """Test endpoint to verify server is running."""
-    global worksheet, use_csv_fallback
+    worksheet = sheets.worksheet
     
     if request.method == 'POST':
         return jsonify({
@@ -213,77 +2253,1082 @@ def test_endpoint():
         return jsonify({
             "success": True, 
             "message": "Server is running",
-            "google_sheets_connected": worksheet is not None,
-            "csv_fallback_active": use_csv_fallback,
+            "google_sheets_connected": sheets.connected,
             "worksheet_title": worksheet.title if worksheet else None,
-            "service_account_file_exists": os.path.exists(SERVICE_ACCOUNT_FILE)
+            "service_account_file_exists": os.path.exists(SERVICE_ACCOUNT_FILE),
+            "sheets_connection": sheets.stats(),
+            "sheets_circuit_breaker": sheets_breaker.stats(),
+            "outbox": outbox_replayer.stats()
         }), 200
 
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus scrape endpoint; counters are summed across workers when METRICS_DIR is set."""
+    counts = outbox.counts()
+    breaker = sheets_breaker.stats()
+    gauges = [
+        ('outbox_rows', "Rows in the local outbox by sync status.",
+         [({'status': status}, counts.get(status, 0)) for status in ('pending', 'sending', 'synced')]),
+        ('sheets_connected', "Whether this worker holds a Google Sheets connection.",
+         [({}, 1 if sheets.connected else 0)]),
+        ('sheets_circuit_open', "Whether this worker's Google Sheets circuit breaker is open.",
+         [({}, 1 if breaker['state'] == CircuitBreaker.OPEN else 0)]),
+        ('outbox_replayer_leader', "Whether this worker is the one replaying the outbox to Google Sheets.",
+         [({}, 1 if outbox_replayer.is_leader else 0)]),
+    ]
+    response = make_response(metrics.render(gauges))
+    response.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
 @app.route('/assets/<path:filename>')
 def serve_assets(filename):
     """Serves files from the assets directory."""
-    return send_from_directory('assets', filename)
+    return serve_static_asset('assets', filename)
 
 @app.route('/css/<path:filename>')
 def serve_css(filename):
     """Serves CSS files."""
-    return send_from_directory('css', filename)
+    return serve_static_asset('css', filename)
 
 @app.route('/js/<path:filename>')
 def serve_js(filename):
     """Serves JavaScript files."""
-    return send_from_directory('js', filename)
+    return serve_static_asset('js', filename)
 
 @app.route('/pg-photos/<path:filename>')
 def serve_photos(filename):
     """Serves photo files."""
-    return send_from_directory('pg-photos', filename)
+    path = safe_join('pg-photos', filename)
+    if path is None:
+        abort(404)
+    return serve_media(path)
+
+# --- Service worker precache manifest ---
+# The service worker precaches what this lists instead of a hand-maintained
+# file list: the page, every file under css/, js/ and assets/ (at its hashed
+# URL) and a few root files, each with a content revision and size. Its install
+# step only downloads entries whose revision changed since the last install.
+PRECACHE_ROOT_FILES = ('manifest.json', 'offline.html')
+PRECACHE_MAX_FILE_BYTES = int(os.environ.get('PRECACHE_MAX_FILE_BYTES', 1024 * 1024))
+SW_GALLERY_CACHE_MAX_ENTRIES = int(os.environ.get('SW_GALLERY_CACHE_MAX_ENTRIES', 60))
+SW_GALLERY_CACHE_MAX_BYTES = int(os.environ.get('SW_GALLERY_CACHE_MAX_BYTES', 25 * 1024 * 1024))
+SERVICE_WORKER_FILE = 'service-worker.js'
+PRECACHE_VERSION_PLACEHOLDER = '__PRECACHE_VERSION__'
+
+def precache_files():
+    """Relative paths of the files to precache that exist on disk (symlinks followed)."""
+    paths = [p for p in PRECACHE_ROOT_FILES if os.path.isfile(p)]
+    for directory in ASSET_DIRS:
+        for root, dirs, files in os.walk(directory):
+            dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+            paths.extend(os.path.join(root, f) for f in sorted(files)
+                         if not f.startswith('.') and os.path.isfile(os.path.join(root, f)))
+    return paths
+
+def build_precache_manifest():
+    """The precache manifest dict; 'version' changes whenever any entry does."""
+    _, gzipped, etag = index_page.get()
+    entries = [{'url': '/', 'revision': etag, 'size': len(gzipped)}]
+    for path in precache_files():
+        asset = static_assets.get(path)
+        if asset is None or asset['size'] > PRECACHE_MAX_FILE_BYTES:
+            continue
+        url = path if path in PRECACHE_ROOT_FILES else static_assets.hashed_url(path)
+        entries.append({'url': '/' + url.replace(os.sep, '/'), 'revision': asset['hash'], 'size': asset['size']})
+    version = hashlib.sha256(json.dumps(entries, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+    return {
+        'version': version,
+        'entries': entries,
+        'runtime': {
+            'gallery': {
+                'prefixes': [f'/{PHOTO_DIR}/', '/media/derived/'],
+                'maxEntries': SW_GALLERY_CACHE_MAX_ENTRIES,
+                'maxBytes': SW_GALLERY_CACHE_MAX_BYTES,
+            },
+        },
+    }
+
+@app.route('/precache-manifest.json')
+def precache_manifest():
+    """Files for the service worker to precache, with content revisions and sizes."""
+    manifest = build_precache_manifest()
+    if request.if_none_match.contains(manifest['version']):
+        response = make_response('', 304)
+    else:
+        response = jsonify(manifest)
+    response.set_etag(manifest['version'])
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/service-worker.js')
+def service_worker():
+    """service-worker.js stamped with the precache version, so browsers reinstall it when an asset changes."""
+    with open(SERVICE_WORKER_FILE, 'r', encoding='utf-8') as f:
+        script = f.read().replace(PRECACHE_VERSION_PLACEHOLDER, build_precache_manifest()['version'])
+    response = make_response(script)
+    response.mimetype = 'application/javascript'
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+# --- Gallery manifest cache ---
+PHOTO_DIR = 'pg-photos'
+GALLERY_IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp'}
+GALLERY_CACHE_MAX_AGE = int(os.environ.get('GALLERY_CACHE_MAX_AGE', 300))
+
+def _jpeg_orientation(segment):
+    """Returns the EXIF orientation (1-8) from a JPEG APP1 segment, or 1."""
+    if not segment.startswith(b'Exif\x00\x00'):
+        return 1
+    tiff = segment[6:]
+    endian = {b'II': '<', b'MM': '>'}.get(tiff[:2])
+    if endian is None or len(tiff) < 8:
+        return 1
+    ifd_offset = struct.unpack(endian + 'I', tiff[4:8])[0]
+    if ifd_offset + 2 > len(tiff):
+        return 1
+    (entries,) = struct.unpack(endian + 'H', tiff[ifd_offset:ifd_offset + 2])
+    for i in range(entries):
+        entry = tiff[ifd_offset + 2 + i * 12:ifd_offset + 14 + i * 12]
+        if len(entry) < 12:
+            break
+        tag, _, _ = struct.unpack(endian + 'HHI', entry[:8])
+        if tag == 0x0112:
+            return struct.unpack(endian + 'H', entry[8:10])[0]
+    return 1
+
+def read_image_size(path):
+    """Reads (width, height) from an image header without decoding it.
+
+    JPEG sizes honour the EXIF orientation, so they match what browsers
+    display. Returns (None, None) for formats it doesn't recognise.
+    """
+    with open(path, 'rb') as f:
+        head = f.read(32)
+        if head.startswith(b'\x89PNG\r\n\x1a\n'):
+            return struct.unpack('>II', head[16:24])
+        if head[:6] in (b'GIF87a', b'GIF89a'):
+            return struct.unpack('<HH', head[6:10])
+        if head.startswith(b'BM'):
+            width, height = struct.unpack('<ii', head[18:26])
+            return width, abs(height)
+        if head.startswith(b'RIFF') and head[8:12] == b'WEBP':
+            chunk = head[12:16]
+            f.seek(20)
+            data = f.read(10)
+            if chunk == b'VP8 ':
+                width, height = struct.unpack('<HH', data[6:10])
+                return width & 0x3fff, height & 0x3fff
+            if chunk == b'VP8L':
+                bits = int.from_bytes(data[1:5], 'little')
+                return (bits & 0x3fff) + 1, ((bits >> 14) & 0x3fff) + 1
+            if chunk == b'VP8X':
+                return int.from_bytes(data[4:7], 'little') + 1, int.from_bytes(data[7:10], 'little') + 1
+            return None, None
+        if not head.startswith(b'\xff\xd8'):
+            return None, None
+        # JPEG: walk the segments until a start-of-frame marker
+        f.seek(2)
+        orientation = 1
+        while True:
+            marker = f.read(2)
+            if len(marker) < 2 or marker[0] != 0xff:
+                return None, None
+            while marker[1] == 0xff:
+                marker = marker[1:] + f.read(1)
+            code = marker[1]
+            if code in (0xd8, 0x01) or 0xd0 <= code <= 0xd7:
+                continue
+            (length,) = struct.unpack('>H', f.read(2))
+            if code in (0xc0, 0xc1, 0xc2, 0xc3, 0xc5, 0xc6, 0xc7, 0xc9, 0xca, 0xcb, 0xcd, 0xce, 0xcf):
+                height, width = struct.unpack('>xHH', f.read(5))
+                return (height, width) if orientation >= 5 else (width, height)
+            segment = f.read(length - 2)
+            if code == 0xe1:
+                orientation = _jpeg_orientation(segment)
+
+class GalleryManifest:
+    """Cached listing of the photo directory, rebuilt only when the directory changes.
+
+    The directory mtime changes whenever a photo is added, removed or renamed.
+    Per-file entries (dimensions, content hash) are also reused across rebuilds
+    as long as the file's size and mtime are unchanged.
+    """
+
+    def __init__(self, directory=PHOTO_DIR):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._dir_mtime = None
+        self._entries = {}
+        self.images = []
+        self.etag = None
+
+    def _entry(self, filename):
+        path = os.path.join(self.directory, filename)
+        st = os.stat(path)
+        cached = self._entries.get(filename)
+        if cached and cached[0] == (st.st_size, st.st_mtime_ns):
+            return cached[1]
+        try:
+            width, height = read_image_size(path)
+        except (OSError, struct.error):
+            width, height = None, None
+        entry = {
+            'filename': filename,
+            'url': f'/{self.directory}/{filename}',
+            'alt': f'Yasodha Residency - {filename.replace("-", " ").replace("_", " ").split(".")[0]}',
+            'type': mimetypes.guess_type(filename)[0],
+            'bytes': st.st_size,
+            'width': width,
+            'height': height,
+            'hash': file_sha256(path),
+        }
+        entry['srcset'] = derivative_store.srcset(entry)
+        self._entries[filename] = ((st.st_size, st.st_mtime_ns), entry)
+        return entry
+
+    def get(self):
+        """Returns (images, etag), rescanning the directory only if its mtime changed."""
+        try:
+            dir_mtime = os.stat(self.directory).st_mtime_ns
+        except FileNotFoundError:
+            dir_mtime = None
+        with self._lock:
+            if self.etag is not None and dir_mtime == self._dir_mtime:
+                return self.images, self.etag
+            images = []
+            if dir_mtime is not None:
+                for filename in sorted(os.listdir(self.directory)):
+                    if os.path.splitext(filename.lower())[1] in GALLERY_IMAGE_EXTENSIONS:
+                        images.append(self._entry(filename))
+            names = {image['filename'] for image in images}
+            self._entries = {k: v for k, v in self._entries.items() if k in names}
+            self.images = images
+            self.etag = hashlib.sha256(json.dumps(images, sort_keys=True).encode('utf-8')).hexdigest()[:32]
+            self._dir_mtime = dir_mtime
+            return self.images, self.etag
+
+gallery_manifest = GalleryManifest()
+
+# --- Responsive image derivatives ---
+DERIVATIVE_DIR = os.environ.get('DERIVATIVE_DIR', os.path.join('.cache', 'derivatives'))
+DERIVATIVE_WIDTHS = sorted(int(w) for w in os.environ.get('DERIVATIVE_WIDTHS', '320,640,1280').split(','))
+DERIVATIVE_WORKERS = int(os.environ.get('DERIVATIVE_WORKERS', 2))
+DERIVATIVE_PREBUILD = os.environ.get('DERIVATIVE_PREBUILD', 'true').lower() == 'true'
+DERIVATIVE_SAVE_OPTIONS = {'webp': {'quality': 75, 'method': 4}, 'avif': {'quality': 55, 'speed': 8}}
+DERIVATIVE_NAME_PATTERN = re.compile(r'^([0-9a-f]{16})-(\d+)\.(webp|avif)$')
+
+def derivative_formats():
+    """Output formats this Pillow build can encode, best first."""
+    if Image is None:
+        return []
+    return [fmt for fmt in ('avif', 'webp') if pil_features.check(fmt)]
+
+def derivative_widths(original_width):
+    """Target widths for an image: the configured widths below its own width, plus
+    the original width itself if it is no wider than the largest target."""
+    if not original_width:
+        return []
+    widths = [w for w in DERIVATIVE_WIDTHS if w < original_width]
+    if original_width <= DERIVATIVE_WIDTHS[-1]:
+        widths.append(original_width)
+    return widths
+
+def derivative_name(content_hash, width, fmt):
+    return f'{content_hash[:16]}-{width}.{fmt}'
+
+def build_derivatives(source_path, content_hash, widths, formats, out_dir):
+    """Writes every width x format variant of one image. Runs in a worker process.
+
+    EXIF orientation is applied to the pixels and no metadata is copied to the
+    output. Files are written to a temp name and renamed into place, so a
+    reader never sees a partial file.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    with Image.open(source_path) as original:
+        image = ImageOps.exif_transpose(original)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+        for width in widths:
+            height = max(1, round(image.height * width / image.width))
+            resized = image if width == image.width else image.resize((width, height), Image.LANCZOS)
+            for fmt in formats:
+                target = os.path.join(out_dir, derivative_name(content_hash, width, fmt))
+                if os.path.exists(target):
+                    continue
+                tmp_path = f'{target}.{os.getpid()}.tmp'
+                resized.save(tmp_path, format=fmt.upper(), **DERIVATIVE_SAVE_OPTIONS[fmt])
+                os.replace(tmp_path, target)
+    return content_hash
+
+class DerivativeStore:
+    """Builds and locates resized WebP/AVIF copies of gallery photos.
+
+    Derivatives are named after the source's content hash, so they never go
+    stale and can be cached forever. Builds run in a process pool, either all
+    at startup or on the first request for an image; a per-image lock keeps
+    concurrent requests from building the same image twice.
+    """
+
+    def __init__(self, out_dir=DERIVATIVE_DIR, workers=DERIVATIVE_WORKERS):
+        self.out_dir = out_dir
+        self.workers = max(1, workers)
+        self.formats = derivative_formats()
+        self._pool = None
+        self._lock = threading.Lock()
+        self._image_locks = {}
+        self.closed = False
+
+    @property
+    def enabled(self):
+        return bool(self.formats)
+
+    def _executor(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = concurrent.futures.ProcessPoolExecutor(max_workers=self.workers)
+            return self._pool
+
+    def _missing(self, entry):
+        return any(
+            not os.path.exists(os.path.join(self.out_dir, derivative_name(entry['hash'], width, fmt)))
+            for width in derivative_widths(entry['width']) for fmt in self.formats)
+
+    def _submit(self, entry):
+        source = os.path.join(PHOTO_DIR, entry['filename'])
+        return self._executor().submit(
+            build_derivatives, source, entry['hash'], derivative_widths(entry['width']), self.formats, self.out_dir)
+
+    def ensure(self, entry):
+        """Builds the derivatives for one manifest entry if any are missing (blocking)."""
+        if not self.enabled or not self._missing(entry):
+            return
+        with self._lock:
+            image_lock = self._image_locks.setdefault(entry['hash'], threading.Lock())
+        with image_lock:
+            if self._missing(entry):
+                self._submit(entry).result()
+
+    def build_all(self, entries):
+        """Builds every missing derivative in parallel. Returns the number of images built."""
+        pending = [entry for entry in entries if entry['width'] and self._missing(entry)]
+        if not self.enabled or not pending:
+            return 0
+        started = time.time()
+        futures = {}
+        for entry in pending:
+            if self.closed:
+                break
+            try:
+                futures[self._submit(entry)] = entry
+            except RuntimeError:
+                if not self.closed:
+                    raise
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                if not self.closed:
+                    logger.error(f"Error building derivatives for {futures[future]['filename']}: {e}")
+        if self.closed:
+            logger.info("Derivative prebuild stopped for shutdown")
+            return 0
+        logger.info(f"Built derivatives for {len(pending)} image(s) in {time.time() - started:.1f}s")
+        return len(pending)
+
+    def srcset(self, entry):
+        """srcset strings per format for a manifest entry, or None if derivatives are disabled."""
+        widths = derivative_widths(entry['width'])
+        if not self.enabled or not widths:
+            return None
+        return {
+            fmt: ', '.join(f'/media/derived/{derivative_name(entry["hash"], w, fmt)} {w}w' for w in widths)
+            for fmt in self.formats
+        }
+
+    def shutdown(self):
+        """Cancels queued builds without waiting (only the ones already encoding finish).
+
+        Must run before interpreter shutdown, which otherwise waits for every
+        queued build: gunicorn's worker_exit hook or the __main__ block call it.
+        """
+        self.closed = True
+        with self._lock:
+            pool = self._pool
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+derivative_store = DerivativeStore()
+atexit.register(derivative_store.shutdown)
+
+def start_derivative_prebuild():
+    """Starts prebuild_derivatives in a background thread if DERIVATIVE_PREBUILD is on.
+
+    Called from gunicorn's post_worker_init hook or the __main__ block, never on
+    import, so importing server.py doesn't start a process pool.
+    """
+    if DERIVATIVE_PREBUILD and derivative_store.enabled:
+        threading.Thread(target=prebuild_derivatives, name='derivative-prebuild', daemon=True).start()
+
+def prebuild_derivatives(lock_path=os.path.join(DERIVATIVE_DIR, '.prebuild.lock')):
+    """Builds every missing derivative, in one process only.
+
+    Workers start together; the one that gets the flock on lock_path does the
+    prebuild and the others skip it (they still build on demand).
+    """
+    try:
+        os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+        with open(lock_path, 'a') as lock:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    logger.debug("Derivative prebuild is running in another process")
+                    return
+            derivative_store.build_all(gallery_manifest.get()[0])
+    except Exception as e:
+        if not derivative_store.closed:
+            logger.error(f"Error prebuilding image derivatives: {e}")
+
+@app.route('/media/derived/<filename>')
+def serve_derivative(filename):
+    """Serves a resized gallery image, building it on first request if needed."""
+    match = DERIVATIVE_NAME_PATTERN.match(filename)
+    if not match or not derivative_store.enabled:
+        return jsonify({'success': False, 'error': 'Not found'}), 404
+    if not os.path.exists(os.path.join(DERIVATIVE_DIR, filename)):
+        hash_prefix, width = match.group(1), int(match.group(2))
+        images, _ = gallery_manifest.get()
+        entry = next((image for image in images if image['hash'].startswith(hash_prefix)), None)
+        if entry is None or width not in derivative_widths(entry['width']):
+            return jsonify({'success': False, 'error': 'Not found'}), 404
+        derivative_store.ensure(entry)
+    # Names include the source's content hash, so they never change
+    return serve_media(os.path.join(DERIVATIVE_DIR, filename), IMMUTABLE_CACHE_CONTROL)
 
 @app.route('/api/gallery-images', methods=['GET'])
 def get_gallery_images():
-    """Returns a list of all images in the pg-photos directory."""
+    """Returns the (optionally paginated) gallery manifest for the pg-photos directory.
+
+    Supports ?offset=&limit= pagination and answers If-None-Match with 304.
+    """
     try:
-        import os
-        import mimetypes
-        
-        images = []
-        photo_dir = 'pg-photos'
-        
-        # Supported image extensions
-        supported_extensions = {'.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp'}
-        
-        if os.path.exists(photo_dir):
-            for filename in sorted(os.listdir(photo_dir)):
-                # Get file extension
-                _, ext = os.path.splitext(filename.lower())
-                
-                # Check if it's an image file
-                if ext in supported_extensions:
-                    # Skip video files
-                    if not filename.lower().endswith(('.mp4', '.avi', '.mov', '.wmv', '.flv', '.webm')):
-                        images.append({
-                            'filename': filename,
-                            'url': f'/pg-photos/{filename}',
-                            'alt': f'Yasodha Residency - {filename.replace("-", " ").replace("_", " ").split(".")[0]}'
-                        })
-        
-        return jsonify({
-            'success': True,
-            'images': images,
-            'count': len(images)
-        })
+        images, manifest_etag = gallery_manifest.get()
+
+        try:
+            offset = max(0, int(request.args.get('offset', 0)))
+            limit = request.args.get('limit')
+            limit = max(1, int(limit)) if limit is not None else None
+        except ValueError:
+            return jsonify({'success': False, 'error': 'offset and limit must be integers', 'images': []}), 400
+
+        end = len(images) if limit is None else min(len(images), offset + limit)
+        etag = f'{manifest_etag}-{offset}-{limit or "all"}'
+        if request.if_none_match.contains(etag):
+            response = make_response('', 304)
+        else:
+            page = images[offset:end]
+            response = jsonify({
+                'success': True,
+                'images': page,
+                'count': len(page),
+                'total': len(images),
+                'offset': offset,
+                'limit': limit,
+                'next_offset': end if end < len(images) else None
+            })
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = f'public, max-age={GALLERY_CACHE_MAX_AGE}, must-revalidate'
+        return response
     except Exception as e:
-        print(f"Error loading gallery images: {e}")
+        logger.error(f"Error loading gallery images: {e}")
         return jsonify({
             'success': False,
             'error': str(e),
             'images': []
         }), 500
 
+# --- Inquiry export API ---
+# Streams stored inquiries from the local outbox (never from the sheet) as CSV
+# or JSON lines. Rows are read from a SQLite cursor as the response is written,
+# so memory stays constant however many rows match.
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN', '')
+EXPORT_DEFAULT_LIMIT = int(os.environ.get('EXPORT_DEFAULT_LIMIT', 1000))
+EXPORT_MAX_LIMIT = int(os.environ.get('EXPORT_MAX_LIMIT', 100000))
+EXPORT_COLUMNS = SHEET_HEADERS + ['Type', 'Status']
+INQUIRY_TYPES = {'booking', 'subscription'}
+CSV_FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+def require_admin_token(view):
+    """Allows the request only with Authorization: Bearer <ADMIN_TOKEN> (or X-Admin-Token)."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if not ADMIN_TOKEN:
+            return jsonify({"success": False, "error": "Not found"}), 404
+        auth = request.headers.get('Authorization', '')
+        supplied = auth[7:] if auth.startswith('Bearer ') else request.headers.get('X-Admin-Token', '')
+        if not hmac.compare_digest(supplied.encode(), ADMIN_TOKEN.encode()):
+            return jsonify({"success": False, "error": "Unauthorized"}), 401
+        return view(*args, **kwargs)
+    return wrapper
+
+def encode_cursor(position):
+    return base64.urlsafe_b64encode(f"{position[0]!r}:{position[1]}".encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+    created_at, row = raw.rsplit(':', 1)
+    return float(created_at), int(row)
+
+def parse_ist_date(value, days=0):
+    """Epoch seconds of midnight IST on a YYYY-MM-DD date, shifted by days."""
+    day = datetime.strptime(value, '%Y-%m-%d') + timedelta(days=days)
+    return IST.localize(day).timestamp()
+
+def export_row(record):
+    return Outbox.sheet_row(record) + [record['kind'], record['status']]
+
+def csv_safe(value):
+    """Stops spreadsheet apps from evaluating exported text as a formula."""
+    return f"'{value}" if value.startswith(CSV_FORMULA_PREFIXES) else value
+
+def stream_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for i, record in enumerate(rows, 1):
+        writer.writerow([csv_safe(str(v)) for v in export_row(record)])
+        if i % 100 == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+def stream_jsonl(rows):
+    keys = OUTBOX_COLUMNS + ['id', 'type', 'status']
+    chunk = []
+    for record in rows:
+        chunk.append(json.dumps(dict(zip(keys, export_row(record))), ensure_ascii=False) + '\n')
+        if len(chunk) == 100:
+            yield ''.join(chunk)
+            chunk = []
+    yield ''.join(chunk)
+
+@app.route('/api/inquiries', methods=['GET'])
+@require_admin_token
+def export_inquiries():
+    """Streams stored inquiries as CSV (default) or JSONL.
+
+    Query parameters: from / to (YYYY-MM-DD, inclusive, IST), type (booking or
+    subscription), email, limit, cursor (from the previous page's X-Next-Cursor
+    header) and format (csv or jsonl).
+    """
+    try:
+        filters = {
+            'start': parse_ist_date(request.args['from']) if request.args.get('from') else None,
+            'end': parse_ist_date(request.args['to'], days=1) if request.args.get('to') else None,
+            'kind': request.args.get('type') or None,
+            'email': request.args.get('email') or None,
+            'after': decode_cursor(request.args['cursor']) if request.args.get('cursor') else None,
+        }
+        limit = min(EXPORT_MAX_LIMIT, max(1, int(request.args.get('limit', EXPORT_DEFAULT_LIMIT))))
+    except (ValueError, UnicodeDecodeError, binascii.Error):
+        return jsonify({"success": False, "error": "Invalid from, to, limit or cursor parameter"}), 400
+    if filters['kind'] and filters['kind'] not in INQUIRY_TYPES:
+        return jsonify({"success": False, "error": "type must be booking or subscription"}), 400
+    fmt = request.args.get('format', 'csv')
+    if fmt not in ('csv', 'jsonl'):
+        return jsonify({"success": False, "error": "format must be csv or jsonl"}), 400
+
+    next_position = outbox.page_end(limit, **filters)
+    rows = outbox.query(limit, **filters)
+    if fmt == 'csv':
+        response = Response(stream_with_context(stream_csv(rows)), mimetype='text/csv')
+        response.headers['Content-Disposition'] = 'attachment; filename="inquiries.csv"'
+    else:
+        response = Response(stream_with_context(stream_jsonl(rows)), mimetype='application/x-ndjson')
+    response.headers['Cache-Control'] = 'no-store'
+    if next_position:
+        next_cursor = encode_cursor(next_position)
+        response.headers['X-Next-Cursor'] = next_cursor
+        args = request.args.to_dict()
+        args['cursor'] = next_cursor
+        response.headers['Link'] = f'<{request.path}?{urllib.parse.urlencode(args)}>; rel="next"'
+    return response
+
+# --- Request profiling ---
+# Off unless PROFILE_REQUESTS=true (every request), PROFILE_SAMPLE_RATE > 0
+# (that fraction of requests) or a request carries X-Profile: <ADMIN_TOKEN>.
+# The default 'sample' mode reads the serving thread's stack every
+# PROFILE_INTERVAL seconds from one background thread, so unprofiled requests
+# pay a random() call and profiled ones no per-call hook; 'cprofile' traces
+# every call instead. Profiles go to PROFILE_DIR, keeping the newest
+# PROFILE_MAX_FILES across all workers. Streamed bodies (the export) are
+# generated after the profile ends.
+PROFILE_REQUESTS = os.environ.get('PROFILE_REQUESTS', 'false').lower() == 'true'
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+PROFILE_MODE = os.environ.get('PROFILE_MODE', 'sample')  # 'sample' or 'cprofile'
+PROFILE_INTERVAL = float(os.environ.get('PROFILE_INTERVAL', 0.005))
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join('data', 'profiles'))
+PROFILE_MAX_FILES = int(os.environ.get('PROFILE_MAX_FILES', 200))
+PROFILE_HEADER = 'X-Profile'
+PROFILE_ID_PATTERN = re.compile(r'^\d{13}-\d+-[\w-]{1,64}$')
+FRAME_NAME_PATTERN = re.compile(r'^(?P<name>.*) \((?P<file>[^()]*):(?P<line>\d+)\)$')
+
+metrics.counter('profiles_recorded_total', "Requests profiled and written to PROFILE_DIR, by mode.")
+
+def frame_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(';', ',')
+
+def collapse_stack(frame):
+    """'outer;...;inner' frame labels for a stack, outermost first."""
+    labels = []
+    while frame is not None:
+        labels.append(frame_label(frame.f_code))
+        frame = frame.f_back
+    return ';'.join(reversed(labels))
+
+class StackSampler:
+    """Samples the stacks of the threads serving profiled requests.
+
+    One daemon thread per process wakes every interval while any thread is
+    registered and reads only the registered threads from sys._current_frames().
+    """
+
+    def __init__(self, interval=PROFILE_INTERVAL):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._active = {}
+        self._wakeup = threading.Event()
+        self._pid = None
+
+    def start(self, thread_id):
+        with self._lock:
+            self._active[thread_id] = collections.Counter()
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                threading.Thread(target=self._run, name='stack-sampler', daemon=True).start()
+        self._wakeup.set()
+
+    def stop(self, thread_id):
+        """Unregisters the thread and returns its Counter of collapsed stacks."""
+        with self._lock:
+            return self._active.pop(thread_id, None)
+
+    def _run(self):
+        while True:
+            if not self._active:
+                self._wakeup.wait()
+                self._wakeup.clear()
+                continue
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                for thread_id, stacks in self._active.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        stacks[collapse_stack(frame)] += 1
+
+stack_sampler = StackSampler()
+
+def should_profile():
+    if request.path.startswith('/api/profiles'):
+        return False
+    if PROFILE_REQUESTS:
+        return True
+    supplied = request.headers.get(PROFILE_HEADER)
+    if supplied and ADMIN_TOKEN and hmac.compare_digest(supplied.encode(), ADMIN_TOKEN.encode()):
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+class ProfileStore:
+    """Profiles on disk as <id>.json (metadata and collapsed stacks) plus <id>.pstats in cprofile mode.
+
+    IDs start with a millisecond timestamp, so sorting names sorts by age;
+    writing one prunes the oldest beyond max_files.
+    """
+
+    def __init__(self, directory=PROFILE_DIR, max_files=PROFILE_MAX_FILES):
+        self.directory = directory
+        self.max_files = max_files
+
+    def path(self, profile_id, ext='.json'):
+        return os.path.join(self.directory, profile_id + ext)
+
+    def save(self, record, stats=None):
+        os.makedirs(self.directory, exist_ok=True)
+        if stats is not None:
+            stats.dump_stats(self.path(record['id'], '.pstats'))
+        tmp_path = self.path(record['id'], f'.{os.getpid()}.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(record, f)
+        os.replace(tmp_path, self.path(record['id']))
+        self.prune()
+
+    def ids(self):
+        """Profile IDs, newest first."""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return sorted((n[:-5] for n in names if n.endswith('.json')), reverse=True)
+
+    def prune(self):
+        for profile_id in self.ids()[self.max_files:]:
+            for ext in ('.json', '.pstats'):
+                try:
+                    os.remove(self.path(profile_id, ext))
+                except FileNotFoundError:
+                    pass
+
+    def load(self, profile_id):
+        """The stored record, or None if the ID is malformed or has been pruned."""
+        if not PROFILE_ID_PATTERN.match(profile_id):
+            return None
+        try:
+            with open(self.path(profile_id), encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+profile_store = ProfileStore()
+# Profiles hold request paths and stacks: only /api/profiles (ADMIN_TOKEN) may serve them
+PRIVATE_DIRS.append(os.path.realpath(PROFILE_DIR))
+
+@app.before_request
+def start_profile():
+    if not should_profile():
+        return
+    if PROFILE_MODE == 'cprofile':
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:  # Another profiler is active in this process
+            return
+        g.profiler = profiler
+    else:
+        stack_sampler.start(threading.get_ident())
+        g.profiler = 'sample'
+    g.profile_started = time.perf_counter()
+    g.profile_wall_start = time.time()
+
+@app.after_request
+def finish_profile(response):
+    profiler = g.pop('profiler', None)
+    if profiler is None:
+        return response
+    duration = time.perf_counter() - g.profile_started
+    stats = None
+    if profiler == 'sample':
+        stacks = stack_sampler.stop(threading.get_ident()) or {}
+        mode = 'sample'
+    else:
+        profiler.disable()
+        stats = pstats.Stats(profiler)
+        stacks = pstats_stacks(stats)
+        mode = 'cprofile'
+    request_id = re.sub(r'[^\w-]', '', g.get('request_id', ''))[:64] or uuid.uuid4().hex[:16]
+    record = {
+        'id': f"{int(g.profile_wall_start * 1000):013d}-{os.getpid()}-{request_id}",
+        'mode': mode,
+        'interval': PROFILE_INTERVAL if mode == 'sample' else None,
+        'started_at': datetime.fromtimestamp(g.profile_wall_start, IST).isoformat(timespec='milliseconds'),
+        'method': request.method,
+        'path': request.path,
+        'endpoint': request.endpoint,
+        'status': response.status_code,
+        'duration_ms': round(duration * 1000, 2),
+        'stacks': dict(stacks),
+    }
+    try:
+        profile_store.save(record, stats)
+        metrics.inc('profiles_recorded_total', mode=mode)
+        response.headers['X-Profile-ID'] = record['id']
+    except OSError as e:
+        logger.warning(f"Could not save profile {record['id']}: {e}")
+    return response
+
+@app.teardown_request
+def abandon_profile(exc):
+    # The request failed before finish_profile ran; don't leave the thread registered
+    profiler = g.pop('profiler', None)
+    if profiler == 'sample':
+        stack_sampler.stop(threading.get_ident())
+    elif profiler is not None:
+        profiler.disable()
+
+def pstats_stacks(stats):
+    """Approximate collapsed stacks from cProfile data: caller;callee weighted by time in microseconds.
+
+    cProfile keeps only caller/callee pairs, not whole stacks, so the
+    flamegraph is two levels deep; download ?format=pstats for the full data.
+    """
+    stacks = collections.Counter()
+    for (filename, line, name), (_, _, tottime, _, callers) in stats.stats.items():
+        callee = f"{name} ({os.path.basename(filename)}:{line})".replace(';', ',')
+        if not callers:
+            stacks[callee] += int(tottime * 1e6)
+            continue
+        total_calls = sum(c[0] for c in callers.values()) or 1
+        for (c_file, c_line, c_name), (calls, *_) in callers.items():
+            caller = f"{c_name} ({os.path.basename(c_file)}:{c_line})".replace(';', ',')
+            stacks[f"{caller};{callee}"] += int(tottime * 1e6 * calls / total_calls)
+    return {k: v for k, v in stacks.items() if v > 0}
+
+def render_collapsed(stacks):
+    """Brendan Gregg's collapsed format, read by flamegraph.pl and speedscope."""
+    return ''.join(f"{stack} {count}\n" for stack, count in sorted(stacks.items()))
+
+def render_speedscope(name, records):
+    """A speedscope file with one sampled profile per record."""
+    frames, index = [], {}
+    profiles = []
+    for record in records:
+        # Samples are counts of PROFILE_INTERVAL; cProfile weights are microseconds
+        scale = record['interval'] * 1000 if record.get('interval') else 0.001
+        samples, weights = [], []
+        for stack, count in record['stacks'].items():
+            ids = []
+            for label in stack.split(';'):
+                if label not in index:
+                    match = FRAME_NAME_PATTERN.match(label)
+                    frame = {'name': match.group('name'), 'file': match.group('file'),
+                             'line': int(match.group('line'))} if match else {'name': label}
+                    index[label] = len(frames)
+                    frames.append(frame)
+                ids.append(index[label])
+            samples.append(ids)
+            weights.append(round(count * scale, 3))
+        profiles.append({
+            'type': 'sampled',
+            'name': f"{record['method']} {record['path']} ({record['id']})",
+            'unit': 'milliseconds',
+            'startValue': 0,
+            'endValue': round(sum(weights), 3),
+            'samples': samples,
+            'weights': weights,
+        })
+    return {
+        '$schema': 'https://www.speedscope.app/file-format-schema.json',
+        'name': name,
+        'exporter': 'server.py',
+        'shared': {'frames': frames},
+        'profiles': profiles,
+    }
+
+def profile_response(name, records, fmt):
+    if fmt == 'speedscope':
+        response = make_response(json.dumps(render_speedscope(name, records)))
+        response.mimetype = 'application/json'
+        response.headers['Content-Disposition'] = f'attachment; filename="{name}.speedscope.json"'
+    else:
+        merged = collections.Counter()
+        for record in records:
+            merged.update(record['stacks'])
+        response = make_response(render_collapsed(merged))
+        response.mimetype = 'text/plain'
+        response.headers['Content-Disposition'] = f'attachment; filename="{name}.collapsed.txt"'
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+@app.route('/api/profiles', methods=['GET'])
+@require_admin_token
+def list_profiles():
+    """Stored request profiles, newest first (without their stacks)."""
+    limit = request.args.get('limit', 100, type=int)
+    profiles = []
+    for profile_id in profile_store.ids()[:max(1, limit)]:
+        record = profile_store.load(profile_id)
+        if record:
+            record.pop('stacks', None)
+            profiles.append(record)
+    return jsonify({"success": True, "profiles": profiles})
+
+@app.route('/api/profiles/merged', methods=['GET'])
+@require_admin_token
+def merged_profile():
+    """All stored profiles (optionally only ?endpoint=... or ?path=...) as one flamegraph."""
+    fmt = request.args.get('format', 'collapsed')
+    if fmt not in ('collapsed', 'speedscope'):
+        return jsonify({"success": False, "error": "format must be collapsed or speedscope"}), 400
+    records = [r for r in (profile_store.load(i) for i in profile_store.ids()) if r
+               and request.args.get('endpoint', r['endpoint']) == r['endpoint']
+               and request.args.get('path', r['path']) == r['path']]
+    if fmt == 'collapsed':
+        # Mixing sample counts with cProfile microseconds would skew the graph
+        modes = {r['mode'] for r in records}
+        if len(modes) > 1:
+            records = [r for r in records if r['mode'] == 'sample']
+    return profile_response('merged', records, fmt)
+
+@app.route('/api/profiles/<profile_id>', methods=['GET'])
+@require_admin_token
+def get_profile(profile_id):
+    """One profile as collapsed stacks (default), speedscope JSON or, for cprofile, raw pstats."""
+    record = profile_store.load(profile_id)
+    if record is None:
+        return jsonify({"success": False, "error": "Profile not found"}), 404
+    fmt = request.args.get('format', 'collapsed')
+    if fmt == 'pstats' and record['mode'] == 'cprofile':
+        return send_file(os.path.abspath(profile_store.path(profile_id, '.pstats')), mimetype='application/octet-stream',
+                         as_attachment=True, download_name=f'{profile_id}.pstats')
+    if fmt not in ('collapsed', 'speedscope'):
+        return jsonify({"success": False, "error": "format must be collapsed, speedscope or pstats (cprofile mode)"}), 400
+    return profile_response(profile_id, [record], fmt)
+
+# --- Rate limiting and idempotent submissions ---
+# Both run before the view, so a rejected or repeated POST costs a dict lookup
+# and never reaches the outbox or Google Sheets. State is per process; a
+# repeat that lands on another worker is caught by the outbox instead, where
+# every row is stored with its idempotency key (see Outbox.add).
+RATE_LIMIT_PER_MINUTE = float(os.environ.get('RATE_LIMIT_PER_MINUTE', 10))
+RATE_LIMIT_BURST = int(os.environ.get('RATE_LIMIT_BURST', 5))
+RATE_LIMIT_MAX_CLIENTS = int(os.environ.get('RATE_LIMIT_MAX_CLIENTS', 10000))
+TRUSTED_PROXY_HOPS = int(os.environ.get('TRUSTED_PROXY_HOPS', 1))  # Render adds one X-Forwarded-For entry
+IDEMPOTENCY_WINDOW = float(os.environ.get('IDEMPOTENCY_WINDOW', 600))
+IDEMPOTENCY_MAX_ENTRIES = int(os.environ.get('IDEMPOTENCY_MAX_ENTRIES', 10000))
+
+def client_ip():
+    """The client address as seen by the last trusted proxy (spoofed entries further left are ignored)."""
+    forwarded = [part.strip() for part in request.headers.get('X-Forwarded-For', '').split(',') if part.strip()]
+    if forwarded and TRUSTED_PROXY_HOPS > 0:
+        return forwarded[-min(TRUSTED_PROXY_HOPS, len(forwarded))]
+    return request.remote_addr or 'unknown'
+
+class RateLimiter:
+    """Token bucket per client, kept in an LRU-bounded OrderedDict."""
+
+    def __init__(self, per_minute=RATE_LIMIT_PER_MINUTE, burst=RATE_LIMIT_BURST, max_clients=RATE_LIMIT_MAX_CLIENTS):
+        self.rate = per_minute / 60.0
+        self.burst = max(1, burst)
+        self.max_clients = max(1, max_clients)
+        self._buckets = collections.OrderedDict()  # key -> (tokens, updated_at)
+        self._lock = threading.Lock()
+
+    def acquire(self, key):
+        """Takes a token for key. Returns 0 if allowed, else seconds until one is available."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        if allowed:
+            return 0.0
+        return (1 - tokens) / self.rate if self.rate > 0 else 60.0
+
+    def __len__(self):
+        return len(self._buckets)
+
+class IdempotencyCache:
+    """Recent POST results keyed by Idempotency-Key or payload hash, LRU-bounded.
+
+    The first request for a key claims it; concurrent duplicates wait for its
+    result instead of running the view a second time.
+    """
+
+    def __init__(self, window=IDEMPOTENCY_WINDOW, max_entries=IDEMPOTENCY_MAX_ENTRIES):
+        self.window = window
+        self.max_entries = max(1, max_entries)
+        self._entries = collections.OrderedDict()  # key -> [expires_at, done Event, (body, status, mimetype)]
+        self._lock = threading.Lock()
+
+    def claim(self, key, wait=10.0):
+        """Returns a stored (body, status, mimetype), or None if the caller should run the request."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < now:
+                self._entries[key] = [now + self.window, threading.Event(), None]
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                return None
+        entry[1].wait(wait)
+        return entry[2]
+
+    def store(self, key, body, status, mimetype):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry[2] = (body, status, mimetype)
+                entry[1].set()
+
+    def release(self, key):
+        """Forgets a claim whose request failed, so a retry runs again."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        if entry is not None:
+            entry[1].set()
+
+    def __len__(self):
+        return len(self._entries)
+
+submission_limiter = RateLimiter()
+idempotency_cache = IdempotencyCache()
+
+def rate_limited(view):
+    """Answers 429 with Retry-After once a client's POST budget is spent."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if request.method == 'POST':
+            retry_after = submission_limiter.acquire(client_ip())
+            if retry_after:
+                metrics.inc('rate_limited_total', endpoint=request.endpoint)
+                response = jsonify({"success": False, "message": "Too many requests. Please wait a minute and try again."})
+                response.status_code = 429
+                response.headers['Retry-After'] = str(math.ceil(retry_after))
+                return response
+        return view(*args, **kwargs)
+    return wrapper
+
+def idempotency_key():
+    """Idempotency-Key header if sent, else a hash of the client and canonical payload."""
+    header = request.headers.get('Idempotency-Key', '').strip()
+    if header:
+        return f"{request.endpoint}:key:{header[:200]}"
+    payload = request.get_json(silent=True)
+    if payload is None:
+        payload = request.form.to_dict() or request.get_data(as_text=True)
+    canonical = json.dumps(payload, sort_keys=True, separators=(',', ':'))
+    digest = hashlib.sha256(f"{client_ip()}\n{canonical}".encode()).hexdigest()
+    return f"{request.endpoint}:body:{digest}"
+
+def idempotent(view):
+    """Replays the earlier response for a repeated POST within IDEMPOTENCY_WINDOW."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if request.method != 'POST':
+            return view(*args, **kwargs)
+        key = g.idempotency_key = idempotency_key()
+        cached = idempotency_cache.claim(key)
+        if cached is not None:
+            metrics.inc('idempotent_replays_total', endpoint=request.endpoint)
+            body, status, mimetype = cached
+            response = make_response(body, status)
+            response.mimetype = mimetype
+            response.headers['Idempotent-Replayed'] = 'true'
+            return response
+        try:
+            response = make_response(view(*args, **kwargs))
+        except Exception:
+            idempotency_cache.release(key)
+            raise
+        if response.status_code >= 500:
+            idempotency_cache.release(key)  # Let the client retry a server failure
+        else:
+            idempotency_cache.store(key, response.get_data(), response.status_code, response.mimetype)
+        return response
+    return wrapper
+
 @app.route('/submit_booking', methods=['POST', 'OPTIONS'])
+@rate_limited
+@idempotent
 def handle_booking_submission():
-    global worksheet, use_csv_fallback # Access the globally initialized worksheet
-    
     # Handle CORS preflight
     if request.method == 'OPTIONS':
         response = jsonify({'status': 'ok'})
@@ -293,40 +3338,33 @@ def handle_booking_submission():
         return response, 200
 
     try:
-        # Debug logging
-        print(f"\n=== NEW BOOKING SUBMISSION ===")
-        print(f"Time: {datetime.now()}")
-        print(f"Request method: {request.method}")
-        print(f"Request content type: {request.content_type}")
-        print(f"Request headers: {dict(request.headers)}")
-        print(f"Request data: {request.data}")
-        print(f"Request form: {request.form}")
-        print(f"Request JSON: {request.json if request.is_json else 'Not JSON'}")
+        # Verbose request dump, only at DEBUG level and for a sample of requests
+        if logger.isEnabledFor(logging.DEBUG) and random.random() < LOG_DEBUG_SAMPLE_RATE:
+            logger.debug("Booking submission payload", extra={'payload': {
+                'content_type': request.content_type,
+                'headers': dict(request.headers),
+                'body': request.get_data(as_text=True),
+            }})
         
         # Get data based on content type
         data = None
         if request.is_json:
             data = request.get_json()
-            print(f"JSON data received: {data}")
         elif request.form:
             data = request.form.to_dict()
-            print(f"Form data received: {data}")
         else:
             # Try to parse as JSON even if content-type is wrong
             try:
                 import json
                 data = json.loads(request.data.decode('utf-8'))
-                print(f"Manually parsed JSON: {data}")
             except:
-                print("Failed to parse request data")
+                logger.warning("Failed to parse request data")
                 return jsonify({"success": False, "message": "Invalid data format received"}), 400
                 
         if not data:
-            print("No data found in request")
+            logger.warning("No data found in request")
             return jsonify({"success": False, "message": "No data received"}), 400
             
-        print(f"Final parsed data: {data}")
-
         name = data.get('name', '').strip()
         email = data.get('email', '').strip()
         phone = data.get('phone', '').strip()
@@ -356,56 +3394,27 @@ def handle_booking_submission():
 
         row_data = [date_str, time_str, name, email, phone, visit_date, message]
         
-        # Try Google Sheets first, fall back to CSV
-        success_response = jsonify({"success": True, "message": "Thank you! Your inquiry has been submitted successfully."})
-        error_response = jsonify({"success": False, "message": "Failed to save inquiry. Please try again."})
-        
-        # Check if Google Sheets is available
-        if worksheet is not None and not use_csv_fallback:
-            try:
-                print(f"Attempting to write to Google Sheets...")
-                worksheet.append_row(row_data, value_input_option='USER_ENTERED')
-                print(f"✓ Inquiry from {name} ({email}) successfully written to Google Sheet")
-                print(f"  Row data: {row_data}")
-                print(f"  Google Sheet URL: https://docs.google.com/spreadsheets/d/{SPREADSHEET_ID}")
-                # Also save to CSV as backup
-                write_to_csv(row_data)
-                return add_cors_headers(success_response), 200
-            except Exception as e:
-                print(f"✗ Failed to write to Google Sheets: {e}")
-                print(f"Falling back to CSV...")
-                if write_to_csv(row_data):
-                    print(f"✓ Successfully saved to CSV fallback")
-                    return add_cors_headers(success_response), 200
-                else:
-                    return add_cors_headers(error_response), 500
+        # Commit to the local outbox; the replayer pushes it to Google Sheets
+        if store_row('booking', row_data, idempotency_key=g.get('idempotency_key')):
+            return add_cors_headers(jsonify({"success": True, "message": "Thank you! Your inquiry has been submitted successfully."})), 200
         else:
-            # Use CSV fallback
-            print(f"Using CSV storage (Google Sheets not available)")
-            if write_to_csv(row_data):
-                print(f"✓ Inquiry saved to CSV")
-                return add_cors_headers(success_response), 200
-            else:
-                print(f"✗ Failed to save to CSV")
-                return add_cors_headers(error_response), 500
+            return add_cors_headers(jsonify({"success": False, "message": "Failed to save inquiry. Please try again."})), 500
 
     except gspread.exceptions.APIError as e:
-        print(f"Google Sheets API Error: {e}")
+        logger.error(f"Google Sheets API Error: {e}")
         error_details = e.args[0] if e.args else {}
         if isinstance(error_details, dict):
-            print(f"Google API error details: {error_details.get('message')}")
+            logger.error(f"Google API error details: {error_details.get('message')}")
         return add_cors_headers(jsonify({"success": False, "message": "Error communicating with Google Sheets. Please try again."})), 503
     except Exception as e:
-        print(f"Error processing inquiry: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception(f"Error processing inquiry: {e}")
         return add_cors_headers(jsonify({"success": False, "message": "An internal server error occurred."})), 500
 
 @app.route('/subscribe_email', methods=['POST'])
+@rate_limited
+@idempotent
 def handle_subscription():
     """Handle email subscription requests."""
-    global worksheet, use_csv_fallback
-
     try:
         data = request.get_json()
         if not data:
@@ -419,17 +3428,11 @@ def handle_subscription():
         if not re.match(r"[^@]+@[^@]+\.[^@]+", email):
             return jsonify({"success": False, "message": "Invalid email format."}), 400
 
-        # Check if already subscribed (simple check - could be improved)
-        try:
-            # Get all emails from the sheet (assuming email is in column 4 for bookings)
-            if worksheet:
-                all_values = worksheet.get_all_values()
-                existing_emails = [row[3] for row in all_values[1:] if len(row) > 3]  # Skip header
-                
-                if email in existing_emails:
-                    return jsonify({"success": True, "message": "You're already subscribed!"}), 200
-        except Exception as e:
-            print(f"Error checking existing subscriptions: {e}")
+        # Check if already subscribed against the in-memory email index, then the
+        # shared outbox (which also holds rows other workers just accepted)
+        email_index.maybe_refresh(sheets)
+        if email in email_index or outbox.has_email(email):
+            return jsonify({"success": True, "message": "You're already subscribed!"}), 200
 
         # Generate Date and Time strings using Indian Standard Time
         ist = pytz.timezone('Asia/Kolkata')
@@ -440,42 +3443,36 @@ def handle_subscription():
         # Add subscription entry with empty fields for unused columns
         row_data = [date_str, time_str, "Newsletter Subscriber", email, "", "", "Subscribed to newsletter"]
         
-        # Try Google Sheets first, fall back to CSV
-        if worksheet:
-            try:
-                worksheet.append_row(row_data, value_input_option='USER_ENTERED')
-                print(f"Newsletter subscription from {email} added to Google Sheet")
-                write_to_csv(row_data)
-                return jsonify({"success": True, "message": "Successfully subscribed! We'll keep you updated."}), 200
-            except Exception as e:
-                print(f"Failed to write to Google Sheets: {e}")
-                if write_to_csv(row_data):
-                    return jsonify({"success": True, "message": "Successfully subscribed! We'll keep you updated."}), 200
-                else:
-                    return jsonify({"success": False, "message": "Failed to save subscription. Please try again."}), 500
+        # Commit to the local outbox; the replayer pushes it to Google Sheets
+        stored = store_row('subscription', row_data, unique_email=True, idempotency_key=g.get('idempotency_key'))
+        if stored:
+            return jsonify({"success": True, "message": "Successfully subscribed! We'll keep you updated."}), 200
+        elif stored is None:
+            # Another worker stored the same address a moment ago
+            return jsonify({"success": True, "message": "You're already subscribed!"}), 200
         else:
-            # Use CSV fallback
-            if write_to_csv(row_data):
-                return jsonify({"success": True, "message": "Successfully subscribed! We'll keep you updated."}), 200
-            else:
-                return jsonify({"success": False, "message": "Failed to save subscription. Please try again."}), 500
+            return jsonify({"success": False, "message": "Failed to save subscription. Please try again."}), 500
 
     except Exception as e:
-        print(f"Error processing subscription: {e}")
+        logger.exception(f"Error processing subscription: {e}")
         return jsonify({"success": False, "message": "An error occurred. Please try again."}), 500
 
+start_background_services()
+
 if __name__ == '__main__':
     # Get port from environment variable (Render sets this)
     port = int(os.environ.get('PORT', 5001))
     host = os.environ.get('HOST', '0.0.0.0')
     debug = os.environ.get('FLASK_ENV', 'development') == 'development'
     
-    print("\n=== Starting Yasodha Residency Backend Server ===")
-    print(f"Server will run on: http://{host}:{port}")
-    print(f"Service account file exists: {os.path.exists(SERVICE_ACCOUNT_FILE)}")
-    print(f"Google Sheets connected: {worksheet is not None}")
-    print(f"CSV fallback active: {use_csv_fallback}")
-    print(f"Environment: {os.environ.get('FLASK_ENV', 'development')}")
-    print("\nPress Ctrl+C to stop the server\n")
+    logger.info("Starting Yasodha Residency Backend Server")
+    logger.info(f"Server will run on: http://{host}:{port}")
+    logger.info(f"Service account file exists: {os.path.exists(SERVICE_ACCOUNT_FILE)}")
+    logger.info("Google Sheets connects in the background; see /test for status")
+    logger.info(f"Environment: {os.environ.get('FLASK_ENV', 'development')}")
     
-    app.run(debug=debug, port=port, host=host)
\ No newline at end of file
+    start_derivative_prebuild()
+    try:
+        app.run(debug=debug, port=port, host=host)
+    finally:
+        derivative_store.shutdown()
\ No newline at end of file
@@ -1,198 +1,235 @@
 /**
  * Service Worker for Yasodha Residency Website
  * Provides offline functionality and caching
+ *
+ * What to precache comes from /precache-manifest.json, which the server
+ * generates from the files on disk (URL, content revision and size of each).
+ * Installing only downloads entries whose revision changed since the last
+ * install; activating drops entries that are no longer listed. Gallery photos
+ * go in a separate runtime cache trimmed to a size cap, least recently used
+ * first.
  */
 
-const CACHE_NAME = 'yasodha-residency-v1';
-
-// Assets to cache on install
-const STATIC_ASSETS = [
-  '/',
-  '/index.html',
-  '/css/style.css',
-  '/css/animations.css',
-  '/css/responsive.css',
-  '/css/video.css',
-  '/js/main.js',
-  '/js/animations.js',
-  '/js/interactive.js',
-  '/js/media-categories.js',
-  '/js/gallery-loader.js',
-  '/js/video-handler.js',
-  '/js/sw-register.js',
-  '/assets/favicon.ico',
-  '/assets/icon-192x192.png',
-  '/assets/icon-512x512.png',
-  '/manifest.json'
-];
-
-// Assets to cache separately (larger files)
-const MEDIA_CACHE_NAME = 'yasodha-residency-media-v1';
-const MEDIA_ASSETS = [
-  '/assets/virtual-tour.mp4'
-];
-
-// Install event - cache static assets
+// Replaced by the server with the manifest version, so any asset change makes
+// this file differ and the browser installs the new worker
+const PRECACHE_VERSION = '__PRECACHE_VERSION__';
+
+const PRECACHE_NAME = 'yasodha-precache';
+const GALLERY_CACHE_NAME = 'yasodha-gallery';
+const MANIFEST_URL = '/precache-manifest.json';
+// Revisions of the entries currently in the precache
+const STATE_URL = '/__precache-state';
+
+// Defaults, overridden by the manifest's runtime.gallery settings
+let galleryConfig = {
+  prefixes: ['/pg-photos/', '/media/derived/'],
+  maxEntries: 60,
+  maxBytes: 25 * 1024 * 1024
+};
+
+// Install event - download new and changed precache entries
 self.addEventListener('install', event => {
-  event.waitUntil(
-    Promise.all([
-      // Cache static assets
-      caches.open(CACHE_NAME).then(cache => {
-        console.log('Caching static assets');
-        return cache.addAll(STATIC_ASSETS);
-      }),
-      
-      // Cache media assets separately
-      caches.open(MEDIA_CACHE_NAME).then(cache => {
-        console.log('Caching media assets');
-        return cache.addAll(MEDIA_ASSETS);
-      })
-    ])
-  );
-  
+  event.waitUntil(updatePrecache());
+
   // Activate immediately
   self.skipWaiting();
 });
 
-// Activate event - clean old caches
+// Activate event - drop stale precache entries and old caches
 self.addEventListener('activate', event => {
   event.waitUntil(
-    caches.keys().then(cacheNames => {
-      return Promise.all(
-        cacheNames.map(cacheName => {
-          if (cacheName !== CACHE_NAME && cacheName !== MEDIA_CACHE_NAME) {
-            console.log('Deleting old cache:', cacheName);
-            return caches.delete(cacheName);
-          }
-        })
-      );
-    })
+    Promise.all([cleanPrecache(), deleteOldCaches()]).then(() => self.clients.claim())
   );
-  
-  // Take control of clients immediately
-  self.clients.claim();
 });
 
-// Fetch event - serve from cache, fallback to network
+// Fetch event - precache first, gallery photos from the LRU cache, network otherwise
 self.addEventListener('fetch', event => {
-  // Skip cross-origin requests
-  if (!event.request.url.startsWith(self.location.origin)) {
+  const request = event.request;
+  const url = new URL(request.url);
+
+  // Skip cross-origin and non-GET requests
+  if (url.origin !== self.location.origin || request.method !== 'GET') {
     return;
   }
-  
-  // Skip non-GET requests
-  if (event.request.method !== 'GET') {
+
+  // Range requests (video) go straight to the network
+  if (request.headers.has('range')) {
     return;
   }
-  
-  // Image-specific strategy - cache first, network fallback with cache update
-  if (event.request.destination === 'image') {
-    event.respondWith(handleImageRequest(event.request));
+
+  if (request.mode === 'navigate') {
+    event.respondWith(handleNavigation(request));
     return;
   }
-  
-  // Video-specific strategy - network first with long cache
-  if (event.request.destination === 'video') {
-    event.respondWith(handleVideoRequest(event.request));
+
+  if (galleryConfig.prefixes.some(prefix => url.pathname.startsWith(prefix))) {
+    event.respondWith(handleGalleryRequest(request));
     return;
   }
-  
-  // Default strategy - stale while revalidate
+
   event.respondWith(
-    caches.match(event.request).then(cachedResponse => {
-      // Return cached response if available
-      if (cachedResponse) {
-        // Revalidate in the background
-        const fetchPromise = fetch(event.request)
-          .then(networkResponse => {
-            // Update cache with fresh response
-            caches.open(CACHE_NAME).then(cache => {
-              cache.put(event.request, networkResponse.clone());
-            });
-            return networkResponse;
-          })
-          .catch(error => {
-            console.log('Fetch failed:', error);
-            // Return original cached response
-            return cachedResponse;
-          });
-          
-        // Return cached response immediately
-        return cachedResponse;
-      }
-      
-      // If not in cache, fetch from network and cache
-      return fetch(event.request)
-        .then(response => {
-          // Cache the response
-          const responseToCache = response.clone();
-          caches.open(CACHE_NAME).then(cache => {
-            cache.put(event.request, responseToCache);
-          });
-          return response;
-        })
-        .catch(error => {
-          console.log('Fetch failed:', error);
-          // Show offline page if available
-          if (event.request.mode === 'navigate') {
-            return caches.match('/offline.html');
-          }
-          return new Response('Network error', { status: 408, headers: { 'Content-Type': 'text/plain' } });
-        });
-    })
+    caches.open(PRECACHE_NAME)
+      .then(cache => cache.match(request))
+      .then(cachedResponse => cachedResponse || fetch(request))
   );
 });
 
-// Handle image requests
-async function handleImageRequest(request) {
-  // Try cache first
-  const cachedResponse = await caches.match(request);
+// Fetches the manifest and downloads only the entries whose revision changed
+async function updatePrecache() {
+  const response = await fetch(MANIFEST_URL, { cache: 'no-store' });
+  if (!response.ok) {
+    throw new Error(`Precache manifest request failed: ${response.status}`);
+  }
+  const manifest = await response.json();
+  applyRuntimeConfig(manifest);
+
+  const cache = await caches.open(PRECACHE_NAME);
+  const state = await readState(cache);
+  const changed = [];
+  for (const entry of manifest.entries) {
+    if (state[entry.url] !== entry.revision || !(await cache.match(entry.url))) {
+      changed.push(entry);
+    }
+  }
+
+  // One entry failing doesn't fail the install; it's retried next time
+  const results = await Promise.allSettled(changed.map(async entry => {
+    const entryResponse = await fetch(entry.url, { cache: 'no-cache' });
+    if (!entryResponse.ok) {
+      throw new Error(`${entry.url}: ${entryResponse.status}`);
+    }
+    await cache.put(entry.url, entryResponse);
+    return entry;
+  }));
+
+  const next = {};
+  for (const entry of manifest.entries) {
+    if (state[entry.url] === entry.revision) {
+      next[entry.url] = entry.revision;
+    }
+  }
+  let downloaded = 0;
+  results.forEach((result, i) => {
+    if (result.status === 'fulfilled') {
+      next[changed[i].url] = changed[i].revision;
+      downloaded += changed[i].size;
+    } else {
+      console.log('Precache failed:', result.reason);
+    }
+  });
+  await writeState(cache, next, manifest);
+  console.log(`Precache ${manifest.version}: ${changed.length} of ${manifest.entries.length} entries changed (${downloaded} bytes)`);
+}
+
+// Deletes precached responses that the current manifest no longer lists
+async function cleanPrecache() {
+  const cache = await caches.open(PRECACHE_NAME);
+  const state = await readState(cache);
+  const keys = await cache.keys();
+  await Promise.all(keys.map(request => {
+    const path = new URL(request.url).pathname;
+    if (path !== STATE_URL && !(path in state)) {
+      return cache.delete(request);
+    }
+  }));
+}
+
+// Removes caches from earlier versions of this worker
+async function deleteOldCaches() {
+  const cacheNames = await caches.keys();
+  await Promise.all(cacheNames.map(cacheName => {
+    if (cacheName !== PRECACHE_NAME && cacheName !== GALLERY_CACHE_NAME) {
+      console.log('Deleting old cache:', cacheName);
+      return caches.delete(cacheName);
+    }
+  }));
+}
+
+async function readState(cache) {
+  const response = await cache.match(STATE_URL);
+  if (!response) {
+    return {};
+  }
+  const saved = await response.json();
+  if (saved.runtime) {
+    applyRuntimeConfig(saved);
+  }
+  return saved.revisions || {};
+}
+
+function writeState(cache, revisions, manifest) {
+  const body = JSON.stringify({ version: manifest.version, revisions, runtime: manifest.runtime });
+  return cache.put(STATE_URL, new Response(body, { headers: { 'Content-Type': 'application/json' } }));
+}
+
+function applyRuntimeConfig(manifest) {
+  if (manifest.runtime && manifest.runtime.gallery) {
+    galleryConfig = Object.assign({}, galleryConfig, manifest.runtime.gallery);
+  }
+}
+
+// Network first so the page is always current, the precached copy when offline
+async function handleNavigation(request) {
+  try {
+    return await fetch(request);
+  } catch (error) {
+    console.log('Navigation failed, serving from cache:', error);
+    const cache = await caches.open(PRECACHE_NAME);
+    const url = new URL(request.url);
+    const cachedResponse = url.pathname === '/' || url.pathname === '/index.html'
+      ? await cache.match('/')
+      : await cache.match(request);
+    return cachedResponse || (await cache.match('/offline.html')) ||
+      new Response('Offline', { status: 503, headers: { 'Content-Type': 'text/plain' } });
+  }
+}
+
+// Cache first; every hit is re-inserted so the cache's key order is least recently used first
+async function handleGalleryRequest(request) {
+  const cache = await caches.open(GALLERY_CACHE_NAME);
+  const cachedResponse = await cache.match(request);
   if (cachedResponse) {
-    // Update cache in background
-    fetch(request)
-      .then(response => {
-        caches.open(CACHE_NAME).then(cache => {
-          cache.put(request, response);
-        });
-      })
-      .catch(error => console.log('Error updating image cache:', error));
-      
+    await cache.delete(request);
+    await cache.put(request, cachedResponse.clone());
     return cachedResponse;
   }
-  
-  // If not in cache, fetch from network and cache
+
+  let networkResponse;
   try {
-    const networkResponse = await fetch(request);
-    const cache = await caches.open(CACHE_NAME);
-    cache.put(request, networkResponse.clone());
-    return networkResponse;
+    networkResponse = await fetch(request);
   } catch (error) {
     console.log('Image fetch failed:', error);
-    // Return placeholder image if available
-    return caches.match('/assets/placeholder.jpg');
+    return new Response('', { status: 504 });
   }
+  if (networkResponse.status === 200) {
+    await cache.put(request, networkResponse.clone());
+    trimGalleryCache(cache);
+  }
+  return networkResponse;
 }
 
-// Handle video requests
-async function handleVideoRequest(request) {
-  try {
-    // Try network first
-    const networkResponse = await fetch(request);
-    // Cache the response
-    const cache = await caches.open(MEDIA_CACHE_NAME);
-    cache.put(request, networkResponse.clone());
-    return networkResponse;
-  } catch (error) {
-    console.log('Video fetch failed:', error);
-    // Fall back to cache
-    const cachedResponse = await caches.match(request);
-    if (cachedResponse) {
-      return cachedResponse;
-    }
-    // Show error message if nothing in cache
-    return new Response('Video unavailable offline', { 
-      status: 503, 
-      headers: { 'Content-Type': 'text/plain' } 
-    });
+// Evicts the least recently used photos until the cache is under both caps
+let trimming = null;
+function trimGalleryCache(cache) {
+  if (trimming) {
+    return trimming;
   }
-}
\ No newline at end of file
+  trimming = (async () => {
+    const keys = await cache.keys();
+    const sizes = await Promise.all(keys.map(async request => {
+      const response = await cache.match(request);
+      const length = response && parseInt(response.headers.get('Content-Length'), 10);
+      return length || (response ? (await response.clone().blob()).size : 0);
+    }));
+    let totalBytes = sizes.reduce((sum, size) => sum + size, 0);
+    let count = keys.length;
+    for (let i = 0; i < keys.length && (count > galleryConfig.maxEntries || totalBytes > galleryConfig.maxBytes); i++) {
+      await cache.delete(keys[i]);
+      count -= 1;
+      totalBytes -= sizes[i];
+    }
+  })().finally(() => {
+    trimming = null;
+  });
+  return trimming;
+}
@@ -0,0 +1,45 @@
+"""
+Imports server.py once for the whole test run: scratch outbox, no derivative
+prebuild, and Google Sheets routed to the in-memory fake from benchmarks/.
+
+The background replayer is stopped so tests drive OutboxReplayer.replay()
+themselves.
+"""
+import os
+import sys
+import tempfile
+import time
+
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRATCH = tempfile.mkdtemp(prefix='server-tests-')
+
+os.environ.update(OUTBOX_DB=os.path.join(SCRATCH, 'inquiries.db'), METRICS_DIR='', DERIVATIVE_PREBUILD='false',
+                  LOG_LEVEL='ERROR', RATE_LIMIT_BURST='1000000')
+sys.path[:0] = [REPO_ROOT, os.path.join(REPO_ROOT, 'benchmarks')]
+os.chdir(REPO_ROOT)
+
+import fake_gspread  # noqa: E402
+
+FAKE_CLIENT = fake_gspread.install()
+
+import server  # noqa: E402
+
+server.outbox_replayer.flush_and_stop()
+
+
+@pytest.fixture
+def client():
+    return server.app.test_client()
+
+
+@pytest.fixture
+def sheets():
+    """The fake spreadsheet, once server.py is connected to it and the outbox is drained."""
+    deadline = time.monotonic() + 10
+    while not server.sheets.connected and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert server.sheets.connected
+    server.outbox_replayer.replay()
+    return FAKE_CLIENT.spreadsheet
@@ -0,0 +1,25 @@
+import server
+
+
+def test_index_is_rebuilt_only_after_the_check_interval(tmp_path, monkeypatch):
+    page_path = tmp_path / 'index.html'
+    page_path.write_text('<html><body>one</body></html>')
+    page = server.IndexPage(str(page_path), mode='static', check_interval=60)
+    body, _, etag = page.get()
+    assert b'one' in body
+
+    stats = []
+    monkeypatch.setattr(page, '_current_key', lambda: stats.append(1))
+    for _ in range(100):
+        assert page.get()[2] == etag
+    assert not stats  # Served from memory: no stat calls within the interval
+
+
+def test_index_change_is_picked_up_after_the_interval(tmp_path):
+    page_path = tmp_path / 'index.html'
+    page_path.write_text('<html><body>one</body></html>')
+    page = server.IndexPage(str(page_path), mode='static', check_interval=0)
+    first = page.get()[2]
+    page_path.write_text('<html><body>two, longer</body></html>')
+    body, _, etag = page.get()
+    assert b'two' in body and etag != first
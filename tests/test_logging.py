@@ -0,0 +1,30 @@
+import json
+import logging
+import sys
+
+import pytest
+
+import server
+
+
+@pytest.mark.parametrize('phone', ['9876543', '98765432', '987654321', '9876543210', '+91 98765 43210'])
+def test_phone_numbers_the_form_accepts_are_redacted(phone):
+    redacted = server.redact(f"Booking from {phone} saved")
+    assert phone not in redacted
+    assert redacted.endswith(f"{phone[-2:]} saved")
+
+
+def test_short_numbers_are_left_alone():
+    assert server.redact("Flushed 50 row(s) in 123456 us") == "Flushed 50 row(s) in 123456 us"
+
+
+def test_exception_goes_to_exc_field_not_msg():
+    handler = server.LogQueueHandler(server._log_queue)
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        record = logging.getLogger('test').makeRecord(
+            'test', logging.ERROR, __file__, 1, "failed for %s", ('x@example.com',), sys.exc_info())
+    entry = json.loads(server.JsonLogFormatter().format(handler.prepare(record)))
+    assert entry['msg'] == "failed for x***@example.com"
+    assert 'Traceback' in entry['exc'] and 'ValueError: boom' in entry['exc']
@@ -0,0 +1,38 @@
+import fake_gspread
+import server
+
+
+def status_of(row_id):
+    return server.outbox._conn().execute("SELECT status FROM outbox WHERE row_id = ?", (row_id,)).fetchone()[0]
+
+
+def test_append_that_lands_then_fails_with_503_is_reconciled_not_resent(sheets, monkeypatch):
+    row_id = server.outbox.add('booking', ['15-06-2026', '10:00:00 AM', 'Five Oh Three', 'e503@example.com',
+                                           '9000000000', '', 'hello'])
+    worksheet = sheets.worksheet('2026')
+    original_append = fake_gspread.FakeWorksheet.append_rows
+
+    def append_then_fail(self, values, **kwargs):
+        original_append(self, values, **kwargs)
+        raise fake_gspread.api_error(503)
+
+    monkeypatch.setattr(fake_gspread.FakeWorksheet, 'append_rows', append_then_fail)
+    assert server.outbox_replayer.replay() == 0
+    assert status_of(row_id) == 'sending'
+
+    monkeypatch.setattr(fake_gspread.FakeWorksheet, 'append_rows', original_append)
+    server.outbox_replayer.replay()
+    assert status_of(row_id) == 'synced'
+    assert [row[-1] for row in worksheet.rows].count(row_id) == 1
+
+
+def test_append_rejected_with_429_is_requeued(sheets, monkeypatch):
+    row_id = server.outbox.add('booking', ['16-06-2026', '10:00:00 AM', 'Four Two Nine', 'e429@example.com',
+                                           '9000000000', '', 'hello'])
+
+    def reject(self, values, **kwargs):
+        raise fake_gspread.api_error(429)
+
+    monkeypatch.setattr(fake_gspread.FakeWorksheet, 'append_rows', reject)
+    assert server.outbox_replayer.replay() == 0
+    assert status_of(row_id) == 'pending'
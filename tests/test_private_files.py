@@ -0,0 +1,24 @@
+import os
+import time
+
+import pytest
+
+import server
+
+
+@pytest.fixture
+def stored_profile():
+    profile_id = f"{int(time.time() * 1000)}-{os.getpid()}-static-test"
+    server.profile_store.save({'id': profile_id, 'endpoint': 'index', 'path': '/', 'mode': 'sample', 'stacks': {}})
+    yield profile_id
+    os.remove(server.profile_store.path(profile_id))
+
+
+def test_stored_profile_is_not_served_as_a_static_file(client, stored_profile):
+    rel_dir = os.path.relpath(server.PROFILE_DIR, server.app.static_folder).replace(os.sep, '/')
+    assert client.get(f'/{rel_dir}/{stored_profile}.json').status_code == 404
+
+
+@pytest.mark.parametrize('path', ['/inquiries.csv', '/service-account.json'])
+def test_private_root_files_are_404(client, path):
+    assert client.get(path).status_code == 404
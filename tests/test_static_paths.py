@@ -0,0 +1,24 @@
+import pytest
+
+import server
+
+
+@pytest.mark.parametrize('path', [
+    '/css/..%2f..%2f..%2fetc%2fpasswd',
+    '/js/..%2fserver.py',
+    '/js/..%2fserver.0123456789ab.py',
+    '/assets/..%2f..%2fserver.py',
+    '/pg-photos/..%2fserver.py',
+    '/css/.',
+    '/js/./',
+    '/assets/.',
+])
+def test_paths_outside_or_not_files_are_404(client, path):
+    assert client.get(path).status_code == 404
+
+
+def test_assets_are_still_served(client):
+    assert client.get('/css/style.css').status_code == 200
+    hashed = client.get('/' + server.static_assets.hashed_url('css/style.css'))
+    assert hashed.status_code == 200
+    assert 'immutable' in hashed.headers['Cache-Control']